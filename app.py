@@ -6,8 +6,15 @@
 import gevent.monkey
 gevent.monkey.patch_all()
 
+import time
+_import_started = time.perf_counter()
+
+import atexit
+import hmac
+import logging
 import os
-from flask import Flask, request, abort
+import uuid
+from flask import Flask, Blueprint, Response, g, request, abort
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import MessageEvent, TextMessage, TextSendMessage
@@ -15,10 +22,31 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
 from apscheduler.triggers.date import DateTrigger
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, update, and_, or_, func
 from sqlalchemy.orm import relationship
-from database import engine, Base, SessionLocal as Session
+from database import engine, Base, SessionLocal as Session, ensure_columns, ensure_indexes, dialect_insert, lock_for_write
+from cache import TTLCache, MISSING
+from logging_setup import configure_logging, parse_level, request_id
+from metrics import REGISTRY, SnapshotWriter, collect, render_text
+from broadcast import Broadcaster
+from webhook_queue import EventDispatcher
+from credentials import CredentialIndex
+from bootstrap import run_once, fingerprint
+from trade_store import MemoryPendingTradeStore, SqlPendingTradeStore
+from card_catalog import CardCatalog
+from versions import StateVersions, state_versions as state_versions_table
+from http_cache import VersionedJsonCache
+from event_bus import EventBus
+from audience import AudienceIndex, parse_audience, is_placeholder, PLACEHOLDER_MARKER
+from scheduler_leader import LeaderLease, LeaderElection, BootstrappedJobStore, scheduler_leases, apscheduler_jobs
+from messaging import split_text, send_reply, PooledHttpClient
+from dedup import EventDeduplicator, event_key, processed_events
+from ratelimit import MemoryRateLimiter, SqlRateLimiter, ConcurrencyLimit, THROTTLED, rate_limit_buckets
+from commands import CommandRouter, CommandContext, UsageError, integer, upper
 
 # --- Configuration ---
 # Load environment variables from .env file
@@ -33,11 +61,45 @@ if not CHANNEL_ACCESS_TOKEN:
 if not CHANNEL_SECRET:
     raise ValueError("LINE_CHANNEL_SECRET environment variable not set.")
 
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
+# One keep-alive connection pool shared by every LINE API call
+LINE_HTTP_POOL_SIZE = int(os.getenv('LINE_HTTP_POOL_SIZE', '10'))
+def _line_http_client(timeout):
+    return PooledHttpClient(timeout=timeout, pool_maxsize=LINE_HTTP_POOL_SIZE)
+
+line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN, http_client=_line_http_client)
 handler = WebhookHandler(CHANNEL_SECRET)
 
+# Opt-in asynchronous webhook mode: /callback only verifies the signature and
+# queues the events, and a pool of greenlets runs handle_message afterwards.
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', '').lower() in ('1', 'true', 'yes')
+event_dispatcher = EventDispatcher(
+    handler,
+    workers=int(os.getenv('WEBHOOK_WORKERS', '8')),
+    maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+)
+
 app = Flask(__name__)
 
+# LOG_FORMAT=json (or text) sends all logs through a queue to a writer on its
+# own OS thread, tags them with the request's correlation id and keeps only
+# LOG_SAMPLE_RATE of the INFO/DEBUG lines. Unset keeps Flask's default logging.
+LOG_FORMAT = os.getenv('LOG_FORMAT', '').lower()
+log_listener = None
+if LOG_FORMAT in ('json', 'text'):
+    from flask.logging import default_handler
+    app.logger.removeHandler(default_handler)
+    log_listener = configure_logging(
+        LOG_FORMAT,
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        sample_rate=float(os.getenv('LOG_SAMPLE_RATE', '1')),
+    )
+    atexit.register(log_listener.stop)
+# Full webhook bodies are only logged at this level (DEBUG unless overridden)
+WEBHOOK_BODY_LOG_LEVEL = parse_level(os.getenv('WEBHOOK_BODY_LOG_LEVEL'), logging.DEBUG)
+
+# Times are stored in UTC and shown to players in Taiwan time
+TAIPEI_TZ = pytz.timezone('Asia/Taipei')
+
 # Directory containing password files
 PASSWORD_DIR = os.path.join(os.path.dirname(__file__), 'passwords')
 
@@ -63,6 +125,12 @@ class User(Base):
     admin_password = Column(String(50), nullable=True) # Storing passwords directly for simplicity, hash in real app
     cards = relationship('TeamCard', back_populates='team')
 
+    __table_args__ = (
+        # Back the password logins and the seeding lookups
+        Index('ix_users_role_team_password', 'role', 'team_password'),
+        Index('ix_users_role_admin_password', 'role', 'admin_password'),
+    )
+
 class Mission(Base):
     __tablename__ = 'missions'
     id = Column(Integer, primary_key=True)
@@ -80,12 +148,18 @@ class Announcement(Base):
     scheduled_time = Column(DateTime, nullable=True)
     sent = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    audience = Column(String(500), nullable=True)  # Selectors from audience.parse_audience; None is everyone
+
+    __table_args__ = (
+        # Startup re-hydration only looks at unsent announcements
+        Index('ix_announcements_sent_scheduled_time', 'sent', 'scheduled_time'),
+    )
 
 class Card(Base):
     __tablename__ = 'cards'
     id = Column(Integer, primary_key=True, index=True)
     card_number = Column(String, unique=True, index=True, nullable=False)
-    name_zh = Column(String, nullable=False)
+    name_zh = Column(String, nullable=False, index=True)
     name_en = Column(String, nullable=True)
 
 class TeamCard(Base):
@@ -98,72 +172,177 @@ class TeamCard(Base):
     team = relationship('User', back_populates='cards')
     card = relationship('Card')
 
+    __table_args__ = (
+        # One row per (team, card); bulk card changes upsert against it
+        Index('ux_team_cards_team_card', 'team_id', 'card_id', unique=True),
+    )
+
+class TeamStanding(Base):
+    # Running totals per team, kept up to date by the functions that complete
+    # missions or move cards so that rankings never have to aggregate.
+    __tablename__ = 'team_standings'
+    team_name = Column(String(50), primary_key=True)
+    missions_completed = Column(Integer, default=0, nullable=False)
+    cards_held = Column(Integer, default=0, nullable=False)
+    last_completion = Column(DateTime, nullable=True)
+
+class TradeRequest(Base):
+    # Same table as models.TradeRequest; only the columns the pending-trade
+    # handshake needs are mapped, and team/card references are carried in
+    # request_id (the serialized trade key) since teams live in `users` here.
+    __tablename__ = 'trade_requests'
+    id = Column(Integer, primary_key=True)
+    request_id = Column(String, unique=True, nullable=False)
+    requester_user_id = Column(String, nullable=False)
+    status = Column(String, default='pending', nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    confirmed_by_users = Column(String, default='', nullable=False)
+    card_a_quantity = Column(Integer, nullable=True)
+    card_b_quantity = Column(Integer, nullable=True)
+    action_type = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index('ix_trade_requests_status_created_at', 'status', 'created_at'),
+    )
+
 # --- Database Initialization ---
+# Tables that live on their own MetaData in the modules using them. They are
+# created (and fingerprinted) with the models, so only bootstrap runs DDL.
+SUPPORT_TABLES = (state_versions_table, processed_events, rate_limit_buckets, scheduler_leases, apscheduler_jobs)
+
 def init_db():
     print("Initializing database...")
     Base.metadata.create_all(engine)
+    for table in SUPPORT_TABLES:
+        table.create(bind=engine, checkfirst=True)
+    for column in ensure_columns(engine, Base.metadata):
+        print(f"Added column {column}")
+    merge_duplicate_team_cards()
+    ensure_indexes(engine, Base.metadata)
     print("Database initialized.")
 
+def merge_duplicate_team_cards():
+    """Fold repeated (team, card) rows into one so the unique index can be built."""
+    session = Session()
+    try:
+        duplicates = (session.query(TeamCard.team_id, TeamCard.card_id)
+                      .group_by(TeamCard.team_id, TeamCard.card_id)
+                      .having(func.count(TeamCard.id) > 1)
+                      .all())
+        for team_id, card_id in duplicates:
+            rows = session.query(TeamCard).filter_by(team_id=team_id, card_id=card_id).order_by(TeamCard.id).all()
+            rows[0].quantity = sum(row.quantity for row in rows)
+            for row in rows[1:]:
+                session.delete(row)
+        session.commit()
+        return len(duplicates)
+    finally:
+        session.close()
+
+# (role, password) -> team_name for every seeded account, used by the login
+# commands instead of querying the users table on each attempt.
+credential_index = CredentialIndex()
+
+def load_credential_index():
+    # Read the version first so accounts seeded meanwhile trigger another reload
+    version = state_versions.get('credentials')['credentials']
+    session = Session()
+    count = credential_index.load(session, User, version)
+    session.close()
+    return count
+
 def add_initial_data():
     print("Checking and adding initial data...")
-    session = Session()
 
     # Load passwords from external files
     gm_passwords = load_passwords('gm_passwords.txt')
     organizer_passwords = load_passwords('organizer_passwords.txt')
     team_passwords = load_passwords('team_passwords.txt')
 
-    # Add Game Master admin accounts
+    # One query for every existing credential instead of one per password line
+    load_credential_index()
+
+    rows = []
     for idx, pwd in enumerate(gm_passwords, start=1):
-        if not session.query(User).filter_by(role='admin', admin_password=pwd).first():
-            new_admin = User(
-                user_id=f'gm_placeholder_{idx}',
-                role='admin',
-                team_name='game_master',
-                admin_password=pwd
-            )
-            session.add(new_admin)
+        if ('admin', pwd) not in credential_index:
+            rows.append(dict(user_id=f'gm_placeholder_{idx}', role='admin', team_name='game_master', team_password=None, admin_password=pwd))
             print(f"Added Admin: game_master #{idx} with password '{pwd}'")
-
-    # Add Organizer admin accounts
     for idx, pwd in enumerate(organizer_passwords, start=1):
-        if not session.query(User).filter_by(role='admin', admin_password=pwd).first():
-            new_admin = User(
-                user_id=f'organizer_placeholder_{idx}',
-                role='admin',
-                team_name='organizer',
-                admin_password=pwd
-            )
-            session.add(new_admin)
+        if ('admin', pwd) not in credential_index:
+            rows.append(dict(user_id=f'organizer_placeholder_{idx}', role='admin', team_name='organizer', team_password=None, admin_password=pwd))
             print(f"Added Admin: organizer #{idx} with password '{pwd}'")
-
-    # Add Team placeholders
     for idx, pwd in enumerate(team_passwords, start=1):
-        if not session.query(User).filter_by(role='team', team_password=pwd).first():
-            new_team = User(
-                user_id=f'team_placeholder_{idx}',
-                role='team',
-                team_name=f'隊伍-{idx}',
-                team_password=pwd
-            )
-            session.add(new_team)
+        if ('team', pwd) not in credential_index:
+            rows.append(dict(user_id=f'team_placeholder_{idx}', role='team', team_name=f'隊伍-{idx}', team_password=pwd, admin_password=None))
             print(f"Added Team: 隊伍-{idx} with password '{pwd}'")
 
-    session.commit()
-    session.close()
+    if rows:
+        # Single bulk insert; placeholders that already exist are left alone
+        stmt = dialect_insert(engine, User.__table__)
+        if hasattr(stmt, 'on_conflict_do_nothing'):
+            stmt = stmt.on_conflict_do_nothing(index_elements=['user_id'])
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+        session = Session()
+        state_versions.bump(session, 'credentials')
+        session.commit()
+        session.close()
+        load_credential_index()
     print("Initial data check and addition complete.")
 
-# Ensure the database and initial accounts are ready when the module is imported
-init_db()
-add_initial_data()
+def bootstrap():
+    """Create the schema and seed accounts once per deployment, then load
+    the per-process credential index.
+
+    Every gunicorn worker imports this module, but only the first one to claim
+    the bootstrap_state marker row runs init_db()/add_initial_data(); the rest
+    wait for it and skip straight to loading their in-memory state.
+    """
+    password_files = [os.path.join(PASSWORD_DIR, name) for name in
+                      ('gm_passwords.txt', 'organizer_passwords.txt', 'team_passwords.txt')]
+    deploy_id = os.getenv('DEPLOY_ID') or os.getenv('RENDER_GIT_COMMIT')
+    ran = run_once(engine, 'schema_and_seed',
+                   fingerprint(Base.metadata, password_files, deploy_id, tables=SUPPORT_TABLES),
+                   [init_db, add_initial_data, rebuild_standings])
+    if not credential_index.loaded:
+        load_credential_index()
+    warm_card_catalog()
+    return ran
 
 # --- Helper Functions ---
+# Per-process cache of detached User rows keyed by LINE user_id. Every webhook
+# message starts with get_user(), so caching it removes one query per message.
+# Misses (unknown users) are cached too; entries are dropped whenever
+# create_or_update_user() changes a row in this worker. A row only changes
+# when a guest logs in, so team and admin entries are served for up to
+# USER_CACHE_TTL seconds as they are, while unknown and guest entries are
+# checked against the 'users' state version: a login on another worker is
+# seen on the very next message.
+user_cache = TTLCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', '2048')),
+    ttl=float(os.getenv('USER_CACHE_TTL', '30')),
+    name='user',
+)
+
 def get_user(user_id):
+    cached = user_cache.get(user_id)
+    if cached is not MISSING:
+        user, version = cached
+        if user is not None and user.role != 'guest':
+            return user
+        if version == state_versions.get('users')['users']:
+            return user
+    # Read the version before the row so a login in between is not missed
+    version = state_versions.get('users')['users']
     session = Session()
     user = session.query(User).filter_by(user_id=user_id).first()
     session.close()
+    user_cache.set(user_id, (user, version))
     return user
 
+def invalidate_user(user_id):
+    user_cache.invalidate(user_id)
+
 def create_or_update_user(user_id, role='guest', team_name=None, team_password=None, admin_password=None):
     session = Session()
     user = session.query(User).filter_by(user_id=user_id).first()
@@ -180,22 +359,261 @@ def create_or_update_user(user_id, role='guest', team_name=None, team_password=N
                     team_password=team_password, admin_password=admin_password,
                     last_active=datetime.utcnow())
         session.add(user)
+    if role == 'team':
+        # Make the team show up in the standings as soon as someone joins it
+        bump_standing(session, team_name)
+        state_versions.bump(session, 'teams')
+    state_versions.bump(session, 'users')
     session.commit()
     session.close()
+    invalidate_user(user_id)
+    if role == 'team':
+        invalidate_standings()
     return user
 
+# Accounts are only created by seeding, which bumps the 'credentials' version.
+# A miss is final unless that version moved since the index was loaded; it is
+# checked at most once per CREDENTIAL_RECHECK_INTERVAL seconds, so guessed
+# passwords cost no query.
+CREDENTIAL_RECHECK_INTERVAL = float(os.getenv('CREDENTIAL_RECHECK_INTERVAL', '30'))
+_credentials_checked_at = None
+
+def find_credential(role, password):
+    """Return the team_name registered for a login password, or None."""
+    global _credentials_checked_at
+    team_name = credential_index.lookup(role, password)
+    if team_name is not None:
+        return team_name
+    now = time.monotonic()
+    if _credentials_checked_at is not None and now - _credentials_checked_at < CREDENTIAL_RECHECK_INTERVAL:
+        return None
+    _credentials_checked_at = now
+    if state_versions.get('credentials')['credentials'] == credential_index.version:
+        return None
+    load_credential_index()
+    return credential_index.lookup(role, password)
+
 def get_mission_by_code(mission_code):
     session = Session()
     mission = session.query(Mission).filter_by(mission_code=mission_code).first()
     session.close()
     return mission
 
+def complete_mission(mission_code, team_name):
+    """Mark a mission as completed by `team_name` unless another team got there first.
+
+    The check and the write are one conditional UPDATE, so when several teams
+    submit the same code at once exactly one of them wins. Returns
+    (won, mission_name, completed_by_team); mission_name is None for an
+    unknown code.
+    """
+    session = Session()
+    try:
+        now = datetime.utcnow()
+        stmt = (update(Mission)
+                .where(Mission.mission_code == mission_code,
+                       or_(Mission.is_completed.is_(False), Mission.is_completed.is_(None)))
+                .values(is_completed=True, completion_time=now, completed_by_team=team_name))
+        if engine.dialect.update_returning:
+            row = session.execute(stmt.returning(Mission.name)).first()
+            won = row is not None
+        else:
+            won = session.execute(stmt).rowcount == 1
+            row = None
+        if won:
+            bump_standing(session, team_name, missions=1, completed_at=now)
+            state_versions.bump(session, 'missions')
+        session.commit()
+        if won:
+            invalidate_standings()
+            event_bus.publish('mission_completed', code=mission_code, team=team_name)
+        if won and row is not None:
+            return True, row.name, team_name
+        mission = session.query(Mission.name, Mission.completed_by_team).filter_by(mission_code=mission_code).first()
+        if mission is None:
+            return False, None, None
+        return won, mission.name, mission.completed_by_team
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def get_first_finisher_leaderboard():
+    """Teams ranked by missions they finished first, then by who got there earlier."""
+    session = Session()
+    rows = (session.query(Mission.completed_by_team,
+                          func.count(Mission.id).label('completed'),
+                          func.max(Mission.completion_time).label('last_completion'))
+            .filter(Mission.is_completed.is_(True), Mission.completed_by_team.isnot(None))
+            .group_by(Mission.completed_by_team)
+            .order_by(func.count(Mission.id).desc(), func.max(Mission.completion_time))
+            .all())
+    session.close()
+    return rows
+
+def render_first_finisher_leaderboard():
+    def build():
+        rows = get_first_finisher_leaderboard()
+        if not rows:
+            return "目前還沒有隊伍完成任務。"
+        lines = ["任務排行榜 (最先完成)："]
+        for rank, row in enumerate(rows, start=1):
+            lines.append(f"{rank}. {row.completed_by_team}：{row.completed} 個任務")
+        return "\n".join(lines)
+    return cached_by_version(mission_board_cache, 'leaderboard', ('missions',), build)
+
+# Version counters for the read-only API: every write bumps the resource it
+# changed ('teams', 'missions', 'inventory', 'announcements') in its own
+# transaction, and the API uses them as ETags and cache keys.
+state_versions = StateVersions(engine)
+
+def cached_by_version(cache, key, resources, build):
+    """Return cache[key] while `resources` are at the versions it was built at.
+
+    Costs one primary-key lookup, so a change made by another worker is seen
+    at once instead of after the cache's TTL; local invalidation still frees
+    entries early.
+    """
+    # Read the versions before building so a concurrent change is not missed
+    version = tuple(state_versions.get(*resources).values())
+    entry = cache.get(key)
+    if entry is not MISSING and entry[0] == version:
+        return entry[1]
+    value = build()
+    cache.set(key, (version, value))
+    return value
+
+# Live game events for /events. Writers publish after their commit; the bus
+# is per process, so a stream only sees changes made by its own worker.
+event_bus = EventBus(history=int(os.getenv('EVENT_HISTORY', '256')))
+
+# Team standings: team_standings holds each team's running totals, changed by
+# one upsert inside the same transaction as the mission or card change. The
+# sorted list is cached per process and checked against the missions,
+# inventory and teams versions, so other workers' changes are seen at once.
+standings_cache = TTLCache(maxsize=4, ttl=float(os.getenv('STANDINGS_CACHE_TTL', '5')), name='standings')
+
+def bump_standing(session, team_name, missions=0, cards=0, completed_at=None):
+    """Adjust one team's totals inside the caller's transaction."""
+    if not team_name:
+        return
+    table = TeamStanding.__table__
+    values = dict(team_name=team_name, missions_completed=missions, cards_held=cards, last_completion=completed_at)
+    stmt = dialect_insert(session.get_bind(), table)
+    if hasattr(stmt, 'on_conflict_do_update'):
+        session.execute(stmt.values(**values).on_conflict_do_update(
+            index_elements=['team_name'],
+            set_={'missions_completed': table.c.missions_completed + stmt.excluded.missions_completed,
+                  'cards_held': table.c.cards_held + stmt.excluded.cards_held,
+                  'last_completion': func.coalesce(stmt.excluded.last_completion, table.c.last_completion)}))
+        return
+    updated = session.execute(
+        update(table).where(table.c.team_name == team_name)
+        .values(missions_completed=table.c.missions_completed + missions,
+                cards_held=table.c.cards_held + cards,
+                last_completion=func.coalesce(completed_at, table.c.last_completion)))
+    if updated.rowcount == 0:
+        session.execute(table.insert().values(**values))
+
+def rebuild_standings():
+    """Recompute every team's totals from missions and team_cards (bootstrap step)."""
+    session = Session()
+    try:
+        totals = {}
+        for (team_name,) in (session.query(User.team_name).distinct()
+                             .filter(User.role == 'team', User.team_name.isnot(None),
+                                     ~User.user_id.contains(PLACEHOLDER_MARKER, autoescape=True))):
+            totals[team_name] = dict(team_name=team_name, missions_completed=0, cards_held=0, last_completion=None)
+        for team_name, completed, last_completion in (
+                session.query(Mission.completed_by_team, func.count(Mission.id), func.max(Mission.completion_time))
+                .filter(Mission.is_completed.is_(True), Mission.completed_by_team.isnot(None))
+                .group_by(Mission.completed_by_team)):
+            totals.setdefault(team_name, dict(team_name=team_name, cards_held=0))
+            totals[team_name].update(missions_completed=completed, last_completion=last_completion)
+        for team_name, held in (session.query(User.team_name, func.sum(TeamCard.quantity))
+                                .join(TeamCard, TeamCard.team_id == User.id)
+                                .filter(User.team_name.isnot(None))
+                                .group_by(User.team_name)):
+            totals.setdefault(team_name, dict(team_name=team_name, missions_completed=0, last_completion=None))
+            totals[team_name]['cards_held'] = int(held or 0)
+        session.query(TeamStanding).delete(synchronize_session=False)
+        if totals:
+            session.execute(TeamStanding.__table__.insert(), list(totals.values()))
+        state_versions.bump(session, 'teams')
+        session.commit()
+    finally:
+        session.close()
+    invalidate_standings()
+    return len(totals)
+
+STANDINGS_RESOURCES = ('missions', 'inventory', 'teams')
+
+def get_standings():
+    """Teams ranked by missions completed (earlier last completion breaks ties), then cards held."""
+    def build():
+        session = Session()
+        rows = (session.query(TeamStanding)
+                .order_by(TeamStanding.missions_completed.desc(),
+                          TeamStanding.last_completion.is_(None),
+                          TeamStanding.last_completion,
+                          TeamStanding.cards_held.desc(),
+                          TeamStanding.team_name)
+                .all())
+        session.close()
+        return [
+            {'rank': rank, 'team': row.team_name, 'missions_completed': row.missions_completed,
+             'cards_held': row.cards_held,
+             'last_completion': row.last_completion.isoformat() + 'Z' if row.last_completion else None}
+            for rank, row in enumerate(rows, start=1)
+        ]
+    return cached_by_version(standings_cache, 'standings', STANDINGS_RESOURCES, build)
+
+def render_standings():
+    standings = get_standings()
+    if not standings:
+        return "目前還沒有隊伍排名。"
+    lines = ["隊伍排行榜："]
+    for entry in standings:
+        lines.append(f"{entry['rank']}. {entry['team']}：任務 {entry['missions_completed']} 個，卡牌 {entry['cards_held']} 張")
+    return "\n".join(lines)
+
+def invalidate_standings():
+    standings_cache.clear()
+
 def get_all_missions():
     session = Session()
     missions = session.query(Mission).all()
     session.close()
     return missions
 
+# Rendered mission boards keyed by header (plus the first-finisher
+# leaderboard under 'leaderboard'). Both mission-list commands are
+# polled constantly, so the text is only rebuilt after a mission is added,
+# completed or reset: each entry is checked against the 'missions' version,
+# which catches changes made on other workers too.
+mission_board_cache = TTLCache(maxsize=8, ttl=float(os.getenv('MISSION_BOARD_TTL', '30')), name='mission_board')
+
+def render_mission_board(missions, header):
+    lines = [header]
+    for m in missions:
+        status = "✅ 已完成" if m.is_completed else "⏳ 未完成"
+        lines.append(f"代碼：{m.mission_code}, 名稱：{m.name}, 狀態：{status}")
+        if m.is_completed:
+            completion_time_local = pytz.utc.localize(m.completion_time).astimezone(TAIPEI_TZ)
+            lines.append(f"  完成時間：{completion_time_local.strftime('%Y-%m-%d %H:%M')}, 完成隊伍：{m.completed_by_team}")
+    return "\n".join(lines)
+
+def get_mission_board(header):
+    """Return the mission list as message-sized chunks, or [] if there are no missions."""
+    def build():
+        missions = get_all_missions()
+        return split_text(render_mission_board(missions, header)) if missions else []
+    return cached_by_version(mission_board_cache, header, ('missions',), build)
+
+def invalidate_mission_board():
+    mission_board_cache.clear()
+
 def get_all_teams():
     session = Session()
     teams = session.query(User).filter_by(role='team').all()
@@ -208,41 +626,146 @@ def get_all_admins():
     session.close()
     return admins
 
+# name_zh / card_number -> CardEntry for every card, so resolving a card name
+# normally costs no query at all.
+card_catalog = CardCatalog(Card)
+card_catalog.attach(Session)
+
+def warm_card_catalog():
+    session = Session()
+    count = card_catalog.warm(session)
+    session.close()
+    return count
+
 def find_or_create_card(session, name):
-    card = session.query(Card).filter_by(name_zh=name).first()
-    if not card:
-        card = Card(card_number=name, name_zh=name)
-        session.add(card)
+    """Resolve a card by name, creating it (flushed, not committed) if needed."""
+    return card_catalog.resolve(session, name)
+
+def upsert_team_cards(session, deltas):
+    """Add {(team_id, card_id): quantity delta} to team_cards in one upsert.
+
+    Goes through the unique (team_id, card_id) index, so a concurrent writer
+    creating the same row cannot make it fail; rows brought down to zero are
+    deleted. The caller checks that removals are covered.
+    """
+    table = TeamCard.__table__
+    rows = [dict(team_id=team_id, card_id=card_id, quantity=delta)
+            for (team_id, card_id), delta in deltas.items() if delta]
+    if not rows:
+        return
+    stmt = dialect_insert(session.get_bind(), table)
+    if hasattr(stmt, 'on_conflict_do_update'):
+        session.execute(stmt.values(rows).on_conflict_do_update(
+            index_elements=['team_id', 'card_id'],
+            set_={'quantity': table.c.quantity + stmt.excluded.quantity}))
+    else:
+        for row in rows:
+            updated = session.execute(
+                update(table)
+                .where(table.c.team_id == row['team_id'], table.c.card_id == row['card_id'])
+                .values(quantity=table.c.quantity + row['quantity']))
+            if updated.rowcount == 0:
+                session.execute(table.insert().values(row))
+    removed = [and_(table.c.team_id == row['team_id'], table.c.card_id == row['card_id'])
+               for row in rows if row['quantity'] < 0]
+    if removed:
+        session.execute(table.delete().where(or_(*removed), table.c.quantity <= 0))
+
+def apply_card_changes(session, team, changes):
+    """Add (positive) or remove (negative) several cards for one team at once.
+
+    `team` is the team's User row (not its id); `changes` maps card name ->
+    quantity delta. All holdings are upserted with
+    a single INSERT ... ON CONFLICT DO UPDATE and committed once; if any
+    removal cannot be covered nothing is changed. Returns (success, message).
+    """
+    team_id = team.id
+    try:
+        lock_for_write(session)
+        deltas = {}
+        for name, delta in changes.items():
+            if delta == 0:
+                continue
+            card = card_catalog.resolve(session, name, create=delta > 0)
+            if card is None:
+                session.rollback()
+                return False, f"找不到卡牌：{name}"
+            deltas[card.id] = deltas.get(card.id, 0) + delta
+        if not deltas:
+            session.rollback()
+            return True, None
+
+        removals = {card_id: -delta for card_id, delta in deltas.items() if delta < 0}
+        if removals:
+            held = dict(session.query(TeamCard.card_id, TeamCard.quantity)
+                        .filter(TeamCard.team_id == team_id, TeamCard.card_id.in_(removals))
+                        .with_for_update())
+            if any(held.get(card_id, 0) < qty for card_id, qty in removals.items()):
+                session.rollback()
+                return False, "卡牌數量不足或不存在。"
+
+        upsert_team_cards(session, {(team_id, card_id): delta for card_id, delta in deltas.items()})
+        bump_standing(session, team.team_name, cards=sum(deltas.values()))
+        state_versions.bump(session, 'inventory')
         session.commit()
-    return card
+    except Exception:
+        session.rollback()
+        raise
+    invalidate_inventory(team_id)
+    invalidate_standings()
+    event_bus.publish('inventory', team=team.team_name,
+                      changes={name: delta for name, delta in changes.items() if delta})
+    return True, None
 
 def add_card_to_team(session, user, card_name, quantity):
-    card = find_or_create_card(session, card_name)
-    team_card = session.query(TeamCard).filter_by(team_id=user.id, card_id=card.id).first()
-    if team_card:
-        team_card.quantity += quantity
-    else:
-        team_card = TeamCard(team_id=user.id, card_id=card.id, quantity=quantity)
-        session.add(team_card)
-    session.commit()
+    return apply_card_changes(session, user, {card_name: quantity})
 
 def remove_card_from_team(session, user, card_name, quantity):
-    card = session.query(Card).filter_by(name_zh=card_name).first()
-    if not card:
-        return False, f"找不到卡牌：{card_name}"
-    team_card = session.query(TeamCard).filter_by(team_id=user.id, card_id=card.id).first()
-    if not team_card or team_card.quantity < quantity:
-        return False, "卡牌數量不足或不存在。"
-    team_card.quantity -= quantity
-    if team_card.quantity == 0:
-        session.delete(team_card)
-    session.commit()
-    return True, None
-
-# Pending trade requests stored in memory. Key is a normalized tuple
-# representing the teams and cards involved. Value stores a timestamp and
-# the user_ids that have confirmed the trade.
-pending_trades = {}
+    return apply_card_changes(session, user, {card_name: -quantity})
+
+# Pending trade requests. Both teams must send the same 交換卡牌 command within
+# PENDING_TRADE_TTL seconds. The default SQL store keeps them in trade_requests
+# so the two confirmations may land on different gunicorn workers; 'memory'
+# is only suitable for a single worker.
+PENDING_TRADE_TTL = timedelta(seconds=int(os.getenv('PENDING_TRADE_TTL', '60')))
+if os.getenv('PENDING_TRADE_STORE', 'sql').lower() == 'memory':
+    pending_trade_store = MemoryPendingTradeStore(ttl=PENDING_TRADE_TTL)
+else:
+    pending_trade_store = SqlPendingTradeStore(Session, TradeRequest, ttl=PENDING_TRADE_TTL)
+
+# LINE redelivers a webhook event when /callback is slow to answer; events
+# already handled within EVENT_DEDUP_TTL seconds are skipped. Set
+# EVENT_DEDUP_STORE=sql to also share the seen-set between workers.
+EVENT_DEDUP_TTL = float(os.getenv('EVENT_DEDUP_TTL', '600'))
+event_deduplicator = EventDeduplicator(
+    ttl=EVENT_DEDUP_TTL,
+    engine=engine if os.getenv('EVENT_DEDUP_STORE', 'memory').lower() == 'sql' else None,
+)
+
+# Flood protection in front of handle_message: a token bucket per LINE user
+# (RATE_LIMIT_RATE messages per second, bursts of RATE_LIMIT_BURST; a rate of
+# 0 disables it) and a cap on messages handled at once. 'sql' shares the
+# buckets between workers; 'memory' limits each worker separately.
+RATE_LIMIT_RATE = float(os.getenv('RATE_LIMIT_RATE', '1'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '10'))
+if RATE_LIMIT_RATE <= 0:
+    rate_limiter = None
+elif os.getenv('RATE_LIMIT_BACKEND', 'memory').lower() == 'sql':
+    rate_limiter = SqlRateLimiter(engine, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST)
+else:
+    rate_limiter = MemoryRateLimiter(rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST)
+handler_limit = ConcurrencyLimit(int(os.getenv('MAX_CONCURRENT_HANDLERS', '50')))
+# A throttled user is told once per interval; further messages are dropped silently
+throttle_notices = TTLCache(maxsize=10000, ttl=float(os.getenv('RATE_LIMIT_NOTICE_INTERVAL', '30')))
+
+THROTTLED_REPLY = "訊息太頻繁，請稍後再試。"
+BUSY_REPLY = "系統忙碌中，請稍後再試。"
+
+def shed_message(reply_token, user_id, reason):
+    THROTTLED.inc(reason=reason)
+    if throttle_notices.get(user_id) is MISSING:
+        throttle_notices.set(user_id, True)
+        send_reply(line_bot_api, reply_token, THROTTLED_REPLY if reason == 'user' else BUSY_REPLY)
 
 def _normalize_trade(team_a, card_a, qty_a, team_b, card_b, qty_b):
     """Return a canonical representation of a trade so A<->B and B<->A match."""
@@ -251,85 +774,186 @@ def _normalize_trade(team_a, card_a, qty_a, team_b, card_b, qty_b):
     return (team_b, card_b, qty_b, team_a, card_a, qty_a)
 
 def execute_trade(team_a, card_a, qty_a, team_b, card_b, qty_b):
-    """Transfer cards between two teams if both have sufficient quantity."""
+    """Transfer cards between two teams if both have sufficient quantity.
+
+    Cards come from the catalog; both teams and all four TeamCard rows
+    involved are read in two batched, row-locking queries and the whole swap
+    is committed exactly once.
+    """
     session = Session()
     try:
-        team_a_user = session.query(User).filter_by(team_name=team_a, role='team').first()
-        team_b_user = session.query(User).filter_by(team_name=team_b, role='team').first()
+        lock_for_write(session)
+
+        # Lock the team rows in id order so concurrent trades cannot deadlock
+        teams = {}
+        for team in (session.query(User)
+                     .filter(User.role == 'team', User.team_name.in_({team_a, team_b}))
+                     .order_by(User.id).with_for_update()):
+            teams.setdefault(team.team_name, team)
+        team_a_user = teams.get(team_a)
+        team_b_user = teams.get(team_b)
         if not team_a_user or not team_b_user:
             return False, "找不到指定隊伍。"
 
-        card_a_obj = find_or_create_card(session, card_a)
-        card_b_obj = find_or_create_card(session, card_b)
-
-        tc_a = session.query(TeamCard).filter_by(team_id=team_a_user.id, card_id=card_a_obj.id).first()
-        tc_b = session.query(TeamCard).filter_by(team_id=team_b_user.id, card_id=card_b_obj.id).first()
-
+        # A card nobody has seen yet cannot be held by either team, so there is
+        # no need to create it here.
+        card_a_entry = card_catalog.resolve(session, card_a, create=False)
+        card_b_entry = card_catalog.resolve(session, card_b, create=False)
+        if card_a_entry is None:
+            return False, f"{team_a} 的 {card_a} 數量不足。"
+        if card_b_entry is None:
+            return False, f"{team_b} 的 {card_b} 數量不足。"
+        card_a_id = card_a_entry.id
+        card_b_id = card_b_entry.id
+
+        holdings = {
+            (tc.team_id, tc.card_id): tc
+            for tc in (session.query(TeamCard)
+                       .filter(TeamCard.team_id.in_({team_a_user.id, team_b_user.id}),
+                               TeamCard.card_id.in_({card_a_id, card_b_id}))
+                       .order_by(TeamCard.id).with_for_update())
+        }
+
+        tc_a = holdings.get((team_a_user.id, card_a_id))
+        tc_b = holdings.get((team_b_user.id, card_b_id))
         if not tc_a or tc_a.quantity < qty_a:
             return False, f"{team_a} 的 {card_a} 數量不足。"
         if not tc_b or tc_b.quantity < qty_b:
             return False, f"{team_b} 的 {card_b} 數量不足。"
 
-        # Deduct cards from each team
-        tc_a.quantity -= qty_a
-        if tc_a.quantity == 0:
-            session.delete(tc_a)
-        tc_b.quantity -= qty_b
-        if tc_b.quantity == 0:
-            session.delete(tc_b)
-
-        # Add cards to opposite teams
-        tc_a_receive = session.query(TeamCard).filter_by(team_id=team_a_user.id, card_id=card_b_obj.id).first()
-        if tc_a_receive:
-            tc_a_receive.quantity += qty_b
-        else:
-            tc_a_receive = TeamCard(team_id=team_a_user.id, card_id=card_b_obj.id, quantity=qty_b)
-            session.add(tc_a_receive)
-
-        tc_b_receive = session.query(TeamCard).filter_by(team_id=team_b_user.id, card_id=card_a_obj.id).first()
-        if tc_b_receive:
-            tc_b_receive.quantity += qty_a
-        else:
-            tc_b_receive = TeamCard(team_id=team_b_user.id, card_id=card_a_obj.id, quantity=qty_a)
-            session.add(tc_b_receive)
+        # Net change per (team, card); the same row can appear on both sides
+        # when a team trades with itself or swaps a card for the same card.
+        deltas = {}
+        for key, delta in (((team_a_user.id, card_a_id), -qty_a),
+                           ((team_b_user.id, card_b_id), -qty_b),
+                           ((team_a_user.id, card_b_id), qty_b),
+                           ((team_b_user.id, card_a_id), qty_a)):
+            deltas[key] = deltas.get(key, 0) + delta
+
+        upsert_team_cards(session, deltas)
+        if team_a_user.team_name != team_b_user.team_name:
+            bump_standing(session, team_a_user.team_name, cards=qty_b - qty_a)
+            bump_standing(session, team_b_user.team_name, cards=qty_a - qty_b)
+        state_versions.bump(session, 'inventory')
 
         session.commit()
+        invalidate_inventory(team_a_user.id, team_b_user.id)
+        invalidate_standings()
+        event_bus.publish('trade', team_a=team_a, card_a=card_a, qty_a=qty_a,
+                          team_b=team_b, card_b=card_b, qty_b=qty_b)
         return True, None
-    except Exception as e:
+    except Exception:
         session.rollback()
-        return False, str(e)
+        app.logger.exception(f"Trade {team_a} {card_a} x{qty_a} <-> {team_b} {card_b} x{qty_b} failed")
+        return False, "系統錯誤，請稍後再試。"
     finally:
         session.close()
 
 
-def list_team_cards(session, user):
-    return session.query(TeamCard).filter_by(team_id=user.id).all()
+# Per-team inventory cache: team (users.id) -> [(card name, quantity), ...].
+# 查看卡牌 is the most viewed screen during trading rounds; entries are dropped
+# by every function that changes a team's cards and are checked against the
+# 'inventory' version, so a trade confirmed on another worker shows up at once.
+inventory_cache = TTLCache(
+    maxsize=int(os.getenv('INVENTORY_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('INVENTORY_CACHE_TTL', '10')),
+    name='inventory',
+)
+
+def get_team_inventory(team_id):
+    def build():
+        session = Session()
+        rows = (session.query(Card.name_zh, TeamCard.quantity)
+                .join(Card, Card.id == TeamCard.card_id)
+                .filter(TeamCard.team_id == team_id)
+                .order_by(Card.name_zh)
+                .all())
+        session.close()
+        return [(name, quantity) for name, quantity in rows]
+    return cached_by_version(inventory_cache, team_id, ('inventory',), build)
+
+def invalidate_inventory(*team_ids):
+    for team_id in team_ids:
+        inventory_cache.invalidate(team_id)
 
 
 # --- Scheduler for Announcements ---
-scheduler = BackgroundScheduler(daemon=True)
+# Announcement jobs live in a SQLAlchemy job store on the application database
+# so they survive restarts. Every worker can add/remove jobs there, but only
+# the worker holding the 'announcements' lease runs the scheduler; the others
+# keep theirs paused. An in-memory database cannot be shared between workers
+# (or threads), so it keeps the announcement jobs in memory instead.
+ANNOUNCEMENT_JOBSTORE = 'announcements'
+SCHEDULER_PERSISTENT = (os.getenv('SCHEDULER_JOBSTORE', 'sql').lower() == 'sql'
+                        and engine.url.database not in (None, '', ':memory:'))
+SCHEDULER_LEASE_TTL = float(os.getenv('SCHEDULER_LEASE_TTL', '30'))
+
+scheduler = BackgroundScheduler(daemon=True, jobstores={
+    'default': MemoryJobStore(),
+    ANNOUNCEMENT_JOBSTORE: BootstrappedJobStore(engine) if SCHEDULER_PERSISTENT else MemoryJobStore(),
+})
+scheduler_election = None
+
+SCHEDULER_JOB_LAG = REGISTRY.histogram(
+    'scheduler_job_lag_seconds', 'Delay between when a job was due and when it was submitted', labelnames=('job',))
+SCHEDULER_JOBS = REGISTRY.counter(
+    'scheduler_jobs_total', 'Scheduler job runs by outcome', labelnames=('job', 'outcome'))
+_JOB_OUTCOMES = {EVENT_JOB_EXECUTED: 'ok', EVENT_JOB_ERROR: 'error', EVENT_JOB_MISSED: 'missed'}
+
+def _record_job_event(event):
+    # One label for all announcement jobs rather than one per announcement id
+    job = 'announcement' if event.jobstore == ANNOUNCEMENT_JOBSTORE else event.job_id
+    if event.code == EVENT_JOB_SUBMITTED:
+        lag = datetime.now(pytz.utc) - event.scheduled_run_times[0]
+        SCHEDULER_JOB_LAG.observe(max(lag.total_seconds(), 0.0), job=job)
+    else:
+        SCHEDULER_JOBS.inc(job=job, outcome=_JOB_OUTCOMES[event.code])
+
+scheduler.add_listener(_record_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+# Broadcast announcements go out as batched multicast calls on a small pool
+# instead of one push_message per user. The broadcaster has its own client so
+# its X-Line-Retry-Key header never leaks into replies and pushes.
+broadcaster = Broadcaster(
+    LineBotApi(CHANNEL_ACCESS_TOKEN, http_client=_line_http_client),
+    pool_size=int(os.getenv('BROADCAST_POOL_SIZE', '4')),
+    max_retries=int(os.getenv('BROADCAST_MAX_RETRIES', '3')),
+)
+
+# Recipients of targeted announcements (everyone, a role, a team or an admin
+# group) precomputed from the users table without the placeholder accounts.
+# It is rebuilt when the 'users' version moves, so a player who logged in on
+# another worker is not missed.
+audience_index = AudienceIndex()
+
+def resolve_audience(audience=None):
+    version = state_versions.get('users')['users']
+    if audience_index.version != version:
+        session = Session()
+        try:
+            audience_index.load(session, User, version)
+        finally:
+            session.close()
+    return audience_index.resolve(audience)
 
 def send_announcement(announcement_id, user_id=None):
     session = Session()
     announcement = session.query(Announcement).filter_by(id=announcement_id).first()
     if announcement and not announcement.sent:
         try:
-            # Send to all users if user_id is not specified (broadcast)
+            message = TextSendMessage(text=f"📢 公告：\n{announcement.message}")
+            # Send to the announcement's audience if user_id is not specified (broadcast)
             if user_id is None:
-                users = session.query(User).all()
-                for user in users:
-                    try:
-                        line_bot_api.push_message(user.user_id, TextSendMessage(text=f"📢 公告：\n{announcement.message}"))
-                    except LineBotApiError as e:
-                        app.logger.error(f"Failed to send announcement to user {user.user_id}: {e}")
-                        if e.status_code == 401:
-                            app.logger.error("Authentication failed. Check LINE_CHANNEL_ACCESS_TOKEN.")
-                    except Exception as e:
-                        app.logger.error(f"Failed to send announcement to user {user.user_id}: {e}")
+                user_ids = resolve_audience(announcement.audience)
+                report = broadcaster.send(user_ids, message)
+                if report.failed:
+                    app.logger.error(f"Announcement ID {announcement_id} failed for {report.failed} of {report.recipients} users.")
+            elif is_placeholder(user_id):
+                app.logger.warning(f"Not sending announcement ID {announcement_id} to placeholder account {user_id}.")
             else:
                 # Send to a specific user
                  try:
-                    line_bot_api.push_message(user_id, TextSendMessage(text=f"📢 公告：\n{announcement.message}"))
+                    line_bot_api.push_message(user_id, message)
                  except LineBotApiError as e:
                     app.logger.error(f"Failed to send announcement to user {user_id}: {e}")
                     if e.status_code == 401:
@@ -338,34 +962,31 @@ def send_announcement(announcement_id, user_id=None):
                     app.logger.error(f"Failed to send announcement to user {user_id}: {e}")
 
             announcement.sent = True
+            text = announcement.message
+            state_versions.bump(session, 'announcements')
             session.commit()
+            event_bus.publish('announcement', id=announcement_id, message=text, audience=announcement.audience)
             app.logger.info(f"Announcement '{announcement.message}' sent successfully.")
         except Exception as e:
             app.logger.error(f"Error sending announcement ID {announcement_id}: {e}")
             session.rollback()
     session.close()
 
-def schedule_announcement(message, scheduled_time_str):
+def schedule_announcement(message, scheduled_time_str, audience=None):
     session = Session()
     try:
         # Assuming scheduled_time_str is in 'YYYY-MM-DD HH:MM' format and local timezone (Taiwan)
-        taiwan_tz = pytz.timezone('Asia/Taipei')
-        scheduled_time = taiwan_tz.localize(datetime.strptime(scheduled_time_str, '%Y-%m-%d %H:%M'))
+        scheduled_time = TAIPEI_TZ.localize(datetime.strptime(scheduled_time_str, '%Y-%m-%d %H:%M'))
         # Convert to UTC for APScheduler
         scheduled_time_utc = scheduled_time.astimezone(pytz.utc)
 
-        new_announcement = Announcement(message=message, scheduled_time=scheduled_time_utc)
+        new_announcement = Announcement(message=message, scheduled_time=scheduled_time_utc, audience=audience)
         session.add(new_announcement)
+        state_versions.bump(session, 'announcements')
         session.commit()
 
         # Schedule the job
-        scheduler.add_job(
-            send_announcement,
-            DateTrigger(run_date=scheduled_time_utc),
-            args=[new_announcement.id],
-            id=f'announcement_{new_announcement.id}',
-            replace_existing=True
-        )
+        add_announcement_job(new_announcement.id, scheduled_time_utc)
         app.logger.info(f"Announcement '{message}' scheduled for {scheduled_time_str}.")
         return True
     except ValueError:
@@ -378,6 +999,75 @@ def schedule_announcement(message, scheduled_time_str):
     finally:
         session.close()
 
+def add_announcement_job(announcement_id, run_date):
+    scheduler.add_job(
+        send_announcement,
+        DateTrigger(run_date=run_date),
+        args=[announcement_id],
+        id=f'announcement_{announcement_id}',
+        jobstore=ANNOUNCEMENT_JOBSTORE,
+        # Still send it if the leader was down when it fell due
+        misfire_grace_time=None,
+        replace_existing=True
+    )
+
+def rehydrate_announcements():
+    """Re-create jobs for unsent announcements that have none in the job store."""
+    existing = {job.id for job in scheduler.get_jobs(jobstore=ANNOUNCEMENT_JOBSTORE)}
+    session = Session()
+    pending = (session.query(Announcement.id, Announcement.scheduled_time)
+               .filter(Announcement.sent.is_(False), Announcement.scheduled_time.isnot(None))
+               .order_by(Announcement.scheduled_time)
+               .all())
+    session.close()
+    restored = 0
+    for announcement_id, scheduled_time in pending:
+        if f'announcement_{announcement_id}' not in existing:
+            add_announcement_job(announcement_id, pytz.utc.localize(scheduled_time))
+            restored += 1
+    if restored:
+        app.logger.info(f"Re-hydrated {restored} unsent announcement(s).")
+    return restored
+
+def _on_scheduler_elected():
+    rehydrate_announcements()
+    scheduler.resume()
+    app.logger.info("This worker now runs scheduled jobs.")
+
+def _on_scheduler_deposed():
+    scheduler.pause()
+
+def _on_scheduler_tick():
+    # Jobs added by other workers go straight to the job store; wake up so
+    # they are noticed without waiting for the next local job.
+    scheduler.wakeup()
+
+def start_scheduler():
+    global scheduler_election
+    if scheduler.running:
+        return
+    if not SCHEDULER_PERSISTENT:
+        scheduler.start()
+        rehydrate_announcements()
+        app.logger.info("Scheduler started.")
+        return
+    scheduler.start(paused=True)
+    lease = LeaderLease(engine, 'announcements', ttl=SCHEDULER_LEASE_TTL)
+    scheduler_election = LeaderElection(
+        lease, interval=SCHEDULER_LEASE_TTL / 3,
+        on_elected=_on_scheduler_elected,
+        on_deposed=_on_scheduler_deposed,
+        on_tick=_on_scheduler_tick,
+    )
+    scheduler_election.start()
+    app.logger.info("Scheduler started (%s).", 'leader' if lease.is_leader else 'standby')
+
+def shutdown_scheduler():
+    if scheduler_election is not None:
+        scheduler_election.stop()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+
 def get_all_scheduled_announcements():
     session = Session()
     announcements = session.query(Announcement).filter_by(sent=False).order_by(Announcement.scheduled_time).all()
@@ -389,8 +1079,12 @@ def cancel_announcement_by_id(announcement_id):
     announcement = session.query(Announcement).filter_by(id=announcement_id).first()
     if announcement:
         try:
-            scheduler.remove_job(f'announcement_{announcement_id}')
+            try:
+                scheduler.remove_job(f'announcement_{announcement_id}', jobstore=ANNOUNCEMENT_JOBSTORE)
+            except JobLookupError:
+                app.logger.warning(f"No scheduled job for announcement ID {announcement_id}; deleting it anyway.")
             session.delete(announcement)
+            state_versions.bump(session, 'announcements')
             session.commit()
             app.logger.info(f"Announcement ID {announcement_id} cancelled and deleted.")
             return True
@@ -401,12 +1095,183 @@ def cancel_announcement_by_id(announcement_id):
     session.close()
     return False
 
+# --- Metrics ---
+# With several gunicorn workers, set METRICS_DIR to a directory they share:
+# each worker writes its metrics there every few seconds and /metrics adds
+# them up, whichever worker answers the scrape. A file not rewritten for
+# three intervals belongs to a worker that is gone and is deleted.
+METRICS_DIR = os.getenv('METRICS_DIR')
+metrics_writer = (SnapshotWriter(METRICS_DIR, interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '5')))
+                  if METRICS_DIR else None)
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_seconds', 'Time spent answering one HTTP request', labelnames=('endpoint',))
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests by endpoint and status code', labelnames=('endpoint', 'status'))
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    request_id.set(request.headers.get('X-Request-Id') or uuid.uuid4().hex[:16])
+    if metrics_writer is not None:
+        metrics_writer.start()
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.endpoint or 'unknown'
+    started = g.get('request_started')
+    if started is not None:
+        HTTP_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    response.headers['X-Request-Id'] = request_id.get()
+    return response
+
+@app.route("/metrics")
+def metrics():
+    max_age = metrics_writer.interval * 3 if metrics_writer is not None else None
+    return Response(render_text(collect(METRICS_DIR, max_age=max_age)), mimetype='text/plain; version=0.0.4')
+
+# --- Read-only API ---
+# JSON views of the game state for dashboards. Each response is keyed by the
+# state versions it depends on: a poll with a matching If-None-Match gets a
+# 304 after one primary-key lookup, and a changed document is built (and
+# gzipped, unless API_GZIP=0) once per version per worker.
+# The API and /events show what only admins can see in chat, so they need
+# API_TOKEN, sent as "Authorization: Bearer <token>" or, for EventSource,
+# which cannot set headers, as ?access_token=. Without API_TOKEN they are off.
+API_TOKEN = os.getenv('API_TOKEN')
+
+def require_api_token():
+    if not API_TOKEN:
+        abort(403)
+    supplied = request.args.get('access_token', '')
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer':
+        supplied = credentials.strip()
+    if not hmac.compare_digest(supplied.encode('utf-8'), API_TOKEN.encode('utf-8')):
+        abort(401)
+
+api = Blueprint('api', __name__, url_prefix='/api')
+api.before_request(require_api_token)
+api_cache = VersionedJsonCache(gzip_enabled=os.getenv('API_GZIP', '1').lower() in ('1', 'true', 'yes'))
+
+def _versioned(key, resources, build):
+    versions = state_versions.get(*resources)
+    return api_cache.respond(key, '.'.join(str(versions[r]) for r in resources), build)
+
+def _utc_iso(value):
+    return value.isoformat() + 'Z' if value else None
+
+def _real_teams(query):
+    return query.filter(User.role == 'team', User.team_name.isnot(None),
+                        ~User.user_id.contains(PLACEHOLDER_MARKER, autoescape=True))
+
+@api.route("/teams")
+def api_teams():
+    def build():
+        session = Session()
+        try:
+            rows = (_real_teams(session.query(User.team_name, func.count(User.id)))
+                    .group_by(User.team_name).order_by(User.team_name).all())
+        finally:
+            session.close()
+        return [{'team': team_name, 'members': members} for team_name, members in rows]
+    return _versioned('teams', ('teams',), build)
+
+@api.route("/missions")
+def api_missions():
+    def build():
+        return [{'code': m.mission_code, 'name': m.name, 'description': m.description,
+                 'is_completed': bool(m.is_completed), 'completed_by_team': m.completed_by_team,
+                 'completion_time': _utc_iso(m.completion_time)}
+                for m in sorted(get_all_missions(), key=lambda m: m.mission_code)]
+    return _versioned('missions', ('missions',), build)
+
+def _inventories(team_name=None):
+    session = Session()
+    try:
+        query = (_real_teams(session.query(User.team_name, Card.name_zh, func.sum(TeamCard.quantity)))
+                 .join(TeamCard, TeamCard.team_id == User.id)
+                 .join(Card, Card.id == TeamCard.card_id))
+        if team_name is not None:
+            query = query.filter(User.team_name == team_name)
+        rows = query.group_by(User.team_name, Card.name_zh).order_by(User.team_name, Card.name_zh).all()
+    finally:
+        session.close()
+    inventories = {}
+    for team, card, quantity in rows:
+        inventories.setdefault(team, []).append({'card': card, 'quantity': int(quantity)})
+    return inventories
+
+@api.route("/inventories")
+def api_inventories():
+    return _versioned('inventories', ('inventory', 'teams'), _inventories)
+
+@api.route("/teams/<team_name>/inventory")
+def api_team_inventory(team_name):
+    return _versioned(f'inventory/{team_name}', ('inventory', 'teams'),
+                      lambda: _inventories(team_name).get(team_name, []))
+
+@api.route("/announcements")
+def api_announcements():
+    def build():
+        session = Session()
+        try:
+            announcements = session.query(Announcement).order_by(Announcement.scheduled_time, Announcement.id).all()
+        finally:
+            session.close()
+        return [{'id': a.id, 'message': a.message, 'scheduled_time': _utc_iso(a.scheduled_time), 'sent': bool(a.sent),
+                 'audience': a.audience}
+                for a in announcements]
+    return _versioned('announcements', ('announcements',), build)
+
+@api.route("/standings")
+def api_standings():
+    return _versioned('standings', STANDINGS_RESOURCES, get_standings)
+
+app.register_blueprint(api)
+
+# --- Live events ---
+# Server-sent events of game changes. Each client is one idle greenlet and a
+# small buffer: a client that falls SSE_BUFFER events behind loses the oldest
+# ones and gets a 'resync' event telling it to refetch from /api. Browsers
+# reconnect with Last-Event-ID and are replayed what they missed, as long as
+# it is still in the bus history. Needs the API token, like /api.
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', '15'))
+SSE_BUFFER = int(os.getenv('SSE_BUFFER', '100'))
+
+@app.route("/events")
+def events():
+    require_api_token()
+    types = {t for t in request.args.get('types', '').split(',') if t} or None
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = event_bus.subscribe(types, maxsize=SSE_BUFFER, last_event_id=last_event_id)
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                messages = subscription.get(timeout=SSE_HEARTBEAT)
+                dropped = subscription.take_dropped()
+                if dropped:
+                    yield f"event: resync\ndata: {{\"dropped\":{dropped}}}\n\n"
+                # A comment line keeps proxies from closing an idle stream
+                yield ''.join(messages) if messages else ": keep-alive\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- Webhook Handler ---
 @app.route("/callback", methods=['POST'])
 def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
-    app.logger.info("Request body: %s", body)
+    app.logger.info("Webhook received", extra={'body_bytes': len(body)})
+    app.logger.log(WEBHOOK_BODY_LOG_LEVEL, "Request body: %s", body)
+
+    if WEBHOOK_ASYNC:
+        return enqueue_webhook(body, signature)
 
     try:
         handler.handle(body, signature)
@@ -429,295 +1294,392 @@ def callback():
 
     return 'OK'
 
+def enqueue_webhook(body, signature):
+    try:
+        payload = handler.parser.parse(body, signature, as_payload=True)
+    except InvalidSignatureError:
+        app.logger.error("Invalid signature. Please check your channel access token/channel secret.")
+        abort(400)
+    for event in payload.events:
+        if not event_dispatcher.submit(event, payload.destination):
+            # LINE redelivers on a non-200, so shed load instead of blocking.
+            app.logger.error(f"Webhook queue full (depth {event_dispatcher.depth()}), rejecting request.")
+            abort(503)
+    return 'OK'
+
 # --- Message Handler ---
+# Commands are looked up by (role, first word); see commands.py.
+router = CommandRouter()
+
+LOGIN_PROMPT = "請先輸入密碼登入 (例如：密碼 [您的隊伍密碼] 或 管理員密碼 [您的管理員密碼])。"
+TEAM_HELP = (
+    "您已登入為隊伍。可用的指令有：\n"
+    "1. 我的隊伍\n"
+    "2. 完成任務 [任務代碼]\n"
+    "3. 查看任務\n"
+    "4. 新增卡牌 [卡片名稱] [數量]\n"
+    "5. 刪除卡牌 [卡片名稱] [數量]\n"
+    "6. 查看卡牌\n"
+    "7. 交換卡牌 [隊伍A] [隊伍B] [卡片A] [數量A] [卡片B] [數量B]\n"
+    "8. 任務排行榜\n"
+    "9. 批量新增卡牌 [卡片名稱:數量] ...\n"
+    "10. 批量刪除卡牌 [卡片名稱:數量] ...\n"
+    "11. 排行榜"
+)
+ADMIN_HELP = (
+    "管理員指令列表：\n"
+    "1. 添加任務 [代碼] [名稱] [描述]\n"
+    "2. 查看所有任務\n"
+    "3. 重置任務 [代碼] (管理員專用)\n"
+    "4. 查看所有隊伍\n"
+    "5. 發布公告 [時間(YYYY-MM-DD HH:MM)] [訊息]\n"
+    "6. 查看所有公告\n"
+    "7. 取消公告 [ID]\n"
+    "8. 任務排行榜\n"
+    "9. 批量新增卡牌 [隊伍名稱] [卡片名稱:數量] ...\n"
+    "10. 批量刪除卡牌 [隊伍名稱] [卡片名稱:數量] ...\n"
+    "11. 排行榜\n"
+    "12. 發布定向公告 [對象] [時間(YYYY-MM-DD HH:MM)] [訊息]\n"
+    "   對象：team:隊伍名稱、role:team/admin/guest、scope:game_master/organizer，多個以逗號分隔"
+)
+
+
+# --- Initial Login/Registration Logic ---
+@router.command('guest', '密碼', args=(str,), usage=LOGIN_PROMPT)
+def cmd_team_login(ctx, password_attempt):
+    if find_credential('team', password_attempt) is None:
+        return "隊伍密碼錯誤，請重新輸入或輸入管理員密碼。"
+    create_or_update_user(ctx.user_id, role='team', team_name=f'隊伍-{password_attempt}', team_password=password_attempt)
+    return f"登入成功！您已加入隊伍 {password_attempt}。"
+
+
+@router.command('guest', '管理員密碼', args=(str,), usage=LOGIN_PROMPT)
+def cmd_admin_login(ctx, admin_password_attempt):
+    group = find_credential('admin', admin_password_attempt)
+    if group is None:
+        return "管理員密碼錯誤，請重新輸入。"
+    # The admin's group (game_master / organizer) is their announcement scope
+    create_or_update_user(ctx.user_id, role='admin', team_name=group, admin_password=admin_password_attempt)
+    return "管理員登入成功！您現在擁有管理員權限。"
+
+
+@router.fallback('guest')
+def cmd_guest_help(ctx):
+    return LOGIN_PROMPT
+
+
+# --- Team User Logic ---
+@router.command('team', '我的隊伍')
+def cmd_my_team(ctx):
+    return f"您的隊伍是：{ctx.user.team_name}"
+
+
+@router.command('team', '完成任務', args=(upper,), usage="請輸入有效的任務代碼 (例如：完成任務 M001)。")
+def cmd_complete_mission(ctx, mission_code):
+    won, mission_name, completed_by_team = complete_mission(mission_code, ctx.user.team_name)
+    if mission_name is None:
+        return "任務代碼無效，請檢查後重試。"
+    if not won:
+        return f"任務 '{mission_name}' 已經被隊伍 {completed_by_team} 完成了。"
+    invalidate_mission_board()
+    return f"任務 '{mission_name}' 已成功標記為完成！"
+
+
+@router.command('team', '查看任務')
+def cmd_view_missions(ctx):
+    return get_mission_board("目前任務列表：") or "目前沒有任何任務。"
+
+
+@router.command(('team', 'admin'), '任務排行榜')
+def cmd_mission_leaderboard(ctx):
+    return render_first_finisher_leaderboard()
+
+
+@router.command(('team', 'admin'), '排行榜')
+def cmd_standings(ctx):
+    return render_standings()
+
+
+@router.command('team', '新增卡牌', args=(str, integer), usage="指令格式：新增卡牌 [卡片名稱] [數量]")
+def cmd_add_card(ctx, card_name, qty):
+    if qty <= 0:
+        return "數量必須為正整數。"
+    session = Session()
+    try:
+        add_card_to_team(session, ctx.user, card_name, qty)
+    finally:
+        session.close()
+    return f"已為 {ctx.user.team_name} 新增 {card_name} x{qty}。"
+
+
+@router.command('team', '刪除卡牌', args=(str, integer), usage="指令格式：刪除卡牌 [卡片名稱] [數量]")
+def cmd_remove_card(ctx, card_name, qty):
+    if qty <= 0:
+        return "數量必須為正整數。"
+    session = Session()
+    try:
+        success, msg = remove_card_from_team(session, ctx.user, card_name, qty)
+    finally:
+        session.close()
+    if not success:
+        raise UsageError()
+    return f"已從 {ctx.user.team_name} 刪除 {card_name} x{qty}。"
+
+
+def card_quantities(value):
+    """Argument parser for 'name:qty name:qty ...' (a full-width colon works too)."""
+    pairs = []
+    for item in value.split():
+        name, sep, qty = item.replace('：', ':').rpartition(':')
+        if not sep or not name or not qty.isdigit() or int(qty) <= 0:
+            raise UsageError()
+        pairs.append((name, int(qty)))
+    if not pairs:
+        raise UsageError()
+    return pairs
+
+
+def bulk_card_command(team, pairs, sign):
+    changes = {}
+    for name, qty in pairs:
+        changes[name] = changes.get(name, 0) + sign * qty
+    session = Session()
+    try:
+        success, msg = apply_card_changes(session, team, changes)
+    finally:
+        session.close()
+    if not success:
+        return msg
+    summary = "、".join(f"{name} x{abs(qty)}" for name, qty in changes.items())
+    return f"已為 {team.team_name} 新增 {summary}。" if sign > 0 else f"已從 {team.team_name} 刪除 {summary}。"
+
+
+@router.command('team', '批量新增卡牌', args=(card_quantities,), usage="指令格式：批量新增卡牌 [卡片名稱:數量] [卡片名稱:數量] ...")
+def cmd_bulk_add_cards(ctx, pairs):
+    return bulk_card_command(ctx.user, pairs, 1)
+
+
+@router.command('team', '批量刪除卡牌', args=(card_quantities,), usage="指令格式：批量刪除卡牌 [卡片名稱:數量] [卡片名稱:數量] ...")
+def cmd_bulk_remove_cards(ctx, pairs):
+    return bulk_card_command(ctx.user, pairs, -1)
+
+
+@router.command('team', '交換卡牌', args=(str, str, str, integer, str, integer),
+                usage="指令格式：交換卡牌 [隊伍A] [隊伍B] [卡片A] [數量A] [卡片B] [數量B]")
+def cmd_trade_cards(ctx, team_a, team_b, card_a, qty_a, card_b, qty_b):
+    key = _normalize_trade(team_a, card_a, qty_a, team_b, card_b, qty_b)
+    confirmation = pending_trade_store.confirm(key, ctx.user_id)
+
+    if len(confirmation.user_ids) >= 2:
+        success, msg = execute_trade(team_a, card_a, qty_a, team_b, card_b, qty_b)
+        return "卡牌交換成功！" if success else f"交換失敗：{msg}"
+    if confirmation.created:
+        return "交換請求已建立，請對方在1分鐘內發送相同指令確認。"
+    return "已收到交換請求，等待另一方確認。"
+
+
+@router.command('team', '查看卡牌')
+def cmd_view_cards(ctx):
+    inventory = get_team_inventory(ctx.user.id)
+    if not inventory:
+        return f"{ctx.user.team_name} 目前沒有任何卡牌。"
+    return "\n".join(f"{name}: {quantity}" for name, quantity in inventory)
+
+
+@router.fallback('team')
+def cmd_team_help(ctx):
+    return TEAM_HELP
+
+
+# --- Admin User Logic ---
+@router.command('admin', '管理員指令')
+def cmd_admin_help(ctx):
+    return ADMIN_HELP
+
+
+@router.command('admin', '添加任務', args=(upper, str, str), usage="請輸入有效的指令格式：添加任務 [代碼] [名稱] [描述]")
+def cmd_add_mission(ctx, mission_code, mission_name, mission_description):
+    session = Session()
+    try:
+        if session.query(Mission).filter_by(mission_code=mission_code).first():
+            return "任務代碼已存在，請使用不同的代碼。"
+        session.add(Mission(mission_code=mission_code, name=mission_name, description=mission_description))
+        state_versions.bump(session, 'missions')
+        session.commit()
+    finally:
+        session.close()
+    invalidate_mission_board()
+    return f"任務 '{mission_name}' (代碼：{mission_code}) 已添加。"
+
+
+@router.command('admin', '查看所有任務')
+def cmd_view_all_missions(ctx):
+    return get_mission_board("所有任務列表：") or "目前沒有任何任務。"
+
+
+@router.command('admin', '重置任務', args=(upper,), usage="請輸入有效的任務代碼 (例如：重置任務 M001)。")
+def cmd_reset_mission(ctx, mission_code):
+    session = Session()
+    try:
+        mission = session.query(Mission).filter_by(mission_code=mission_code).first()
+        if not mission:
+            return "任務代碼無效。"
+        previous_team = mission.completed_by_team if mission.is_completed else None
+        mission.is_completed = False
+        mission.completion_time = None
+        mission.completed_by_team = None
+        if previous_team:
+            bump_standing(session, previous_team, missions=-1)
+            latest = (session.query(func.max(Mission.completion_time))
+                      .filter(Mission.completed_by_team == previous_team, Mission.is_completed.is_(True),
+                              Mission.id != mission.id)
+                      .scalar())
+            session.query(TeamStanding).filter_by(team_name=previous_team).update(
+                {'last_completion': latest}, synchronize_session=False)
+        state_versions.bump(session, 'missions')
+        session.commit()
+        mission_name = mission.name
+    finally:
+        session.close()
+    invalidate_mission_board()
+    invalidate_standings()
+    event_bus.publish('mission_reset', code=mission_code)
+    return f"任務 '{mission_name}' 已重置為未完成。"
+
+
+def find_team(team_name):
+    session = Session()
+    try:
+        return session.query(User).filter_by(role='team', team_name=team_name).order_by(User.id).first()
+    finally:
+        session.close()
+
+
+@router.command('admin', '批量新增卡牌', args=(str, card_quantities),
+                usage="指令格式：批量新增卡牌 [隊伍名稱] [卡片名稱:數量] [卡片名稱:數量] ...")
+def cmd_admin_bulk_add_cards(ctx, team_name, pairs):
+    team = find_team(team_name)
+    if team is None:
+        return "找不到指定隊伍。"
+    return bulk_card_command(team, pairs, 1)
+
+
+@router.command('admin', '批量刪除卡牌', args=(str, card_quantities),
+                usage="指令格式：批量刪除卡牌 [隊伍名稱] [卡片名稱:數量] [卡片名稱:數量] ...")
+def cmd_admin_bulk_remove_cards(ctx, team_name, pairs):
+    team = find_team(team_name)
+    if team is None:
+        return "找不到指定隊伍。"
+    return bulk_card_command(team, pairs, -1)
+
+
+@router.command('admin', '查看所有隊伍')
+def cmd_view_teams(ctx):
+    teams = get_all_teams()
+    if not teams:
+        return "目前沒有任何隊伍。"
+    response = "所有隊伍列表：\n"
+    for t in teams:
+        if t.team_name and t.role == 'team':
+            response += f"隊伍名稱：{t.team_name}, 用戶ID：{t.user_id}\n"
+    return response
+
+
+# The time is two words (date and clock time), so the message starts at the
+# fourth word.
+@router.command('admin', '發布公告', args=(str, str, str), usage="請輸入有效的指令格式：發布公告 [時間(YYYY-MM-DD HH:MM)] [訊息]")
+def cmd_schedule_announcement(ctx, date_str, clock_str, announcement_message):
+    scheduled_time_str = f"{date_str} {clock_str}"
+    if not schedule_announcement(announcement_message, scheduled_time_str):
+        return "時間格式無效 (應為 YYYY-MM-DD HH:MM) 或排程失敗。"
+    return f"公告已成功安排於 {scheduled_time_str} 發送。"
+
+
+@router.command('admin', '發布定向公告', args=(parse_audience, str, str, str),
+                usage="請輸入有效的指令格式：發布定向公告 [對象] [時間(YYYY-MM-DD HH:MM)] [訊息]")
+def cmd_schedule_targeted_announcement(ctx, audience, date_str, clock_str, announcement_message):
+    scheduled_time_str = f"{date_str} {clock_str}"
+    if not schedule_announcement(announcement_message, scheduled_time_str, audience):
+        return "時間格式無效 (應為 YYYY-MM-DD HH:MM) 或排程失敗。"
+    return f"公告已成功安排於 {scheduled_time_str} 發送給 {audience or '所有人'}。"
+
+
+@router.command('admin', '查看所有公告')
+def cmd_view_announcements(ctx):
+    announcements = get_all_scheduled_announcements()
+    if not announcements:
+        return "目前沒有任何排程公告。"
+    response = "所有排程公告列表：\n"
+    for a in announcements:
+        scheduled_time_local = pytz.utc.localize(a.scheduled_time).astimezone(TAIPEI_TZ)
+        response += f"ID: {a.id}, 時間: {scheduled_time_local.strftime('%Y-%m-%d %H:%M')}, 訊息: {a.message}"
+        response += f", 對象: {a.audience}\n" if a.audience else "\n"
+    return response
+
+
+@router.command('admin', '取消公告', args=(integer,), usage="請輸入有效的公告 ID (例如：取消公告 1)。")
+def cmd_cancel_announcement(ctx, announcement_id):
+    if cancel_announcement_by_id(announcement_id):
+        return f"公告 ID {announcement_id} 已取消並刪除。"
+    return f"找不到公告 ID {announcement_id} 或取消失敗。"
+
+
+@router.fallback('admin')
+def cmd_admin_fallback(ctx):
+    return "您已登入為管理員。輸入 '管理員指令' 查看可用指令。"
+
+
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     reply_token = event.reply_token
     user_id = event.source.user_id
-    text = event.message.text.strip()
-    user = get_user(user_id)
-
-    # --- Initial Login/Registration Logic ---
-    if not user or user.role == 'guest':
-        # Check for team password command
-        if text.lower().startswith('密碼 '):
-            parts = text.split(' ', 1)
-            if len(parts) == 2:
-                password_attempt = parts[1]
-                session = Session()
-                existing_team_user = session.query(User).filter_by(role='team', team_password=password_attempt).first()
-                if existing_team_user:
-                    # Update current user or create new if not exists
-                    create_or_update_user(user_id, role='team', team_name=f'隊伍-{password_attempt}', team_password=password_attempt)
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"登入成功！您已加入隊伍 {password_attempt}。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="隊伍密碼錯誤，請重新輸入或輸入管理員密碼。"))
-                session.close()
-                return # Crucial: Exit after handling password input
-
-        # Check for admin password command
-        elif text.lower().startswith('管理員密碼 '):
-            parts = text.split(' ', 1)
-            if len(parts) == 2:
-                admin_password_attempt = parts[1]
-                session = Session()
-                existing_admin_user = session.query(User).filter_by(role='admin', admin_password=admin_password_attempt).first()
-                if existing_admin_user:
-                    create_or_update_user(user_id, role='admin', team_name='game_master', admin_password=admin_password_attempt)
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="管理員登入成功！您現在擁有管理員權限。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="管理員密碼錯誤，請重新輸入。"))
-                session.close()
-                return # Crucial: Exit after handling password input
-
-        else:
-            # This is the line that was likely causing recursion if not handled properly
-            # by immediately returning after a successful login attempt.
-            line_bot_api.reply_message(reply_token, TextSendMessage(text="請先輸入密碼登入 (例如：密碼 [您的隊伍密碼] 或 管理員密碼 [您的管理員密碼])。"))
-            return # Ensure exit here if not logged in
-
-    # --- Team User Logic ---
-    if user and user.role == 'team':
-        if text.lower() == '我的隊伍':
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=f"您的隊伍是：{user.team_name}"))
-        elif text.lower().startswith('完成任務 '):
-            parts = text.split(' ', 1)
-            if len(parts) == 2:
-                mission_code = parts[1].upper()
-                session = Session()
-                mission = session.query(Mission).filter_by(mission_code=mission_code).first()
-                if mission:
-                    if not mission.is_completed:
-                        mission.is_completed = True
-                        mission.completion_time = datetime.utcnow()
-                        mission.completed_by_team = user.team_name
-                        session.commit()
-                        line_bot_api.reply_message(reply_token, TextSendMessage(text=f"任務 '{mission.name}' 已成功標記為完成！"))
-                    else:
-                        line_bot_api.reply_message(reply_token, TextSendMessage(text=f"任務 '{mission.name}' 已經被隊伍 {mission.completed_by_team} 完成了。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="任務代碼無效，請檢查後重試。"))
-                session.close()
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="請輸入有效的任務代碼 (例如：完成任務 M001)。"))
-        elif text.lower() == '查看任務':
-            missions = get_all_missions()
-            if missions:
-                response = "目前任務列表：\n"
-                for m in missions:
-                    status = "✅ 已完成" if m.is_completed else "⏳ 未完成"
-                    response += f"代碼：{m.mission_code}, 名稱：{m.name}, 狀態：{status}\n"
-                    if m.is_completed:
-                        completion_time_local = pytz.utc.localize(m.completion_time).astimezone(pytz.timezone('Asia/Taipei'))
-                        response += f"  完成時間：{completion_time_local.strftime('%Y-%m-%d %H:%M')}, 完成隊伍：{m.completed_by_team}\n"
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=response))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="目前沒有任何任務。"))
-        elif text.startswith('新增卡牌 '):
-            parts = text.split(' ', 2)
-            if len(parts) == 3 and parts[2].isdigit():
-                card_name = parts[1]
-                qty = int(parts[2])
-                if qty <= 0:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="數量必須為正整數。"))
-                else:
-                    session = Session()
-                    add_card_to_team(session, user, card_name, qty)
-                    session.close()
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"已為 {user.team_name} 新增 {card_name} x{qty}。"))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="指令格式：新增卡牌 [卡片名稱] [數量]"))
-        elif text.startswith('刪除卡牌 '):
-            parts = text.split(' ', 2)
-            if len(parts) == 3 and parts[2].isdigit():
-                card_name = parts[1]
-                qty = int(parts[2])
-                if qty <= 0:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="數量必須為正整數。"))
-                else:
-                    session = Session()
-                    success, msg = remove_card_from_team(session, user, card_name, qty)
-                    session.close()
-                    if success:
-                        line_bot_api.reply_message(reply_token, TextSendMessage(text=f"已從 {user.team_name} 刪除 {card_name} x{qty}。"))
-                    else:
-                            line_bot_api.reply_message(reply_token, TextSendMessage(text="指令格式：刪除卡牌 [卡片名稱] [數量]"))
-                
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="指令格式：刪除卡牌 [卡片名稱] [數量]"))
-        elif text.startswith('交換卡牌 '):
-            parts = text.split(' ')
-            if len(parts) == 7 and parts[4].isdigit() and parts[6].isdigit():
-                team_a = parts[1]
-                team_b = parts[2]
-                card_a = parts[3]
-                qty_a = int(parts[4])
-                card_b = parts[5]
-                qty_b = int(parts[6])
-
-                key = _normalize_trade(team_a, card_a, qty_a, team_b, card_b, qty_b)
-                now = datetime.utcnow()
-                record = pending_trades.get(key)
-
-                if record and (now - record['timestamp']) <= timedelta(minutes=1):
-                    record['user_ids'].add(user_id)
-                    if len(record['user_ids']) >= 2:
-                        success, msg = execute_trade(team_a, card_a, qty_a, team_b, card_b, qty_b)
-                        pending_trades.pop(key, None)
-                        if success:
-                            line_bot_api.reply_message(reply_token, TextSendMessage(text="卡牌交換成功！"))
-                        else:
-                            line_bot_api.reply_message(reply_token, TextSendMessage(text=f"交換失敗：{msg}"))
-                    else:
-                        pending_trades[key] = record  # update timestamp untouched
-                        line_bot_api.reply_message(reply_token, TextSendMessage(text="已收到交換請求，等待另一方確認。"))
-                else:
-                    pending_trades[key] = {
-                        'timestamp': now,
-                        'user_ids': {user_id}
-                    }
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="交換請求已建立，請對方在1分鐘內發送相同指令確認。"))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="指令格式：交換卡牌 [隊伍A] [隊伍B] [卡片A] [數量A] [卡片B] [數量B]"))
-        elif text == '查看卡牌':
-            session = Session()
-            team_cards = list_team_cards(session, user)
-            if team_cards:
-                response += f"{tc.card.name_zh}: {tc.quantity}\n"
-                for tc in team_cards:
-                    response += f"{tc.card.name}: {tc.quantity}\n"
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=response))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=f"{user.team_name} 目前沒有任何卡牌。"))
-            session.close()
-        else:
-            line_bot_api.reply_message(
-                reply_token,
-                TextSendMessage(
-                    text=(
-                        "您已登入為隊伍。可用的指令有：\n"
-                        "1. 我的隊伍\n"
-                        "2. 完成任務 [任務代碼]\n"
-                        "3. 查看任務\n"
-                        "4. 新增卡牌 [卡片名稱] [數量]\n"
-                        "5. 刪除卡牌 [卡片名稱] [數量]\n"
-                        "6. 查看卡牌\n"
-                        "7. 交換卡牌 [隊伍A] [隊伍B] [卡片A] [數量A] [卡片B] [數量B]"
-                    )
-                )
-            )
-        return # Crucial: Exit after handling team commands
-
-    # --- Admin User Logic ---
-    if user and user.role == 'admin':
-        if text.lower() == '管理員指令':
-            line_bot_api.reply_message(reply_token, TextSendMessage(text="管理員指令列表：\n1. 添加任務 [代碼] [名稱] [描述]\n2. 查看所有任務\n3. 重置任務 [代碼] (管理員專用)\n4. 查看所有隊伍\n5. 發布公告 [時間(YYYY-MM-DD HH:MM)] [訊息]\n6. 查看所有公告\n7. 取消公告 [ID]"))
-        elif text.lower().startswith('添加任務 '):
-            parts = text.split(' ', 3) # Split into 4 parts: command, code, name, description
-            if len(parts) == 4:
-                mission_code = parts[1].upper()
-                mission_name = parts[2]
-                mission_description = parts[3]
-                session = Session()
-                if not session.query(Mission).filter_by(mission_code=mission_code).first():
-                    new_mission = Mission(mission_code=mission_code, name=mission_name, description=mission_description)
-                    session.add(new_mission)
-                    session.commit()
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"任務 '{mission_name}' (代碼：{mission_code}) 已添加。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="任務代碼已存在，請使用不同的代碼。"))
-                session.close()
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="請輸入有效的指令格式：添加任務 [代碼] [名稱] [描述]"))
-        elif text.lower() == '查看所有任務':
-            missions = get_all_missions()
-            if missions:
-                response = "所有任務列表：\n"
-                for m in missions:
-                    status = "✅ 已完成" if m.is_completed else "⏳ 未完成"
-                    response += f"代碼：{m.mission_code}, 名稱：{m.name}, 狀態：{status}\n"
-                    if m.is_completed:
-                        completion_time_local = pytz.utc.localize(m.completion_time).astimezone(pytz.timezone('Asia/Taipei'))
-                        response += f"  完成時間：{completion_time_local.strftime('%Y-%m-%d %H:%M')}, 完成隊伍：{m.completed_by_team}\n"
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=response))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="目前沒有任何任務。"))
-        elif text.lower().startswith('重置任務 '):
-            parts = text.split(' ', 1)
-            if len(parts) == 2:
-                mission_code = parts[1].upper()
-                session = Session()
-                mission = session.query(Mission).filter_by(mission_code=mission_code).first()
-                if mission:
-                    mission.is_completed = False
-                    mission.completion_time = None
-                    mission.completed_by_team = None
-                    session.commit()
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"任務 '{mission.name}' 已重置為未完成。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="任務代碼無效。"))
-                session.close()
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="請輸入有效的任務代碼 (例如：重置任務 M001)。"))
-        elif text.lower() == '查看所有隊伍':
-            teams = get_all_teams()
-            if teams:
-                response = "所有隊伍列表：\n"
-                for t in teams:
-                    if t.team_name and t.role == 'team':
-                        response += f"隊伍名稱：{t.team_name}, 用戶ID：{t.user_id}\n"
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=response))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="目前沒有任何隊伍。"))
-        elif text.lower().startswith('發布公告 '):
-            parts = text.split(' ', 2) # Split into 3 parts: command, time, message
-            if len(parts) == 3:
-                scheduled_time_str = parts[1]
-                announcement_message = parts[2]
-                if schedule_announcement(announcement_message, scheduled_time_str):
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"公告已成功安排於 {scheduled_time_str} 發送。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text="時間格式無效 (應為 YYYY-MM-DD HH:MM) 或排程失敗。"))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="請輸入有效的指令格式：發布公告 [時間(YYYY-MM-DD HH:MM)] [訊息]"))
-        elif text.lower() == '查看所有公告':
-            announcements = get_all_scheduled_announcements()
-            if announcements:
-                response = "所有排程公告列表：\n"
-                for a in announcements:
-                    scheduled_time_local = pytz.utc.localize(a.scheduled_time).astimezone(pytz.timezone('Asia/Taipei'))
-                    response += f"ID: {a.id}, 時間: {scheduled_time_local.strftime('%Y-%m-%d %H:%M')}, 訊息: {a.message}\n"
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=response))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="目前沒有任何排程公告。"))
-        elif text.lower().startswith('取消公告 '):
-            parts = text.split(' ', 1)
-            if len(parts) == 2 and parts[1].isdigit():
-                announcement_id = int(parts[1])
-                if cancel_announcement_by_id(announcement_id):
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"公告 ID {announcement_id} 已取消並刪除。"))
-                else:
-                    line_bot_api.reply_message(reply_token, TextSendMessage(text=f"找不到公告 ID {announcement_id} 或取消失敗。"))
-            else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text="請輸入有效的公告 ID (例如：取消公告 1)。"))
-        else:
-            line_bot_api.reply_message(reply_token, TextSendMessage(text="您已登入為管理員。輸入 '管理員指令' 查看可用指令。"))
-        return # Crucial: Exit after handling admin commands
-
-    # Fallback for unhandled messages (should not be reached if previous 'return' statements work)
-    app.logger.warning(f"Unhandled message from user {user_id} ({user.role if user else 'guest'}): {text}")
-    line_bot_api.reply_message(reply_token, TextSendMessage(text="對不起，我不明白您的意思。"))
+    key = event_key(event)
+    if key is not None and not event_deduplicator.claim(key):
+        app.logger.info(f"Skipping redelivered event {key} from user {user_id}")
+        return
+    if rate_limiter is not None and not rate_limiter.allow(user_id):
+        shed_message(reply_token, user_id, 'user')
+        return
+    if not handler_limit.try_acquire():
+        shed_message(reply_token, user_id, 'busy')
+        return
+    try:
+        text = event.message.text.strip()
+        user = get_user(user_id)
+        role = user.role if user else 'guest'
+        reply = router.dispatch(role, CommandContext(user_id, user, text))
+    except Exception:
+        # Nothing was committed, so a redelivery of this event may run again
+        if key is not None:
+            event_deduplicator.forget(key)
+        raise
+    finally:
+        handler_limit.release()
+    if not reply:
+        # Fallback for unhandled messages (only reached for an unknown role)
+        app.logger.warning(f"Unhandled message from user {user_id} ({role}): {text}")
+        reply = "對不起，我不明白您的意思。"
+    send_reply(line_bot_api, reply_token, reply)
 
 
 # --- Initialization for WSGI environments ---
 # Ensure the database and scheduler are initialized even when the application
 # is launched by a WSGI server (e.g. Gunicorn) and the __main__ block is not
 # executed.
-init_db()
-add_initial_data()
-if not scheduler.running:
-    scheduler.start()
-    app.logger.info("Scheduler started.")
+_bootstrap_ran = bootstrap()
+start_scheduler()
+# Drop trade requests whose second confirmation never arrived
+scheduler.add_job(pending_trade_store.sweep, 'interval', seconds=60,
+                  id='pending_trade_sweeper', replace_existing=True)
+if event_deduplicator.engine is not None:
+    scheduler.add_job(event_deduplicator.sweep, 'interval', seconds=300,
+                      id='processed_events_sweeper', replace_existing=True)
+if isinstance(rate_limiter, SqlRateLimiter):
+    scheduler.add_job(rate_limiter.sweep, 'interval', seconds=300,
+                      id='rate_limit_sweeper', replace_existing=True)
+
+print(f"app.py imported in {(time.perf_counter() - _import_started) * 1000:.1f} ms "
+      f"(bootstrap {'ran' if _bootstrap_ran else 'skipped'}).")
 
 if __name__ == "__main__":
 
@@ -0,0 +1,98 @@
+# audience.py
+import threading
+
+from commands import UsageError
+
+# Seeded accounts hold a password until a real player logs in with it; their
+# user ids are not LINE ids, so every push to them fails.
+PLACEHOLDER_MARKER = '_placeholder_'
+
+ALL = 'all'
+# Selector prefixes, with the Chinese forms admins type in chat
+PREFIXES = {
+    'role': 'role', '角色': 'role',
+    'team': 'team', '隊伍': 'team',
+    'scope': 'scope', '範圍': 'scope',
+}
+ROLES = ('guest', 'team', 'admin')
+
+
+def is_placeholder(user_id):
+    return user_id is None or PLACEHOLDER_MARKER in user_id
+
+
+def parse_audience(text):
+    """Normalize 'team:隊伍-1,role:admin' to a stored audience string.
+
+    Selectors are comma separated and combined as a union:
+      all / 全部          every real user
+      role:<role>        guests, team members or admins
+      team:<team name>   the members of one team
+      scope:<group>      the admins of one group, e.g. game_master
+    Returns None for everyone; raises UsageError for an unknown selector.
+    """
+    selectors = []
+    for part in text.replace('，', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if part.lower() in (ALL, '全部'):
+            return None
+        prefix, sep, value = part.partition(':')
+        if not sep:
+            prefix, sep, value = part.partition('：')
+        kind = PREFIXES.get(prefix.strip().lower())
+        value = value.strip()
+        if kind is None or not value:
+            raise UsageError(f"無效的公告對象：{part}")
+        if kind == 'role' and value not in ROLES:
+            raise UsageError(f"無效的角色：{value} (可用：{', '.join(ROLES)})")
+        selector = f"{kind}:{value}"
+        if selector not in selectors:
+            selectors.append(selector)
+    if not selectors:
+        raise UsageError("請指定公告對象。")
+    return ','.join(selectors)
+
+
+class AudienceIndex:
+    """Per-process map of audience selector -> LINE user ids.
+
+    Built from the users table with one query, leaving out placeholder
+    accounts, so resolving an announcement's audience is a few set unions.
+    `version` records which state the index was built from.
+    """
+
+    def __init__(self):
+        self._members = {}
+        self._lock = threading.Lock()
+        self.version = None
+
+    def load(self, session, user_model, version=None):
+        rows = (session.query(user_model.user_id, user_model.role, user_model.team_name)
+                .filter(~user_model.user_id.contains(PLACEHOLDER_MARKER, autoescape=True))
+                .all())
+        members = {}
+        for user_id, role, team_name in rows:
+            keys = [ALL, f"role:{role or 'guest'}"]
+            if team_name and role == 'team':
+                keys.append(f"team:{team_name}")
+            elif team_name and role == 'admin':
+                keys.append(f"scope:{team_name}")
+            for key in keys:
+                members.setdefault(key, set()).add(user_id)
+        with self._lock:
+            self._members = members
+            self.version = version
+        return len(rows)
+
+    def resolve(self, audience):
+        """User ids for a stored audience string (None means everyone)."""
+        selectors = audience.split(',') if audience else [ALL]
+        user_ids = set()
+        for selector in selectors:
+            user_ids |= self._members.get(selector, set())
+        return sorted(user_ids)
+
+    def __len__(self):
+        return len(self._members.get(ALL, ()))
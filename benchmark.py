@@ -0,0 +1,242 @@
+# benchmark.py
+"""Replay signed webhook events for every chat command against /callback.
+
+    python benchmark.py                      # SQLite file and in-memory, 20 rounds
+    python benchmark.py --db sqlite --rounds 100 --concurrency 8
+    python benchmark.py --line-latency 0.05  # pretend LINE takes 50ms per call
+
+LINE is replaced by a local stub, so only the app and its database are
+measured. Each database runs in its own subprocess because app.py reads its
+configuration at import time.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unicodedata
+
+TEAM_A, TEAM_B = 'team_pass1', 'team_pass2'
+ADMIN = 'gm_pass1'
+
+
+class StubLineBotApi:
+    """Accepts every LINE call after an optional simulated network delay."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.headers = {}
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reply_message(self, reply_token, messages, **kwargs):
+        self._call()
+
+    def push_message(self, to, messages, **kwargs):
+        self._call()
+
+    def multicast(self, to, messages, **kwargs):
+        self._call()
+
+
+def sign(body, secret):
+    return base64.b64encode(hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()).decode()
+
+
+_ids = itertools.count(1)
+
+
+def webhook_body(user_id, text):
+    n = next(_ids)
+    return json.dumps({'destination': 'Ubenchmark', 'events': [{
+        'type': 'message', 'mode': 'active', 'timestamp': int(time.time() * 1000),
+        'webhookEventId': f'bench-{os.getpid()}-{n}', 'deliveryContext': {'isRedelivery': False},
+        'replyToken': f'reply-{n}',
+        'source': {'type': 'user', 'userId': user_id},
+        'message': {'type': 'text', 'id': str(n), 'text': text},
+    }]}, ensure_ascii=False)
+
+
+def build_scenario(rounds):
+    """(user_id, label, text) steps covering every command in handle_message."""
+    team_a, team_b, admin, guest = 'Ubench-team-a', 'Ubench-team-b', 'Ubench-admin', 'Ubench-guest'
+    steps = [
+        (guest, '密碼', '密碼 wrong'),
+        (guest, '(未登入)', '你好'),
+        (team_a, '密碼', f'密碼 {TEAM_A}'),
+        (team_b, '密碼', f'密碼 {TEAM_B}'),
+        (admin, '管理員密碼', f'管理員密碼 {ADMIN}'),
+    ]
+    for i in range(rounds):
+        code = f'B{i:04d}'
+        steps += [
+            (admin, '添加任務', f'添加任務 {code} 任務{i} 基準測試任務'),
+            (team_a, '查看任務', '查看任務'),
+            (team_a, '完成任務', f'完成任務 {code}'),
+            (team_b, '完成任務', f'完成任務 {code}'),
+            (admin, '重置任務', f'重置任務 {code}'),
+            (team_a, '任務排行榜', '任務排行榜'),
+            (team_b, '排行榜', '排行榜'),
+            (team_a, '我的隊伍', '我的隊伍'),
+            (team_a, '新增卡牌', '新增卡牌 火龍 2'),
+            (team_b, '新增卡牌', '新增卡牌 冰龍 2'),
+            (team_a, '交換卡牌', f'交換卡牌 隊伍-{TEAM_A} 隊伍-{TEAM_B} 火龍 1 冰龍 1'),
+            (team_b, '交換卡牌', f'交換卡牌 隊伍-{TEAM_A} 隊伍-{TEAM_B} 火龍 1 冰龍 1'),
+            (team_a, '刪除卡牌', '刪除卡牌 火龍 1'),
+            (team_a, '批量新增卡牌', '批量新增卡牌 火龍:1 冰龍:2 雷龍:3'),
+            (admin, '批量新增卡牌', f'批量新增卡牌 隊伍-{TEAM_B} 火龍:1 雷龍:1'),
+            (team_a, '批量刪除卡牌', '批量刪除卡牌 冰龍:2 雷龍:3'),
+            (admin, '批量刪除卡牌', f'批量刪除卡牌 隊伍-{TEAM_B} 雷龍:1'),
+            (team_a, '查看卡牌', '查看卡牌'),
+            (team_b, '(隊伍說明)', '你好'),
+            (admin, '管理員指令', '管理員指令'),
+            (admin, '查看所有任務', '查看所有任務'),
+            (admin, '查看所有隊伍', '查看所有隊伍'),
+            (admin, '發布公告', f'發布公告 2099-01-01 10:00 基準測試公告 {i}'),
+            (admin, '發布定向公告', f'發布定向公告 team:{TEAM_A},role:admin 2099-01-01 10:00 基準測試公告 {i}'),
+            (admin, '查看所有公告', '查看所有公告'),
+            (admin, '取消公告', f'取消公告 {2 * i + 1}'),
+        ]
+    return steps
+
+
+def _query_total(database):
+    return sum(value for _, value in database.QUERIES.samples())
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_benchmark(app_module, steps, concurrency=1):
+    """POST every step to /callback and collect per-command timings.
+
+    DB queries per request are only counted with concurrency 1, where they
+    cannot be mixed up with another request's.
+    """
+    import database
+    import gevent.pool
+
+    client = app_module.app.test_client()
+    secret = app_module.CHANNEL_SECRET
+    samples = {}  # label -> list of (seconds, queries or None)
+    errors = 0
+
+    def post(step):
+        nonlocal errors
+        user_id, label, text = step
+        body = webhook_body(user_id, text)
+        queries_before = _query_total(database) if concurrency == 1 else None
+        started = time.perf_counter()
+        response = client.post('/callback', data=body.encode('utf-8'),
+                               headers={'X-Line-Signature': sign(body, secret), 'Content-Type': 'application/json'})
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            errors += 1
+        queries = _query_total(database) - queries_before if queries_before is not None else None
+        samples.setdefault(label, []).append((elapsed, queries))
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        for step in steps:
+            post(step)
+    else:
+        pool = gevent.pool.Pool(concurrency)
+        for step in steps:
+            pool.spawn(post, step)
+        pool.join()
+    wall = time.perf_counter() - started
+
+    commands = {}
+    for label, runs in samples.items():
+        latencies = [seconds for seconds, _ in runs]
+        queries = [q for _, q in runs if q is not None]
+        commands[label] = {
+            'count': len(runs),
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+            'queries': sum(queries) / len(queries) if queries else None,
+        }
+    return {'requests': len(steps), 'errors': errors, 'seconds': wall,
+            'rps': len(steps) / wall if wall else 0.0, 'concurrency': concurrency, 'commands': commands}
+
+
+def _pad(text, width):
+    # CJK characters take two columns in a terminal
+    columns = sum(2 if unicodedata.east_asian_width(ch) in 'WF' else 1 for ch in text)
+    return text + ' ' * max(0, width - columns)
+
+
+def report(name, result):
+    lines = [f"== {name}: {result['requests']} requests in {result['seconds']:.2f}s "
+             f"({result['rps']:.1f} req/s, concurrency {result['concurrency']}, {result['errors']} errors)",
+             f"{'command':<14}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}"]
+    for label, stats in sorted(result['commands'].items(), key=lambda item: -item[1]['p50_ms']):
+        queries = f"{stats['queries']:.1f}" if stats['queries'] is not None else '-'
+        lines.append(f"{_pad(label, 14)}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{queries:>9}")
+    return '\n'.join(lines)
+
+
+def _worker(args):
+    os.environ.update({
+        'LINE_CHANNEL_ACCESS_TOKEN': 'benchmark', 'LINE_CHANNEL_SECRET': 'benchmark-secret',
+        'DATABASE_URL': args.database_url, 'WEBHOOK_ASYNC': '0', 'RATE_LIMIT_RATE': '0',
+    })
+    import app as app_module
+    app_module.line_bot_api = StubLineBotApi(args.line_latency)
+    app_module.broadcaster.api = app_module.line_bot_api
+    result = run_benchmark(app_module, build_scenario(args.rounds), args.concurrency)
+    app_module.shutdown_scheduler()
+    print('RESULT ' + json.dumps(result))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', choices=('sqlite', 'memory', 'both'), default='both')
+    parser.add_argument('--rounds', type=int, default=20, help='scenario repetitions')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--line-latency', type=float, default=0.0, help='simulated seconds per LINE call')
+    parser.add_argument('--json', action='store_true', help='print raw results as JSON')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--database-url', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        _worker(args)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        targets = {'sqlite': f"sqlite:///{os.path.join(tmp, 'benchmark.db')}", 'memory': 'sqlite://'}
+        for name in (('sqlite', 'memory') if args.db == 'both' else (args.db,)):
+            # An in-memory SQLite database is private to one greenlet, so it
+            # can only be driven sequentially.
+            concurrency = 1 if name == 'memory' else args.concurrency
+            output = subprocess.run(
+                [sys.executable, __file__, '--worker', '--database-url', targets[name],
+                 '--rounds', str(args.rounds), '--concurrency', str(concurrency),
+                 '--line-latency', str(args.line_latency)],
+                capture_output=True, text=True, check=True).stdout
+            result_line = next(line for line in reversed(output.splitlines()) if line.startswith('RESULT '))
+            results[name] = json.loads(result_line[len('RESULT '):])
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print('\n\n'.join(report(name, result) for name, result in results.items()))
+
+
+if __name__ == '__main__':
+    main()
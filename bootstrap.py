@@ -0,0 +1,122 @@
+# bootstrap.py
+import hashlib
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Kept on its own MetaData so the marker table exists before (and independently
+# of) the application schema it guards.
+_metadata = MetaData()
+bootstrap_state = Table(
+    'bootstrap_state', _metadata,
+    Column('key', String(50), primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+    Column('status', String(10), nullable=False),  # 'running', 'done', 'failed'
+    Column('owner', String(100), nullable=True),
+    Column('started_at', DateTime, nullable=False),
+    Column('completed_at', DateTime, nullable=True),
+)
+
+
+def fingerprint(metadata, files=(), deploy_id=None, tables=()):
+    """Hash of the schema, the seed files and the deployment id.
+
+    `tables` are extra tables kept outside `metadata`. Bootstrap only runs
+    again when one of these changes.
+    """
+    digest = hashlib.sha256()
+    digest.update((deploy_id or '').encode('utf-8'))
+    for table in list(metadata.sorted_tables) + list(tables):
+        columns = ','.join(f"{c.name}:{c.type}" for c in table.columns)
+        indexes = ','.join(sorted(ix.name or '' for ix in table.indexes))
+        digest.update(f"{table.name}({columns})[{indexes}]".encode('utf-8'))
+    for path in files:
+        digest.update(path.encode('utf-8'))
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _claim(engine, key, fp, owner, stale_after):
+    """Try to become the process that runs the bootstrap; True on success."""
+    now = datetime.utcnow()
+    row = _status(engine, key)
+    if row is None:
+        try:
+            with engine.begin() as conn:
+                conn.execute(bootstrap_state.insert().values(
+                    key=key, fingerprint=fp, status='running', owner=owner, started_at=now))
+            return True
+        except IntegrityError:
+            return False
+    if row.fingerprint == fp and row.status == 'done':
+        return False
+    stale = row.started_at < now - timedelta(seconds=stale_after)
+    if row.status == 'running' and not stale:
+        return False
+    # Compare-and-set on the row we just read so only one process wins
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(bootstrap_state)
+            .where(bootstrap_state.c.key == key,
+                   bootstrap_state.c.fingerprint == row.fingerprint,
+                   bootstrap_state.c.status == row.status,
+                   bootstrap_state.c.started_at == row.started_at)
+            .values(fingerprint=fp, status='running', owner=owner, started_at=now, completed_at=None))
+    return result.rowcount == 1
+
+
+def _finish(engine, key, owner, status):
+    with engine.begin() as conn:
+        conn.execute(
+            update(bootstrap_state)
+            .where(bootstrap_state.c.key == key, bootstrap_state.c.owner == owner)
+            .values(status=status, completed_at=datetime.utcnow()))
+
+
+def _status(engine, key):
+    with engine.connect() as conn:
+        return conn.execute(select(bootstrap_state).where(bootstrap_state.c.key == key)).first()
+
+
+def run_once(engine, key, fp, steps, wait_timeout=60.0, stale_after=300.0, poll_interval=0.5):
+    """Run `steps` once for this fingerprint across every process sharing `engine`.
+
+    The `bootstrap_state` row acts as the lock: the process that claims it runs
+    the steps, the others wait until it is marked done. Returns True if this
+    process ran the steps.
+    """
+    bootstrap_state.create(bind=engine, checkfirst=True)
+    row = _status(engine, key)
+    if row is not None and row.fingerprint == fp and row.status == 'done':
+        return False
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if _claim(engine, key, fp, owner, stale_after):
+        try:
+            for step in steps:
+                step()
+        except Exception:
+            _finish(engine, key, owner, 'failed')
+            raise
+        _finish(engine, key, owner, 'done')
+        return True
+
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        row = _status(engine, key)
+        if row is not None and row.fingerprint == fp and row.status == 'done':
+            return False
+        if row is not None and row.status == 'failed':
+            break
+        time.sleep(poll_interval)
+    logger.warning("Bootstrap '%s' was not completed by another process; continuing without it.", key)
+    return False
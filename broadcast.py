@@ -0,0 +1,143 @@
+# broadcast.py
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import gevent
+from gevent.pool import Pool
+from linebot.exceptions import LineBotApiError
+
+logger = logging.getLogger(__name__)
+
+# LINE's multicast endpoint accepts at most 500 recipients per call.
+MULTICAST_LIMIT = 500
+
+
+@dataclass
+class BatchResult:
+    index: int
+    size: int
+    elapsed: float = 0.0
+    attempts: int = 0
+    ok: bool = False
+    error: str = None
+
+
+@dataclass
+class BroadcastReport:
+    recipients: int = 0
+    elapsed: float = 0.0
+    batches: list = field(default_factory=list)
+
+    @property
+    def sent(self):
+        return sum(b.size for b in self.batches if b.ok)
+
+    @property
+    def failed(self):
+        return sum(b.size for b in self.batches if not b.ok)
+
+
+def _is_retryable(exc):
+    if isinstance(exc, LineBotApiError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    # Connection resets, timeouts and the like from the HTTP client
+    return True
+
+
+def _retry_after(exc):
+    headers = getattr(exc, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Broadcaster:
+    """Send one set of messages to many users via batched LINE multicast calls.
+
+    Recipients are de-duplicated, cut into batches of at most `batch_size`
+    IDs and sent concurrently on a bounded gevent pool. Batches failing with
+    429/5xx (or a transport error) are retried with exponential backoff; each
+    batch reuses its retry key so LINE never delivers a batch twice.
+
+    Give it a client of its own: the SDK sets the retry key as a default
+    header, which a concurrent reply on a shared client would pick up.
+    """
+
+    def __init__(self, api, pool_size=4, batch_size=MULTICAST_LIMIT,
+                 max_retries=3, backoff=0.5, max_backoff=8.0, sleep=gevent.sleep):
+        self.api = api
+        self.pool_size = pool_size
+        self.batch_size = min(batch_size, MULTICAST_LIMIT)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+
+    def send(self, user_ids, messages):
+        recipients = list(dict.fromkeys(uid for uid in user_ids if uid))
+        batches = [recipients[i:i + self.batch_size]
+                   for i in range(0, len(recipients), self.batch_size)]
+        report = BroadcastReport(recipients=len(recipients))
+        started = time.perf_counter()
+
+        pool = Pool(self.pool_size)
+        jobs = [(idx, batch, messages) for idx, batch in enumerate(batches)]
+        for result in pool.imap_unordered(self._send_batch, jobs):
+            report.batches.append(result)
+        report.batches.sort(key=lambda b: b.index)
+
+        report.elapsed = time.perf_counter() - started
+        logger.info("Broadcast to %d recipients in %d batches: %d sent, %d failed, %.3fs",
+                    report.recipients, len(batches), report.sent, report.failed, report.elapsed)
+        return report
+
+    def _send_batch(self, job):
+        index, batch, messages = job
+        result = BatchResult(index=index, size=len(batch))
+        retry_key = str(uuid.uuid4())
+        started = time.perf_counter()
+
+        while True:
+            result.attempts += 1
+            try:
+                try:
+                    self.api.multicast(batch, messages, retry_key=retry_key)
+                finally:
+                    # The SDK keeps the retry key on the client's default
+                    # headers; left there it would ride along on every later
+                    # push or reply made through the same client.
+                    self.api.headers.pop('X-Line-Retry-Key', None)
+                result.ok = True
+                break
+            except LineBotApiError as e:
+                # 409 with an accepted request id means an earlier attempt of
+                # this very batch already went through.
+                if e.status_code == 409 and getattr(e, 'accepted_request_id', None):
+                    result.ok = True
+                    break
+                if e.status_code == 401:
+                    logger.error("Authentication failed. Check LINE_CHANNEL_ACCESS_TOKEN.")
+                error = e
+            except Exception as e:
+                error = e
+
+            result.error = str(error)
+            if result.attempts > self.max_retries or not _is_retryable(error):
+                break
+            delay = _retry_after(error)
+            if delay is None:
+                delay = min(self.backoff * (2 ** (result.attempts - 1)), self.max_backoff)
+            self._sleep(delay)
+
+        if result.ok:
+            result.error = None
+        result.elapsed = time.perf_counter() - started
+        log = logger.info if result.ok else logger.error
+        log("Broadcast batch %d (%d users): %s after %d attempt(s) in %.3fs%s",
+            index, result.size, 'ok' if result.ok else 'failed', result.attempts,
+            result.elapsed, '' if result.ok else f" ({result.error})")
+        return result
@@ -0,0 +1,90 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter('cache_hits_total', 'Cache lookups that found a live entry', labelnames=('cache',))
+CACHE_MISSES = REGISTRY.counter('cache_misses_total', 'Cache lookups that found nothing or an expired entry',
+                                labelnames=('cache',))
+CACHE_EVICTIONS = REGISTRY.counter('cache_evictions_total', 'Entries evicted to stay within maxsize',
+                                   labelnames=('cache',))
+
+# Sentinel returned by TTLCache.get() when a key is absent or expired, so that
+# None can itself be cached (e.g. "this LINE user has no row yet").
+MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    A cache given a `name` also counts its hits, misses and evictions on
+    /metrics, labelled cache="<name>".
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, clock=time.monotonic, name=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    if self.name:
+                        CACHE_HITS.inc(cache=self.name)
+                    return value
+                del self._data[key]
+            self.misses += 1
+            if self.name:
+                CACHE_MISSES.inc(cache=self.name)
+            return MISSING
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                if self.name:
+                    CACHE_EVICTIONS.inc(cache=self.name)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,98 @@
+# card_catalog.py
+import threading
+from collections import namedtuple
+
+from sqlalchemy import event, or_
+
+# Immutable snapshot of a Card row, safe to share between sessions/greenlets
+CardEntry = namedtuple('CardEntry', ['id', 'card_number', 'name_zh', 'name_en'])
+
+
+def _entry(card):
+    return CardEntry(card.id, card.card_number, card.name_zh, card.name_en)
+
+
+class CardCatalog:
+    """In-memory index of the cards table keyed by name_zh and card_number.
+
+    Warmed with one query at startup. Cards created through resolve() are only
+    published to the catalog once their session commits, so a rolled back
+    transaction never leaves a phantom card behind.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._by_name = {}
+        self._by_number = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, session_factory):
+        event.listen(session_factory, 'after_commit', self._publish_pending)
+        event.listen(session_factory, 'after_rollback', self._drop_pending)
+
+    def warm(self, session):
+        cards = session.query(self.model).order_by(self.model.id).all()
+        by_name, by_number = {}, {}
+        for card in cards:
+            entry = _entry(card)
+            by_name.setdefault(entry.name_zh, entry)
+            by_number.setdefault(entry.card_number, entry)
+        with self._lock:
+            self._by_name = by_name
+            self._by_number = by_number
+        return len(cards)
+
+    def get(self, name):
+        return self._by_name.get(name) or self._by_number.get(name)
+
+    def _add(self, entry):
+        with self._lock:
+            self._by_name.setdefault(entry.name_zh, entry)
+            self._by_number.setdefault(entry.card_number, entry)
+
+    def resolve(self, session, name, create=True):
+        """Return the CardEntry for `name`, creating the card if asked to.
+
+        A new card is flushed (not committed) so it gets an id inside the
+        caller's transaction.
+        """
+        entry = self.get(name)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+
+        model = self.model
+        # Another worker may have created it since we warmed up
+        card = (session.query(model)
+                .filter(or_(model.name_zh == name, model.card_number == name))
+                .order_by(model.name_zh != name, model.id)
+                .first())
+        if card is not None:
+            entry = _entry(card)
+            self._add(entry)
+            return entry
+        if not create:
+            return None
+
+        card = model(card_number=name, name_zh=name)
+        session.add(card)
+        session.flush()
+        entry = _entry(card)
+        session.info.setdefault('new_cards', []).append(entry)
+        return entry
+
+    def _publish_pending(self, session):
+        for entry in session.info.pop('new_cards', ()):
+            self._add(entry)
+
+    def _drop_pending(self, session):
+        session.info.pop('new_cards', None)
+
+    def __len__(self):
+        return len(self._by_number)
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
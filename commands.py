@@ -0,0 +1,113 @@
+# commands.py
+import time
+from collections import namedtuple
+
+from metrics import REGISTRY, current_command
+
+COMMANDS_TOTAL = REGISTRY.counter(
+    'bot_commands_total', 'Chat commands handled, by command and outcome',
+    labelnames=('command', 'outcome'))
+COMMAND_LATENCY = REGISTRY.histogram(
+    'bot_command_seconds', 'Time spent running one chat command', labelnames=('command',))
+
+# What a command handler sees besides its parsed arguments
+CommandContext = namedtuple('CommandContext', ['user_id', 'user', 'text'])
+
+Command = namedtuple('Command', ['name', 'func', 'args', 'usage'])
+
+
+class UsageError(Exception):
+    """Raised by a handler or argument parser when the input is malformed.
+
+    The message, if any, is sent back instead of the command's usage text.
+    """
+
+
+def integer(value):
+    """Argument parser for a non-negative integer written in plain digits."""
+    if not value.isdigit():
+        raise UsageError()
+    return int(value)
+
+
+def upper(value):
+    """Argument parser for codes that are matched case-insensitively."""
+    return value.upper()
+
+
+class CommandRouter:
+    """Dispatch chat messages by (role, first word) with one dict lookup.
+
+    A command registered with N argument parsers receives the text split the
+    way `text.split(' ', N)` splits it, so its last argument keeps any spaces.
+    Commands without arguments only match the exact word.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._fallbacks = {}
+
+    def command(self, roles, name, args=(), usage=None):
+        if isinstance(roles, str):
+            roles = (roles,)
+
+        def register(func):
+            command = Command(name, func, tuple(args), usage)
+            for role in roles:
+                key = (role, name.lower())
+                if key in self._routes:
+                    raise ValueError(f"Command {name} is already registered for {role}")
+                self._routes[key] = command
+            return func
+        return register
+
+    def fallback(self, roles):
+        """Register the handler for messages that match no command of `roles`."""
+        if isinstance(roles, str):
+            roles = (roles,)
+
+        def register(func):
+            for role in roles:
+                self._fallbacks[role] = func
+            return func
+        return register
+
+    def match(self, role, text):
+        """Return (command, raw argument strings) or (None, None)."""
+        word, _, rest = text.partition(' ')
+        command = self._routes.get((role, word.lower()))
+        if command is None:
+            return None, None
+        if not command.args:
+            return (command, []) if not rest else (None, None)
+        return command, text.split(' ', len(command.args))[1:]
+
+    def dispatch(self, role, ctx):
+        """Run the command for `ctx.text`; returns the handler's reply."""
+        command, raw_args = self.match(role, ctx.text)
+        if command is None:
+            fallback = self._fallbacks.get(role)
+            COMMANDS_TOTAL.inc(command='', outcome='unmatched')
+            return fallback(ctx) if fallback is not None else None
+
+        started = time.perf_counter()
+        outcome = 'error'
+        token = current_command.set(command.name)
+        try:
+            try:
+                if len(raw_args) != len(command.args):
+                    raise UsageError()
+                args = [parse(value) for parse, value in zip(command.args, raw_args)]
+                reply = command.func(ctx, *args)
+            except UsageError as e:
+                outcome = 'usage'
+                return str(e) or command.usage
+            outcome = 'ok'
+            return reply
+        finally:
+            current_command.reset(token)
+            COMMANDS_TOTAL.inc(command=command.name, outcome=outcome)
+            COMMAND_LATENCY.observe(time.perf_counter() - started, command=command.name)
+
+    def names(self, role):
+        return [command.name for (r, _), command in self._routes.items() if r == role]
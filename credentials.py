@@ -0,0 +1,42 @@
+# credentials.py
+import threading
+
+
+class CredentialIndex:
+    """In-memory map of (role, password) -> team_name for the login commands.
+
+    Loaded from the users table with a single query at startup so that a
+    `密碼` / `管理員密碼` attempt is a dict lookup instead of a table scan.
+    `version` records which seeding state the index was built from.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.version = None
+
+    def load(self, session, user_model, version=None):
+        rows = session.query(
+            user_model.role, user_model.team_password,
+            user_model.admin_password, user_model.team_name,
+        ).filter(user_model.role.in_(('team', 'admin'))).all()
+        entries = {}
+        for role, team_password, admin_password, team_name in rows:
+            password = team_password if role == 'team' else admin_password
+            if password:
+                entries.setdefault((role, password), team_name)
+        with self._lock:
+            self._entries = entries
+            self.loaded = True
+            self.version = version
+        return len(entries)
+
+    def lookup(self, role, password):
+        return self._entries.get((role, password))
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,15 +1,120 @@
 # database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert, event, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 import os
+import time
 from dotenv import load_dotenv
+from metrics import REGISTRY, current_command
 
 # 加載 .env 檔中的環境變數
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+POOL_CHECKOUTS = REGISTRY.counter('db_pool_checkouts_total', '從連線池取出連線的次數')
+POOL_CONNECTS = REGISTRY.counter('db_pool_connects_total', '建立新資料庫連線的次數')
+POOL_WAIT = REGISTRY.histogram('db_pool_wait_seconds', '等待連線池釋出連線的時間')
+QUERIES = REGISTRY.counter('db_queries_total', '執行的 SQL 敘述數量 (依指令分類)', labelnames=('command',))
+QUERY_TIME = REGISTRY.histogram('db_query_seconds', '單一 SQL 敘述的執行時間 (依指令分類)', labelnames=('command',))
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+class InstrumentedQueuePool(QueuePool):
+    """記錄每次取得連線所等待時間的 QueuePool"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started)
+
+def _set_sqlite_pragmas(use_wal):
+    busy_timeout = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if use_wal:
+            # WAL 讓讀取不會被寫入阻塞，多個 worker 同時存取時效果明顯
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        cursor.close()
+
+    return on_connect
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    command = current_command.get()
+    QUERIES.inc(command=command)
+    QUERY_TIME.observe(time.perf_counter() - started, command=command)
+
+def _on_query_error(exception_context):
+    # 失敗的敘述不會觸發 after_cursor_execute，在此移除其開始時間
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+        QUERIES.inc(command=current_command.get())
+
+def build_engine(url):
+    """依據環境變數建立 engine。
+
+    SQLite：開啟 WAL、busy_timeout 與 synchronous=NORMAL。
+    其他資料庫 (PostgreSQL)：以 DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT /
+    DB_POOL_RECYCLE 設定連線池大小，並預設開啟 pool_pre_ping。
+    """
+    parsed = make_url(url)
+    is_sqlite = parsed.get_backend_name() == 'sqlite'
+    in_memory = is_sqlite and parsed.database in (None, '', ':memory:')
+    kwargs = {}
+    if not in_memory:
+        kwargs.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5" if is_sqlite else "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10" if is_sqlite else "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        )
+    if not is_sqlite:
+        kwargs.update(
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING", True),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        )
+
+    new_engine = create_engine(url, **kwargs)
+    if is_sqlite:
+        use_wal = not in_memory and _env_bool("SQLITE_WAL", True)
+        event.listen(new_engine, 'connect', _set_sqlite_pragmas(use_wal))
+    event.listen(new_engine, 'connect', lambda *args: POOL_CONNECTS.inc())
+    event.listen(new_engine, 'checkout', lambda *args: POOL_CHECKOUTS.inc())
+    # 依目前處理中的聊天指令統計 SQL 數量與耗時
+    event.listen(new_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(new_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(new_engine, 'handle_error', _on_query_error)
+    return new_engine
+
+def pool_stats(bind=None):
+    """目前連線池的使用狀況，用於調整尖峰時段的連線池大小"""
+    pool = (bind or engine).pool
+    stats = {
+        'pool': type(pool).__name__,
+        'connects': POOL_CONNECTS.value(),
+        'checkouts': POOL_CHECKOUTS.value(),
+        'wait': POOL_WAIT.summary(),
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+    return stats
+
+engine = build_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -21,6 +126,55 @@ def get_db():
     finally:
         db.close()
 
+def ensure_indexes(bind, metadata):
+    """為已存在的資料表補建索引 (create_all 只會在建立新表時建立索引)"""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+def ensure_columns(bind, metadata):
+    """為已存在的資料表補上新增的欄位 (create_all 不會修改既有資料表)
+
+    只補可為 NULL 的欄位，舊資料列在新欄位中皆為 NULL；回傳新增的欄位名稱。
+    """
+    inspector = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+    added = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as conn:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}")
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+def dialect_insert(bind, table):
+    """回傳支援 ON CONFLICT 的 INSERT (SQLite / PostgreSQL)，其他資料庫則為一般 INSERT"""
+    name = bind.dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table)
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table)
+    return insert(table)
+
+def lock_for_write(session):
+    """在交易一開始取得寫入鎖。
+
+    PostgreSQL 搭配查詢上的 with_for_update() 鎖定資料列；SQLite 不支援
+    SELECT ... FOR UPDATE，因此以 BEGIN IMMEDIATE 直接取得資料庫寫入鎖。
+    必須在 session 執行任何寫入之前呼叫。
+    """
+    if session.get_bind().dialect.name == 'sqlite':
+        session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+
 # 示例：初始化資料庫 (在 app.py 中調用)
 def init_db():
     # 這裡可以導入所有模型，然後調用 Base.metadata.create_all(engine)
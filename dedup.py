@@ -0,0 +1,78 @@
+# dedup.py
+import threading
+import time
+
+from sqlalchemy import Column, Float, MetaData, String, Table
+
+from cache import TTLCache, MISSING
+from database import dialect_insert
+from metrics import REGISTRY
+
+DUPLICATES = REGISTRY.counter(
+    'webhook_duplicate_events_total', 'Redelivered webhook events that were skipped, by where they were caught',
+    labelnames=('store',))
+
+_metadata = MetaData()
+processed_events = Table(
+    'processed_events', _metadata,
+    Column('event_key', String(100), primary_key=True),
+    Column('processed_at', Float, nullable=False, index=True),
+)
+
+
+def event_key(event):
+    """Identify a webhook event across redeliveries, or None if it cannot be."""
+    webhook_event_id = getattr(event, 'webhook_event_id', None)
+    if webhook_event_id:
+        return webhook_event_id
+    message = getattr(event, 'message', None)
+    if message is not None and getattr(message, 'id', None):
+        return f"message:{message.id}"
+    return None
+
+
+class EventDeduplicator:
+    """Remembers recently handled webhook events for `ttl` seconds.
+
+    The in-memory set catches redeliveries that reach the same worker. With an
+    engine, processed_events is checked too, so a redelivery routed to another
+    worker is skipped as well.
+    """
+
+    def __init__(self, ttl=600.0, maxsize=10000, engine=None, clock=time.time):
+        self.ttl = ttl
+        self.engine = engine
+        self._clock = clock
+        self._seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Return True if `key` has not been seen yet (and mark it seen)."""
+        with self._lock:
+            if self._seen.get(key) is not MISSING:
+                DUPLICATES.inc(store='memory')
+                return False
+            self._seen.set(key, True)
+        if self.engine is None:
+            return True
+        stmt = dialect_insert(self.engine, processed_events).values(event_key=key, processed_at=self._clock())
+        if hasattr(stmt, 'on_conflict_do_nothing'):
+            stmt = stmt.on_conflict_do_nothing(index_elements=['event_key'])
+        with self.engine.begin() as conn:
+            if conn.execute(stmt).rowcount == 1:
+                return True
+        DUPLICATES.inc(store='db')
+        return False
+
+    def forget(self, key):
+        """Let `key` be handled again, e.g. after its handler failed."""
+        self._seen.invalidate(key)
+        if self.engine is not None:
+            with self.engine.begin() as conn:
+                conn.execute(processed_events.delete().where(processed_events.c.event_key == key))
+
+    def sweep(self):
+        cutoff = self._clock() - self.ttl
+        with self.engine.begin() as conn:
+            return conn.execute(
+                processed_events.delete().where(processed_events.c.processed_at < cutoff)).rowcount
@@ -0,0 +1,106 @@
+# event_bus.py
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+EVENTS_PUBLISHED = REGISTRY.counter(
+    'bus_events_published_total', 'Game events published on the in-process bus', labelnames=('type',))
+EVENTS_DROPPED = REGISTRY.counter(
+    'bus_events_dropped_total', 'Events dropped because a subscriber buffer was full')
+SUBSCRIBERS = REGISTRY.gauge(
+    'bus_subscribers', 'Open event stream subscriptions')
+
+
+def format_sse(event_id, event_type, data):
+    """Encode one server-sent event; `data` is serialized as one JSON line."""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+    return f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """A bounded buffer of encoded events for one reader.
+
+    When the reader falls behind, the oldest events are dropped so that
+    publishers never wait; `dropped` tells the reader it missed some.
+    """
+
+    def __init__(self, types=None, maxsize=100):
+        self.types = frozenset(types) if types else None
+        self._buffer = deque(maxlen=maxsize)
+        self._ready = threading.Event()
+        self.dropped = 0
+
+    def wants(self, event_type):
+        return self.types is None or event_type in self.types
+
+    def put(self, message):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+            EVENTS_DROPPED.inc()
+        self._buffer.append(message)
+        self._ready.set()
+
+    def get(self, timeout=None):
+        """Wait up to `timeout` seconds and return every buffered message."""
+        if not self._buffer:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        messages = []
+        while self._buffer:
+            messages.append(self._buffer.popleft())
+        return messages
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class EventBus:
+    """In-process publish/subscribe for game state changes.
+
+    publish() encodes an event once and appends it to every matching
+    subscriber's buffer; it never blocks. The last `history` events are kept
+    so a reconnecting client can catch up from its Last-Event-ID.
+    """
+
+    def __init__(self, history=256, clock=time.time):
+        self._subscribers = set()
+        self._history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._clock = clock
+        SUBSCRIBERS.set_function(lambda: len(self._subscribers))
+
+    def publish(self, event_type, **data):
+        data['at'] = self._clock()
+        with self._lock:
+            event_id = next(self._ids)
+            message = format_sse(event_id, event_type, data)
+            self._history.append((event_id, event_type, message))
+            subscribers = list(self._subscribers)
+        EVENTS_PUBLISHED.inc(type=event_type)
+        for subscription in subscribers:
+            if subscription.wants(event_type):
+                subscription.put(message)
+        return event_id
+
+    def subscribe(self, types=None, maxsize=100, last_event_id=None):
+        subscription = Subscription(types, maxsize)
+        with self._lock:
+            if last_event_id is not None:
+                for event_id, event_type, message in self._history:
+                    if event_id > last_event_id and subscription.wants(event_type):
+                        subscription.put(message)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def __len__(self):
+        return len(self._subscribers)
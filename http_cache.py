@@ -0,0 +1,59 @@
+# http_cache.py
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+from cache import TTLCache, MISSING
+
+
+class VersionedJsonCache:
+    """Serve JSON documents keyed by a state version, with ETags and gzip.
+
+    A document is built and encoded once per version and process; a client
+    that already has that version gets a bodyless 304.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0, gzip_enabled=True, min_gzip_size=1024):
+        self._bodies = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.gzip_enabled = gzip_enabled
+        self.min_gzip_size = min_gzip_size
+
+    def respond(self, key, version, build):
+        """Answer the current request with build()'s result for `version`.
+
+        `version` is anything that changes whenever the document may change,
+        e.g. a state counter or a dotted string of them; its text ends up in
+        the ETag, so it must be ASCII.
+        """
+        # Header values must be latin-1, and keys can hold team names
+        etag = f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}-{version}"
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        bodies = self._bodies.get(etag)
+        if bodies is MISSING:
+            body = json.dumps(build(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            compressed = None
+            if self.gzip_enabled and len(body) >= self.min_gzip_size:
+                compressed = gzip.compress(body, compresslevel=6)
+            bodies = (body, compressed)
+            self._bodies.set(etag, bodies)
+        body, compressed = bodies
+
+        use_gzip = compressed is not None and 'gzip' in request.accept_encodings
+        response = Response(compressed if use_gzip else body, mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        if self.gzip_enabled:
+            response.vary.add('Accept-Encoding')
+        response.set_etag(etag, weak=True)
+        # Always revalidate; the 304 makes that cheap
+        response.cache_control.no_cache = True
+        return response
+
+    def clear(self):
+        self._bodies.clear()
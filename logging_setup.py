@@ -0,0 +1,152 @@
+# logging_setup.py
+import json
+import logging
+import random
+import time
+import zlib
+from contextvars import ContextVar
+from logging.handlers import QueueHandler
+
+try:
+    from gevent.monkey import get_original
+except ImportError:  # pragma: no cover - gevent is always installed in production
+    get_original = None
+
+# Correlation id of the webhook request (or event) being handled, so every log
+# line it produces can be grouped together.
+request_id = ContextVar('request_id', default='-')
+
+# Attributes every LogRecord has; anything else was passed through `extra=`.
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+def parse_level(name, default=logging.INFO):
+    """Level number for a name like 'debug' or '10'; `default` if it is unset or unknown."""
+    if not name:
+        return default
+    name = name.strip().upper()
+    if name.isdigit():
+        return int(name)
+    level = logging.getLevelName(name)
+    # getLevelName() answers 'Level FOO' for names it does not know
+    return level if isinstance(level, int) else default
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamp each record with the current request id."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below `always_level`.
+
+    Sampling is decided per request id, so a sampled request keeps all of its
+    log lines. Warnings and errors are always kept.
+    """
+
+    def __init__(self, rate=1.0, always_level=logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.always_level = always_level
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= self.always_level:
+            return True
+        rid = getattr(record, 'request_id', None) or request_id.get()
+        if rid == '-':
+            return random.random() < self.rate
+        return zlib.crc32(rid.encode('utf-8')) % 10000 < self.rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed with `extra=` are included."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _native_queue_and_thread():
+    """A queue and thread starter that bypass gevent's monkey patching.
+
+    The listener has to run on a real OS thread so a slow disk or pipe never
+    blocks the hub; the queue is the C SimpleQueue, which is safe to use
+    between that thread and greenlets.
+    """
+    if get_original is not None:
+        return get_original('queue', 'SimpleQueue')(), get_original('_thread', 'start_new_thread')
+    import _thread
+    import queue
+    return queue.SimpleQueue(), _thread.start_new_thread
+
+
+class QueueLogListener:
+    """Drain a log queue into `handlers` on a dedicated OS thread."""
+
+    def __init__(self, queue, handlers, start_thread):
+        self.queue = queue
+        self.handlers = list(handlers)
+        self._start_thread = start_thread
+        self._done = False
+
+    def start(self):
+        self._start_thread(self._run, ())
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        self._done = True
+
+    def stop(self, timeout=2.0):
+        """Flush what is queued and stop the thread."""
+        self.queue.put_nowait(None)
+        deadline = time.monotonic() + timeout
+        while not self._done and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def configure_logging(fmt='json', level=logging.INFO, sample_rate=1.0, stream=None):
+    """Send every log record through a queue to a stream handler on its own thread.
+
+    Returns the listener so callers can stop() it on shutdown.
+    """
+    queue, start_thread = _native_queue_and_thread()
+    target = logging.StreamHandler(stream)
+    if fmt == 'json':
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s'))
+
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(CorrelationFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueLogListener(queue, [target], start_thread)
+    listener.start()
+    return listener
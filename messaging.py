@@ -0,0 +1,126 @@
+# messaging.py
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
+from linebot.models import TextSendMessage
+
+from metrics import REGISTRY
+
+# LINE limits: characters per text message, and messages per reply token.
+LINE_TEXT_LIMIT = 5000
+MAX_REPLY_MESSAGES = 5
+
+# Appended to the last bubble when a reply had to be cut short
+TRUNCATED_NOTICE = "\n…(內容過長，僅顯示部分)"
+
+LINE_API_LATENCY = REGISTRY.histogram(
+    'line_api_request_seconds', 'Time spent on one HTTP call to the LINE API', labelnames=('method',))
+LINE_API_REQUESTS = REGISTRY.counter(
+    'line_api_requests_total', 'HTTP calls to the LINE API by method and status', labelnames=('method', 'status'))
+REPLY_LATENCY = REGISTRY.histogram(
+    'line_reply_seconds', 'Time spent sending one reply_message call')
+REPLY_TRUNCATED = REGISTRY.counter(
+    'line_replies_truncated_total', 'Replies that did not fit in the per-reply message limit')
+
+
+def split_text(text, limit=LINE_TEXT_LIMIT):
+    """Split `text` into chunks of at most `limit` characters.
+
+    Chunks break on line boundaries; a single line longer than the limit is
+    cut into pieces.
+    """
+    if len(text) <= limit:
+        return [text]
+    chunks = []
+    current = ''
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_reply(reply, limit=LINE_TEXT_LIMIT, max_messages=MAX_REPLY_MESSAGES):
+    """Turn a reply (a string or a list of strings) into at most `max_messages` bubbles.
+
+    Long texts are split on line boundaries. If that gives too many bubbles,
+    adjacent ones are merged while they fit, and whatever is still left over
+    is dropped with a notice on the last bubble.
+    """
+    parts = [reply] if isinstance(reply, str) else reply
+    chunks = [chunk for part in parts if part for chunk in split_text(part, limit)]
+    if len(chunks) > max_messages:
+        merged = []
+        for chunk in chunks:
+            if merged and len(merged[-1]) + 1 + len(chunk) <= limit:
+                merged[-1] = f"{merged[-1]}\n{chunk}"
+            else:
+                merged.append(chunk)
+        chunks = merged
+    if len(chunks) > max_messages:
+        REPLY_TRUNCATED.inc()
+        chunks = chunks[:max_messages]
+        chunks[-1] = chunks[-1][:limit - len(TRUNCATED_NOTICE)] + TRUNCATED_NOTICE
+    return [TextSendMessage(text=chunk) for chunk in chunks]
+
+
+def send_reply(api, reply_token, reply):
+    """Reply with `reply` using a single reply_message call."""
+    messages = build_reply(reply)
+    started = time.perf_counter()
+    try:
+        api.reply_message(reply_token, messages[0] if len(messages) == 1 else messages)
+    finally:
+        REPLY_LATENCY.observe(time.perf_counter() - started)
+
+
+class PooledHttpClient(RequestsHttpClient):
+    """RequestsHttpClient that keeps one requests.Session for every call.
+
+    Connections to api.line.me are reused from a keep-alive pool instead of
+    being opened (with a fresh TLS handshake) for each request.
+    """
+
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT, pool_maxsize=10):
+        super().__init__(timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, method, url, timeout, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(
+                method, url, timeout=self.timeout if timeout is None else timeout, **kwargs)
+            status = response.status_code
+            return RequestsHttpResponse(response)
+        finally:
+            LINE_API_LATENCY.observe(time.perf_counter() - started, method=method)
+            LINE_API_REQUESTS.inc(method=method, status=status)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request('GET', url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request('POST', url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request('DELETE', url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request('PUT', url, timeout, headers=headers, data=data)
@@ -0,0 +1,327 @@
+# metrics.py
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+# Default latency buckets in seconds, from 5ms up to 10s.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The chat command being handled by the current thread/greenlet, so that lower
+# layers (e.g. the DB query counters) can attribute their work to it.
+current_command = ContextVar('current_command', default='none')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help='', labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return a list of (label values, value) pairs."""
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help='', labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from `function` at collection time."""
+        self._function = function
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is not None:
+            return [((), self._function())]
+        return super().samples()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['count'] += 1
+            state['sum'] += value
+            state['max'] = max(state['max'], value)
+
+    def summary(self, **labels):
+        state = self._values.get(self._key(labels))
+        if not state:
+            return {'count': 0, 'sum': 0.0, 'max': 0.0, 'avg': 0.0}
+        return {'count': state['count'], 'sum': state['sum'], 'max': state['max'],
+                'avg': state['sum'] / state['count']}
+
+    def samples(self):
+        with self._lock:
+            return [(key, {'buckets': list(state['buckets']), 'count': state['count'],
+                           'sum': state['sum'], 'max': state['max']})
+                    for key, state in self._values.items()]
+
+
+class Registry:
+    """Process-wide collection of named metrics."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name, help='', labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help='', labelnames=()):
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+
+REGISTRY = Registry()
+
+
+def _snapshot_metric(metric):
+    entry = {'kind': metric.kind, 'help': metric.help, 'labelnames': list(metric.labelnames),
+             'samples': [[list(key), value] for key, value in metric.samples()]}
+    if metric.kind == 'histogram':
+        entry['buckets'] = list(metric.buckets)
+    return entry
+
+
+def snapshot(registry=None):
+    """JSON-serializable copy of every metric in `registry`."""
+    return {metric.name: _snapshot_metric(metric) for metric in (registry or REGISTRY).metrics()}
+
+
+def _merge_value(kind, current, value):
+    if current is None:
+        return dict(value, buckets=list(value['buckets'])) if kind == 'histogram' else value
+    if kind == 'histogram':
+        current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+        current['count'] += value['count']
+        current['sum'] += value['sum']
+        current['max'] = max(current['max'], value['max'])
+        return current
+    return current + value
+
+
+def merge_snapshots(snapshots):
+    """Add up several snapshots (one per worker) into one.
+
+    Counters, gauges and histogram buckets are summed per label set.
+    """
+    merged = {}
+    for snap in snapshots:
+        for name, entry in snap.items():
+            target = merged.setdefault(name, dict(entry, samples={}))
+            for key, value in entry['samples']:
+                key = tuple(key)
+                target['samples'][key] = _merge_value(entry['kind'], target['samples'].get(key), value)
+    for entry in merged.values():
+        entry['samples'] = list(entry['samples'].items())
+    return merged
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_start_tokens = {}
+
+
+def _start_token():
+    """Tells this process apart from earlier ones that had the same pid."""
+    pid = os.getpid()
+    if pid not in _start_tokens:
+        _start_tokens[pid] = f"{time.time_ns() // 1000000:x}"
+    return _start_tokens[pid]
+
+
+def _snapshot_owner(filename):
+    """(pid, token) for a '<pid>-<token>.json' snapshot file, else None."""
+    name, ext = os.path.splitext(filename)
+    pid, _, token = name.partition('-')
+    if ext != '.json' or not pid.isdigit() or not token:
+        return None
+    return int(pid), token
+
+
+def write_snapshot(directory, registry=None, pid=None, token=None):
+    """Write this process's metrics to <directory>/<pid>-<token>.json (atomically)."""
+    pid = pid or os.getpid()
+    token = token or _start_token()
+    path = os.path.join(directory, f"{pid}-{token}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(registry), f)
+    os.replace(tmp, path)
+
+
+def collect(directory=None, registry=None, max_age=None):
+    """Metrics of this process, plus those of the other workers sharing `directory`.
+
+    Snapshots of workers that are gone (their pid is not running, or the file
+    was not rewritten within `max_age` seconds) are deleted. Their totals drop
+    out with them, which Prometheus handles like any counter reset.
+    """
+    snapshots = [snapshot(registry)]
+    if directory and os.path.isdir(directory):
+        own = (os.getpid(), _start_token())
+        now = time.time()
+        for filename in os.listdir(directory):
+            owner = _snapshot_owner(filename)
+            if owner is None or owner == own:
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stale = (owner[0] == own[0] or not _pid_alive(owner[0])
+                         or (max_age is not None and os.path.getmtime(path) < now - max_age))
+                if stale:
+                    os.remove(path)
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return merge_snapshots(snapshots)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render_text(families):
+    """Format collected metrics in the Prometheus text exposition format."""
+    lines = []
+    for name in sorted(families):
+        entry = families[name]
+        names = entry['labelnames']
+        lines.append(f"# HELP {name} {_escape(entry['help'])}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        for key, value in sorted(entry['samples'], key=lambda sample: sample[0]):
+            if entry['kind'] != 'histogram':
+                lines.append(f"{name}{_labels(names, key)} {value}")
+                continue
+            for bound, count in zip(entry['buckets'], value['buckets']):
+                lines.append(f"{name}_bucket{_labels(names, key, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_labels(names, key, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_labels(names, key)} {value['sum']}")
+            lines.append(f"{name}_count{_labels(names, key)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+class SnapshotWriter:
+    """Periodically writes this worker's metrics to a shared directory.
+
+    Started lazily and once per process, so it also works when the app is
+    imported before gunicorn forks its workers.
+    """
+
+    def __init__(self, directory, interval=5.0, registry=None):
+        self.directory = directory
+        self.interval = interval
+        self.registry = registry
+        self._pid = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        os.makedirs(self.directory, exist_ok=True)
+        threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def flush(self):
+        write_snapshot(self.directory, self.registry)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except OSError:
+                pass
@@ -0,0 +1,125 @@
+# ratelimit.py
+import threading
+import time
+
+from sqlalchemy import Column, Float, MetaData, String, Table, case, update
+
+from database import dialect_insert
+from metrics import REGISTRY
+
+THROTTLED = REGISTRY.counter(
+    'rate_limited_total', 'Messages shed by the rate limiter, by reason', labelnames=('reason',))
+IN_FLIGHT = REGISTRY.gauge(
+    'handlers_in_flight', 'Messages currently being handled')
+
+_metadata = MetaData()
+rate_limit_buckets = Table(
+    'rate_limit_buckets', _metadata,
+    Column('key', String(100), primary_key=True),
+    Column('tokens', Float, nullable=False),
+    Column('updated_at', Float, nullable=False),
+)
+
+
+class MemoryRateLimiter:
+    """Token bucket per key: `burst` messages at once, refilled at `rate` per second.
+
+    Buckets are process-local, so with several workers each one enforces the
+    limit on its own share of the traffic.
+    """
+
+    def __init__(self, rate=1.0, burst=10, clock=time.monotonic, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = self._clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket
+        full = [key for key, (tokens, updated_at) in self._buckets.items()
+                if tokens + (now - updated_at) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+    def sweep(self):
+        with self._lock:
+            before = len(self._buckets)
+            self._prune(self._clock())
+            return before - len(self._buckets)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SqlRateLimiter:
+    """Token buckets in the rate_limit_buckets table, shared by all workers.
+
+    Taking a token is a single conditional UPDATE, so concurrent workers can
+    never spend the same token twice.
+    """
+
+    def __init__(self, engine, rate=1.0, burst=10, clock=time.time):
+        self.engine = engine
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+
+    def allow(self, key):
+        now = self._clock()
+        t = rate_limit_buckets
+        refilled = t.c.tokens + (now - t.c.updated_at) * self.rate
+        available = case((refilled > self.burst, self.burst), else_=refilled)
+        take = (update(t)
+                .where(t.c.key == key, available >= 1)
+                .values(tokens=available - 1, updated_at=now))
+        with self.engine.begin() as conn:
+            if conn.execute(take).rowcount == 1:
+                return True
+            # Either the bucket is empty or this is the key's first message
+            stmt = dialect_insert(self.engine, t).values(key=key, tokens=self.burst - 1, updated_at=now)
+            if hasattr(stmt, 'on_conflict_do_nothing'):
+                stmt = stmt.on_conflict_do_nothing(index_elements=['key'])
+            if conn.execute(stmt).rowcount == 1:
+                return True
+            # Inserted by another worker in the meantime
+            return conn.execute(take).rowcount == 1
+
+    def sweep(self):
+        """Delete buckets that have been idle long enough to be full again."""
+        cutoff = self._clock() - self.burst / self.rate
+        with self.engine.begin() as conn:
+            return conn.execute(
+                rate_limit_buckets.delete().where(rate_limit_buckets.c.updated_at < cutoff)).rowcount
+
+
+class ConcurrencyLimit:
+    """Non-blocking cap on how many messages are handled at the same time."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._in_flight = 0
+        IN_FLIGHT.set_function(lambda: self._in_flight)
+
+    def try_acquire(self):
+        if not self._semaphore.acquire(blocking=False):
+            return False
+        self._in_flight += 1
+        return True
+
+    def release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
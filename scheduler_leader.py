@@ -0,0 +1,148 @@
+# scheduler_leader.py
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from apscheduler.jobstores.base import BaseJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from sqlalchemy import Column, DateTime, Float, LargeBinary, MetaData, String, Table, Unicode, insert, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+scheduler_leases = Table(
+    'scheduler_leases', _metadata,
+    Column('name', String(50), primary_key=True),
+    Column('holder', String(100), nullable=False),
+    Column('expires_at', DateTime, nullable=False),
+)
+# Same layout as the table SQLAlchemyJobStore would create for itself
+apscheduler_jobs = Table(
+    'apscheduler_jobs', _metadata,
+    Column('id', Unicode(191), primary_key=True),
+    Column('next_run_time', Float(25), index=True),
+    Column('job_state', LargeBinary, nullable=False),
+)
+
+
+class BootstrappedJobStore(SQLAlchemyJobStore):
+    """SQLAlchemyJobStore on `apscheduler_jobs` that leaves creating it to the bootstrap.
+
+    The stock store runs CREATE TABLE whenever a scheduler starts, i.e. in
+    every worker.
+    """
+
+    def __init__(self, engine, **kwargs):
+        super().__init__(engine=engine, **kwargs)
+        self.jobs_t = apscheduler_jobs
+
+    def start(self, scheduler, alias):
+        BaseJobStore.start(self, scheduler, alias)
+
+
+class LeaderLease:
+    """A named, expiring lease row; whoever holds it is the leader.
+
+    The holder has to renew it more often than `ttl`. If it dies, another
+    process takes over once the lease expires.
+    """
+
+    def __init__(self, engine, name, ttl=30.0, holder=None, clock=datetime.utcnow):
+        self.engine = engine
+        self.name = name
+        self.ttl = timedelta(seconds=ttl)
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self._clock = clock
+        self.is_leader = False
+
+    def try_acquire(self):
+        """Take or renew the lease; returns whether this process now holds it."""
+        now = self._clock()
+        values = dict(holder=self.holder, expires_at=now + self.ttl)
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(scheduler_leases)
+                .where(scheduler_leases.c.name == self.name,
+                       (scheduler_leases.c.holder == self.holder) | (scheduler_leases.c.expires_at < now))
+                .values(**values))
+            acquired = result.rowcount == 1
+        if not acquired:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(insert(scheduler_leases).values(name=self.name, **values))
+                acquired = True
+            except IntegrityError:
+                acquired = False
+        self.is_leader = acquired
+        return acquired
+
+    def release(self):
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(scheduler_leases)
+                .where(scheduler_leases.c.name == self.name, scheduler_leases.c.holder == self.holder)
+                .values(expires_at=datetime(1970, 1, 1)))
+        self.is_leader = False
+
+
+class LeaderElection:
+    """Background loop that keeps trying to acquire/renew a LeaderLease.
+
+    `on_elected` runs when this process becomes leader, `on_deposed` when it
+    loses the lease, and `on_tick` on every successful renewal.
+    """
+
+    def __init__(self, lease, interval=10.0, on_elected=None, on_deposed=None, on_tick=None):
+        self.lease = lease
+        self.interval = interval
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.on_tick = on_tick
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.check()
+        self._thread = threading.Thread(target=self._run, name=f'leader-{self.lease.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.lease.is_leader:
+            try:
+                self.lease.release()
+            except Exception as e:
+                logger.error(f"Failed to release lease {self.lease.name}: {e}")
+
+    def check(self):
+        was_leader = self.lease.is_leader
+        try:
+            leader = self.lease.try_acquire()
+        except Exception as e:
+            logger.error(f"Leader election for {self.lease.name} failed: {e}")
+            leader = False
+            self.lease.is_leader = False
+        if leader and not was_leader:
+            logger.info("Process %s elected leader for %s", self.lease.holder, self.lease.name)
+            self._notify(self.on_elected)
+        elif was_leader and not leader:
+            logger.warning("Process %s lost leadership for %s", self.lease.holder, self.lease.name)
+            self._notify(self.on_deposed)
+        elif leader:
+            self._notify(self.on_tick)
+        return leader
+
+    def _notify(self, callback):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Leader callback for {self.lease.name} failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
@@ -0,0 +1,68 @@
+import importlib
+import itertools
+import sys
+
+import pytest
+
+from test.line_stub import FakeLineBotApi
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    """Reload database.py and app.py against a fresh SQLite file."""
+    monkeypatch.setenv('LINE_CHANNEL_ACCESS_TOKEN', 'dummy')
+    monkeypatch.setenv('LINE_CHANNEL_SECRET', 'dummy')
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setenv('API_TOKEN', 'test-token')
+
+    # Reload database.py first: a module imported during collection (e.g.
+    # trade_store) may already have bound it to the .env DATABASE_URL.
+    import database
+    importlib.reload(database)
+    if 'app' in sys.modules:
+        app = importlib.reload(sys.modules['app'])
+    else:
+        import app
+
+    yield app
+
+    app.shutdown_scheduler()
+
+
+@pytest.fixture
+def api_client(app_module):
+    """Test client that sends the API token with every request."""
+    client = app_module.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer test-token'
+    return client
+
+
+@pytest.fixture
+def fake_line_api():
+    return FakeLineBotApi()
+
+
+@pytest.fixture
+def send_text(app_module, fake_line_api, monkeypatch):
+    """Feed a text message through handle_message and return the reply texts."""
+    from linebot.models import MessageEvent
+
+    monkeypatch.setattr(app_module, 'line_bot_api', fake_line_api)
+
+    message_ids = itertools.count(1)
+
+    def send(user_id, text):
+        event = MessageEvent.new_from_json_dict({
+            'type': 'message', 'replyToken': f'token-{user_id}', 'timestamp': 0, 'mode': 'active',
+            'source': {'type': 'user', 'userId': user_id},
+            'message': {'type': 'text', 'id': str(next(message_ids)), 'text': text},
+        })
+        before = len(fake_line_api.calls['reply_message'])
+        app_module.handle_message(event)
+        replies = []
+        for _, messages in fake_line_api.calls['reply_message'][before:]:
+            messages = messages if isinstance(messages, list) else [messages]
+            replies.extend(m.text for m in messages)
+        return replies
+
+    return send
@@ -0,0 +1,30 @@
+from linebot.exceptions import LineBotApiError
+from linebot.models.error import Error
+
+
+class FakeLineBotApi:
+    """Local stand-in for linebot.LineBotApi that records outgoing calls.
+
+    `failures` maps a call number (1-based, counted per method) to the HTTP
+    status the call should fail with.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.headers = {}
+        self.calls = {'multicast': [], 'push_message': [], 'reply_message': []}
+
+    def _record(self, method, *args):
+        self.calls[method].append(args)
+        status = self.failures.get((method, len(self.calls[method])))
+        if status:
+            raise LineBotApiError(status, {}, error=Error(message=f'HTTP {status}'))
+
+    def multicast(self, to, messages, retry_key=None, **kwargs):
+        self._record('multicast', list(to), messages, retry_key)
+
+    def push_message(self, to, messages, **kwargs):
+        self._record('push_message', to, messages)
+
+    def reply_message(self, reply_token, messages, **kwargs):
+        self._record('reply_message', reply_token, messages)
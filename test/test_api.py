@@ -0,0 +1,79 @@
+import gzip
+
+
+def test_etag_changes_only_when_the_state_changes(app_module, api_client, send_text):
+    app = app_module
+    client = api_client
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+    send_text('Uadmin', '添加任務 M1 尋寶 找到寶藏')
+
+    first = client.get('/api/missions')
+    assert first.status_code == 200
+    assert first.get_json()[0]['code'] == 'M1'
+    etag = first.headers['ETag']
+
+    again = client.get('/api/missions', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+    # A card change leaves the missions document alone
+    send_text('Uteam', '密碼 team_pass1')
+    send_text('Uteam', '新增卡牌 火 2')
+    assert client.get('/api/missions', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/teams/隊伍-team_pass1/inventory').get_json() == [{'card': '火', 'quantity': 2}]
+    assert client.get('/api/inventories').get_json() == {'隊伍-team_pass1': [{'card': '火', 'quantity': 2}]}
+    assert client.get('/api/teams').get_json() == [{'team': '隊伍-team_pass1', 'members': 1}]
+
+    send_text('Uteam', '完成任務 M1')
+    changed = client.get('/api/missions', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.get_json()[0]['completed_by_team'] == '隊伍-team_pass1'
+
+
+def test_large_documents_are_gzipped(app_module, api_client, send_text):
+    app = app_module
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+    for i in range(3):
+        assert app.schedule_announcement('公告' * 200 + str(i), '2099-01-01 10:00')
+
+    client = api_client
+    plain = client.get('/api/announcements')
+    zipped = client.get('/api/announcements', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.data) == plain.data
+    assert len(zipped.data) < len(plain.data)
+    assert [a['sent'] for a in plain.get_json()] == [False, False, False]
+
+
+def test_headers_stay_latin1_for_non_ascii_team_names(app_module, api_client, send_text):
+    app = app_module
+    send_text('Uteam', '密碼 team_pass1')
+    send_text('Uteam', '新增卡牌 火 2')
+    client = api_client
+
+    # Real WSGI servers (gevent's pywsgi included) refuse non-latin-1 header values
+    first = client.get('/api/teams/隊伍-team_pass1/inventory')
+    for name, value in first.headers.items():
+        value.encode('latin-1')
+    assert first.get_json() == [{'card': '火', 'quantity': 2}]
+    assert client.get('/api/teams/隊伍-team_pass1/inventory',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    # Another team's document never shares the ETag
+    assert client.get('/api/teams/隊伍-team_pass2/inventory').headers['ETag'] != first.headers['ETag']
+
+
+def test_api_and_events_require_the_token(app_module, api_client, monkeypatch):
+    app = app_module
+    anonymous = app.app.test_client()
+    assert anonymous.get('/api/inventories').status_code == 401
+    assert anonymous.get('/api/inventories', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert anonymous.get('/api/inventories?access_token=test-token').status_code == 200
+    # Cards held by a seeded placeholder account are not a real team's
+    session = app.Session()
+    assert app.apply_card_changes(session, app.find_team('隊伍-1'), {'火': 1}) == (True, None)
+    session.close()
+    assert api_client.get('/api/inventories').get_json() == {}
+
+    monkeypatch.setattr(app, 'API_TOKEN', None)
+    assert api_client.get('/api/teams').status_code == 403
@@ -0,0 +1,21 @@
+import benchmark
+
+
+def test_benchmark_scenario_covers_every_command(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'rate_limiter', None)
+    stub = benchmark.StubLineBotApi()
+    monkeypatch.setattr(app, 'line_bot_api', stub)
+
+    steps = benchmark.build_scenario(rounds=2)
+    result = benchmark.run_benchmark(app, steps)
+
+    assert result['errors'] == 0
+    assert stub.calls == len(steps)
+    registered = {name for role in ('guest', 'team', 'admin') for name in app.router.names(role)}
+    assert registered <= set(result['commands'])
+    assert result['commands']['查看卡牌']['queries'] is not None
+
+    lines = benchmark.report('smoke', result).splitlines()
+    assert lines[0].startswith(f"== smoke: {len(steps)} requests")
+    assert len(lines) == 2 + len(result['commands'])
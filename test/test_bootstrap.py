@@ -0,0 +1,54 @@
+import pytest
+
+import bootstrap
+
+
+def test_bootstrap_runs_once_per_fingerprint(app_module):
+    app = app_module
+    calls = []
+
+    assert bootstrap.run_once(app.engine, 'test', 'a', [lambda: calls.append('a')])
+    assert not bootstrap.run_once(app.engine, 'test', 'a', [lambda: calls.append('again')])
+    assert bootstrap.run_once(app.engine, 'test', 'b', [lambda: calls.append('b')])
+    assert calls == ['a', 'b']
+
+
+def test_failed_bootstrap_is_retried(app_module):
+    app = app_module
+
+    def boom():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError, match='boom'):
+        bootstrap.run_once(app.engine, 'test', 'a', [boom])
+    calls = []
+    assert bootstrap.run_once(app.engine, 'test', 'a', [lambda: calls.append(1)])
+    assert calls == [1]
+
+
+def test_app_bootstrap_is_skipped_when_already_done(app_module):
+    app = app_module
+    assert app.bootstrap() is False
+    assert app.credential_index.lookup('team', 'team_pass1') == '隊伍-1'
+
+
+def test_support_tables_are_created_by_bootstrap_only(app_module, tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from dedup import EventDeduplicator
+    from ratelimit import SqlRateLimiter
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from scheduler_leader import BootstrappedJobStore, LeaderLease
+    from versions import StateVersions
+
+    app = app_module
+    assert {t.name for t in app.SUPPORT_TABLES} <= set(inspect(app.engine).get_table_names())
+
+    # Building the per-process objects issues no DDL of its own
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    StateVersions(fresh)
+    EventDeduplicator(engine=fresh)
+    SqlRateLimiter(fresh)
+    LeaderLease(fresh, 'test')
+    BootstrappedJobStore(fresh).start(BackgroundScheduler(), 'announcements')
+    assert inspect(fresh).get_table_names() == []
+    fresh.dispose()
@@ -0,0 +1,109 @@
+from broadcast import Broadcaster
+from test.line_stub import FakeLineBotApi
+
+
+def test_recipients_are_deduped_and_batched():
+    api = FakeLineBotApi()
+    broadcaster = Broadcaster(api, pool_size=3, batch_size=500, sleep=lambda s: None)
+    user_ids = [f'U{i}' for i in range(1200)] + ['U0', 'U1', None]
+
+    report = broadcaster.send(user_ids, 'hello')
+
+    assert report.recipients == 1200
+    assert report.sent == 1200
+    assert sorted(len(call[0]) for call in api.calls['multicast']) == [200, 500, 500]
+    sent_ids = [uid for call in api.calls['multicast'] for uid in call[0]]
+    assert len(sent_ids) == len(set(sent_ids)) == 1200
+
+
+def test_retryable_errors_are_retried_with_the_same_retry_key():
+    api = FakeLineBotApi(failures={('multicast', 1): 429, ('multicast', 2): 503})
+    delays = []
+    broadcaster = Broadcaster(api, pool_size=1, backoff=0.5, sleep=delays.append)
+
+    report = broadcaster.send(['U1', 'U2'], 'hello')
+
+    assert report.sent == 2
+    assert report.batches[0].attempts == 3
+    assert delays == [0.5, 1.0]
+    assert len({call[2] for call in api.calls['multicast']}) == 1
+
+
+def test_client_errors_are_not_retried():
+    api = FakeLineBotApi(failures={('multicast', 1): 400})
+    broadcaster = Broadcaster(api, sleep=lambda s: None)
+
+    report = broadcaster.send(['U1'], 'hello')
+
+    assert report.failed == 1
+    assert report.batches[0].attempts == 1
+
+
+def test_broadcast_announcement_uses_multicast(app_module, fake_line_api, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app.broadcaster, 'api', fake_line_api)
+    session = app.Session()
+    announcement = app.Announcement(message='集合')
+    session.add(announcement)
+    session.add(app.User(user_id='Ureal', role='guest'))
+    session.commit()
+    announcement_id = announcement.id
+    session.close()
+
+    app.send_announcement(announcement_id)
+
+    assert [call[0] for call in fake_line_api.calls['multicast']] == [['Ureal']]
+    assert fake_line_api.calls['push_message'] == []
+    session = app.Session()
+    assert session.get(app.Announcement, announcement_id).sent
+    session.close()
+
+
+def test_targeted_announcement_skips_placeholders_and_other_teams(app_module, send_text, fake_line_api, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app.broadcaster, 'api', fake_line_api)
+    send_text('Ugm', '管理員密碼 gm_pass1')
+    send_text('Ua1', '密碼 team_pass1')
+    send_text('Ua2', '密碼 team_pass1')
+    send_text('Ub1', '密碼 team_pass2')
+    send_text('Uguest', '你好')
+
+    assert send_text('Ugm', '發布定向公告 隊伍:隊伍-team_pass1,scope:game_master 2099-01-01 10:00 集合') == [
+        '公告已成功安排於 2099-01-01 10:00 發送給 team:隊伍-team_pass1,scope:game_master。']
+    assert send_text('Ugm', '發布定向公告 role:boss 2099-01-01 10:00 集合') == ['無效的角色：boss (可用：guest, team, admin)']
+    session = app.Session()
+    announcement = session.query(app.Announcement).one()
+    session.close()
+
+    app.send_announcement(announcement.id)
+    assert sorted(uid for call in fake_line_api.calls['multicast'] for uid in call[0]) == ['Ua1', 'Ua2', 'Ugm']
+
+    # Everyone means every real user; the seeded placeholder accounts are never contacted
+    assert app.resolve_audience() == ['Ua1', 'Ua2', 'Ub1', 'Ugm']
+    send_text('Ub2', '密碼 team_pass2')
+    assert app.resolve_audience('team:隊伍-team_pass2') == ['Ub1', 'Ub2']
+
+
+class _RecordingHttpClient:
+    """linebot HttpClient stand-in that records request headers and answers 200."""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.requests = []
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        self.requests.append((url, dict(headers)))
+        return type('Response', (), {'status_code': 200, 'headers': {}, 'json': {}})()
+
+
+def test_retry_key_does_not_leak_into_later_calls():
+    from linebot import LineBotApi
+    from linebot.models import TextSendMessage
+
+    api = LineBotApi('token', http_client=_RecordingHttpClient)
+    Broadcaster(api, sleep=lambda s: None).send(['U1', 'U2'], TextSendMessage(text='hello'))
+    api.push_message('U1', TextSendMessage(text='later'))
+
+    (multicast_url, multicast_headers), (push_url, push_headers) = api.http_client.requests
+    assert multicast_url.endswith('/multicast') and 'X-Line-Retry-Key' in multicast_headers
+    assert push_url.endswith('/push') and 'X-Line-Retry-Key' not in push_headers
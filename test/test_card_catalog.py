@@ -0,0 +1,39 @@
+from sqlalchemy import event
+
+
+def test_new_card_is_added_with_a_single_commit(app_module):
+    app = app_module
+    session = app.Session()
+    user = session.query(app.User).filter_by(role='team').first()
+    commits = []
+    event.listen(app.engine, 'commit', lambda conn: commits.append(1))
+
+    app.add_card_to_team(session, user, '火', 2)
+    session.close()
+
+    assert len(commits) == 1
+    entry = app.card_catalog.get('火')
+    assert entry is not None and entry.name_zh == '火'
+
+
+def test_cached_cards_cost_no_queries(app_module):
+    app = app_module
+    session = app.Session()
+    app.find_or_create_card(session, '水')
+    session.commit()
+
+    statements = []
+    event.listen(app.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    assert app.find_or_create_card(session, '水').name_zh == '水'
+    assert statements == []
+    session.close()
+
+
+def test_rolled_back_cards_are_not_published(app_module):
+    app = app_module
+    session = app.Session()
+    app.find_or_create_card(session, '雷')
+    session.rollback()
+    session.close()
+
+    assert app.card_catalog.get('雷') is None
@@ -0,0 +1,55 @@
+from commands import COMMANDS_TOTAL, CommandContext, CommandRouter, UsageError, integer
+
+
+def test_router_splits_arguments_and_reports_usage():
+    router = CommandRouter()
+    calls = []
+
+    @router.command('team', '新增卡牌', args=(str, integer), usage='usage')
+    def add(ctx, name, qty):
+        calls.append((name, qty))
+        return 'ok'
+
+    @router.command('team', '查看卡牌')
+    def view(ctx):
+        return 'cards'
+
+    @router.fallback('team')
+    def fallback(ctx):
+        return 'help'
+
+    def send(text):
+        return router.dispatch('team', CommandContext('U1', None, text))
+
+    assert send('新增卡牌 火龍 3') == 'ok'
+    assert send('新增卡牌 火龍 x') == 'usage'
+    assert send('新增卡牌 火龍') == 'usage'
+    assert send('查看卡牌') == 'cards'
+    assert send('查看卡牌 全部') == 'help'
+    assert send('你好') == 'help'
+    assert router.dispatch('admin', CommandContext('U1', None, '查看卡牌')) is None
+    assert calls == [('火龍', 3)]
+    assert COMMANDS_TOTAL.value(command='新增卡牌', outcome='usage') >= 2
+
+
+def test_usage_error_message_overrides_usage():
+    router = CommandRouter()
+
+    @router.command('admin', '取消公告', args=(integer,), usage='usage')
+    def cancel(ctx, announcement_id):
+        raise UsageError(f'找不到 {announcement_id}')
+
+    assert router.dispatch('admin', CommandContext('U1', None, '取消公告 7')) == '找不到 7'
+
+
+def test_announcement_time_includes_the_clock_time(app_module, send_text):
+    app = app_module
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+
+    assert send_text('Uadmin', '發布公告 2099-01-01 10:00 集合囉 大家') == ['公告已成功安排於 2099-01-01 10:00 發送。']
+    session = app.Session()
+    announcement = session.query(app.Announcement).one()
+    session.close()
+    assert announcement.message == '集合囉 大家'
+    assert send_text('Uadmin', '發布公告 明天 集合') == ['請輸入有效的指令格式：發布公告 [時間(YYYY-MM-DD HH:MM)] [訊息]']
+    assert send_text('Uadmin', '管理員指令')[0].startswith('管理員指令列表：')
@@ -0,0 +1,59 @@
+from sqlalchemy import event, inspect
+
+
+def test_seeding_is_bulk_and_idempotent(app_module):
+    app = app_module
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(app.engine, 'before_cursor_execute', listener)
+    try:
+        app.add_initial_data()
+    finally:
+        event.remove(app.engine, 'before_cursor_execute', listener)
+
+    # Everything was already seeded at import: the seeding version and the
+    # accounts are read, nothing is inserted
+    assert len(statements) == 2
+    session = app.Session()
+    assert session.query(app.User).filter_by(role='team').count() == len(app.load_passwords('team_passwords.txt'))
+    session.close()
+
+    index_names = {ix['name'] for ix in inspect(app.engine).get_indexes('users')}
+    assert {'ix_users_role_team_password', 'ix_users_role_admin_password'} <= index_names
+
+
+def test_login_lookup_uses_index(app_module):
+    app = app_module
+    assert app.find_credential('team', 'team_pass1') == '隊伍-1'
+    assert app.find_credential('admin', 'gm_pass1') == 'game_master'
+    assert app.find_credential('team', 'gm_pass1') is None
+    assert app.find_credential('admin', 'nope') is None
+
+
+def test_wrong_passwords_cost_no_query_until_seeding_changes(app_module):
+    app = app_module
+    assert app.find_credential('team', 'guess0') is None  # first miss checks the version
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(app.engine, 'before_cursor_execute', listener)
+    try:
+        for i in range(1, 20):
+            assert app.find_credential('team', f'guess{i}') is None
+        assert statements == []
+
+        # Another worker seeds a new account
+        session = app.Session()
+        session.add(app.User(user_id='team_placeholder_new', role='team', team_name='隊伍-new', team_password='fresh'))
+        app.state_versions.bump(session, 'credentials')
+        session.commit()
+        session.close()
+        statements.clear()
+
+        assert app.find_credential('team', 'fresh') is None  # within the recheck interval
+        app._credentials_checked_at -= app.CREDENTIAL_RECHECK_INTERVAL
+        assert app.find_credential('team', 'fresh') == '隊伍-new'
+        assert app.find_credential('team', 'fresh') == '隊伍-new'
+        assert len(statements) == 3  # version check, version + accounts reload
+    finally:
+        event.remove(app.engine, 'before_cursor_execute', listener)
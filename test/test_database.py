@@ -0,0 +1,48 @@
+import database
+
+
+def test_sqlite_file_engine_uses_wal_and_busy_timeout(tmp_path, monkeypatch):
+    monkeypatch.setenv('SQLITE_BUSY_TIMEOUT_MS', '1234')
+    engine = database.build_engine(f"sqlite:///{tmp_path / 'wal.db'}")
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 1234
+        assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1  # NORMAL
+
+    stats = database.pool_stats(engine)
+    assert isinstance(engine.pool, database.InstrumentedQueuePool)
+    assert stats['checked_out'] == 0
+    assert stats['wait']['count'] >= 1
+    engine.dispose()
+
+
+def test_pool_settings_come_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '7')
+    monkeypatch.setenv('DB_MAX_OVERFLOW', '3')
+    engine = database.build_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    assert engine.pool.size() == 7
+    assert engine.pool._max_overflow == 3
+
+    # In-memory SQLite keeps SQLAlchemy's per-thread pool
+    assert not isinstance(database.build_engine('sqlite:///:memory:').pool, database.InstrumentedQueuePool)
+
+
+def test_missing_nullable_columns_are_added_to_existing_tables(tmp_path):
+    from sqlalchemy import Column, Integer, MetaData, String, Table, inspect
+
+    engine = database.build_engine(f"sqlite:///{tmp_path / 'columns.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE announcements (id INTEGER PRIMARY KEY, message VARCHAR(500) NOT NULL)")
+        conn.exec_driver_sql("INSERT INTO announcements (message) VALUES ('舊公告')")
+    metadata = MetaData()
+    Table('announcements', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('message', String(500), nullable=False),
+          Column('audience', String(500), nullable=True))
+
+    assert database.ensure_columns(engine, metadata) == ['announcements.audience']
+    assert database.ensure_columns(engine, metadata) == []
+    assert 'audience' in {c['name'] for c in inspect(engine).get_columns('announcements')}
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT audience FROM announcements").scalar() is None
+    engine.dispose()
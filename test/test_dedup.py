@@ -0,0 +1,46 @@
+from linebot.models import MessageEvent
+
+from dedup import DUPLICATES, EventDeduplicator, event_key
+
+
+def _event(message_id, text, webhook_event_id=None):
+    payload = {
+        'type': 'message', 'replyToken': 'token', 'timestamp': 0, 'mode': 'active',
+        'source': {'type': 'user', 'userId': 'Uteam'},
+        'message': {'type': 'text', 'id': message_id, 'text': text},
+    }
+    if webhook_event_id:
+        payload['webhookEventId'] = webhook_event_id
+        payload['deliveryContext'] = {'isRedelivery': False}
+    return MessageEvent.new_from_json_dict(payload)
+
+
+def test_event_key_prefers_webhook_event_id():
+    assert event_key(_event('42', 'x', '01HABC')) == '01HABC'
+    assert event_key(_event('42', 'x')) == 'message:42'
+
+
+def test_redelivered_event_is_applied_once(app_module, fake_line_api, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'line_bot_api', fake_line_api)
+    app.handle_message(_event('100', '密碼 team_pass1', '01HLOGIN'))
+    before = DUPLICATES.value(store='memory')
+
+    app.handle_message(_event('101', '新增卡牌 火龍 2', '01HADD'))
+    app.handle_message(_event('101', '新增卡牌 火龍 2', '01HADD'))
+
+    user = app.get_user('Uteam')
+    assert app.get_team_inventory(user.id) == [('火龍', 2)]
+    assert len(fake_line_api.calls['reply_message']) == 2
+    assert DUPLICATES.value(store='memory') == before + 1
+
+
+def test_sql_store_is_shared_and_forgets_failures(app_module):
+    worker_a = EventDeduplicator(engine=app_module.engine)
+    worker_b = EventDeduplicator(engine=app_module.engine)
+    assert worker_a.claim('01HX')
+    assert not worker_b.claim('01HX')
+    assert not worker_a.claim('01HX')
+
+    worker_a.forget('01HX')
+    assert worker_a.claim('01HX')
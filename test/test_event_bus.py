@@ -0,0 +1,63 @@
+import json
+
+from event_bus import EventBus
+
+
+def _events(chunk):
+    """(event, data) pairs in one chunk of an SSE stream."""
+    found = []
+    for block in chunk.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            found.append((fields['event'], json.loads(fields['data'])))
+    return found
+
+
+def test_slow_subscriber_loses_oldest_events_without_blocking():
+    bus = EventBus(clock=lambda: 0)
+    slow = bus.subscribe(maxsize=2)
+    trades_only = bus.subscribe(types={'trade'})
+    for n in range(5):
+        bus.publish('inventory', n=n)
+    bus.publish('trade', n=5)
+
+    assert [data['n'] for _, data in _events(''.join(slow.get(timeout=0)))] == [4, 5]
+    assert slow.take_dropped() == 4
+    assert _events(''.join(trades_only.get(timeout=0))) == [('trade', {'n': 5, 'at': 0})]
+    assert slow.get(timeout=0) == []
+
+
+def test_reconnect_replays_events_after_last_event_id():
+    bus = EventBus(history=3)
+    for n in range(5):
+        bus.publish('inventory', n=n)
+    replayed = bus.subscribe(last_event_id=3)
+    assert [data['n'] for _, data in _events(''.join(replayed.get(timeout=0)))] == [3, 4]
+    bus.unsubscribe(replayed)
+    assert len(bus) == 0
+
+
+def test_stream_pushes_game_changes(app_module, api_client, send_text, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'SSE_HEARTBEAT', 0.01)
+    assert app.app.test_client().get('/events').status_code == 401
+    assert len(app.event_bus) == 0
+    response = api_client.get('/events?types=inventory,mission_completed', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = (chunk.decode('utf-8') for chunk in response.response)
+    assert next(chunks).startswith('retry:')
+    assert next(chunks) == ': keep-alive\n\n'
+
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+    send_text('Uadmin', '添加任務 M1 尋寶 找到寶藏')
+    send_text('Uteam', '密碼 team_pass1')
+    send_text('Uteam', '新增卡牌 火 2')
+    send_text('Uteam', '完成任務 M1')
+
+    events = _events(next(chunks))
+    assert [kind for kind, _ in events] == ['inventory', 'mission_completed']
+    assert events[0][1]['changes'] == {'火': 2}
+    assert events[1][1]['team'] == '隊伍-team_pass1'
+    assert len(app.event_bus) == 1
+    response.close()
+    assert len(app.event_bus) == 0
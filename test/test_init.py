@@ -10,6 +10,8 @@ def test_db_initialization(monkeypatch):
     if 'app' in globals():
         importlib.reload(globals()['app'])
     import app
+    import database
+    importlib.reload(database)  # fresh engine and metadata for the new URL
     importlib.reload(app)  # ensure reload with new env vars
 
     inspector = inspect(app.engine)
@@ -0,0 +1,67 @@
+from sqlalchemy import event, text
+
+
+def test_inventory_is_one_query_and_cached_until_changed(app_module, send_text):
+    app = app_module
+    send_text('U1', '密碼 team_pass1')
+    send_text('U1', '新增卡牌 火 2')
+    send_text('U1', '新增卡牌 水 1')
+
+    statements = []
+    event.listen(app.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    assert send_text('U1', '查看卡牌') == ['水: 1\n火: 2']
+    assert len(statements) == 2  # version check + inventory
+    assert send_text('U1', '查看卡牌') == ['水: 1\n火: 2']
+    assert len(statements) == 3  # version check only
+
+    send_text('U1', '刪除卡牌 火 2')
+    assert send_text('U1', '查看卡牌') == ['水: 1']
+
+    # A trade confirmed on another worker: rows and version change, this
+    # worker's cache is not told
+    session = app.Session()
+    session.execute(text("UPDATE team_cards SET quantity = 5"))
+    app.state_versions.bump(session, 'inventory')
+    session.commit()
+    session.close()
+    assert send_text('U1', '查看卡牌') == ['水: 5']
+
+
+def test_empty_inventory(send_text):
+    send_text('U1', '密碼 team_pass1')
+    assert send_text('U1', '查看卡牌') == ['隊伍-team_pass1 目前沒有任何卡牌。']
+
+
+def test_bulk_card_changes_are_one_transaction(app_module, send_text):
+    app = app_module
+    send_text('U1', '密碼 team_pass1')
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+
+    commits = []
+    event.listen(app.engine, 'commit', lambda conn: commits.append(1))
+    assert send_text('U1', '批量新增卡牌 火:2 水：3 火:1') == ['已為 隊伍-team_pass1 新增 火 x3、水 x3。']
+    assert len(commits) == 1
+    assert send_text('Uadmin', '批量新增卡牌 隊伍-team_pass1 土:1 水:1') == ['已為 隊伍-team_pass1 新增 土 x1、水 x1。']
+    assert send_text('U1', '查看卡牌') == ['土: 1\n水: 4\n火: 3']
+
+    # One short removal rejects the whole batch
+    assert send_text('U1', '批量刪除卡牌 火:3 水:9') == ['卡牌數量不足或不存在。']
+    assert send_text('U1', '批量刪除卡牌 火:3 水:1') == ['已從 隊伍-team_pass1 刪除 火 x3、水 x1。']
+    assert send_text('U1', '查看卡牌') == ['土: 1\n水: 3']
+    assert send_text('U1', '批量新增卡牌 火') == ['指令格式：批量新增卡牌 [卡片名稱:數量] [卡片名稱:數量] ...']
+    assert send_text('Uadmin', '批量刪除卡牌 不存在 火:1') == ['找不到指定隊伍。']
+
+
+def test_duplicate_holdings_are_merged(app_module):
+    app = app_module
+    session = app.Session()
+    session.execute(text('DROP INDEX ux_team_cards_team_card'))
+    session.add_all([app.TeamCard(team_id=1, card_id=1, quantity=2), app.TeamCard(team_id=1, card_id=1, quantity=3)])
+    session.commit()
+    session.close()
+
+    assert app.merge_duplicate_team_cards() == 1
+    app.ensure_indexes(app.engine, app.Base.metadata)
+    session = app.Session()
+    assert [tc.quantity for tc in session.query(app.TeamCard)] == [5]
+    session.close()
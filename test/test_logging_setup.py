@@ -0,0 +1,56 @@
+import io
+import json
+import logging
+
+from logging_setup import JsonFormatter, SamplingFilter, configure_logging, parse_level, request_id
+
+
+def _record(level, msg='hello', **extra):
+    record = logging.LogRecord('test', level, __file__, 1, msg, (), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_correlation_and_extra_fields():
+    line = JsonFormatter().format(_record(logging.INFO, request_id='abc', body_bytes=12))
+    entry = json.loads(line)
+    assert entry['message'] == 'hello'
+    assert entry['request_id'] == 'abc'
+    assert entry['body_bytes'] == 12
+
+
+def test_sampling_keeps_whole_requests_and_all_warnings():
+    sampler = SamplingFilter(rate=0.5)
+    kept = [rid for rid in (f'req-{i}' for i in range(400)) if sampler.filter(_record(logging.INFO, request_id=rid))]
+    assert 100 < len(kept) < 300
+    assert all(sampler.filter(_record(logging.INFO, request_id=rid)) for rid in kept)
+    assert SamplingFilter(rate=0).filter(_record(logging.WARNING, request_id='x'))
+    assert not SamplingFilter(rate=0).filter(_record(logging.INFO, request_id='x'))
+
+
+def test_records_are_written_by_a_native_thread():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    listener = configure_logging('json', stream=stream)
+    try:
+        token = request_id.set('req-1')
+        logging.getLogger('test.queue').info("queued %s", 'message', extra={'user': 'U1'})
+        request_id.reset(token)
+        listener.stop()
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+    entry = json.loads(stream.getvalue().splitlines()[-1])
+    assert entry['message'] == 'queued message'
+    assert entry['request_id'] == 'req-1'
+    assert entry['user'] == 'U1'
+
+
+def test_unknown_level_names_fall_back_to_the_default():
+    assert parse_level('info', logging.DEBUG) == logging.INFO
+    assert parse_level(' Warning ') == logging.WARNING
+    assert parse_level('15') == 15
+    assert parse_level('VERBOSE', logging.DEBUG) == logging.DEBUG
+    assert parse_level(None, logging.DEBUG) == logging.DEBUG
@@ -0,0 +1,40 @@
+from messaging import (LINE_API_REQUESTS, MAX_REPLY_MESSAGES, TRUNCATED_NOTICE, PooledHttpClient,
+                       build_reply)
+
+
+def test_build_reply_splits_and_coalesces():
+    assert [m.text for m in build_reply('你好')] == ['你好']
+
+    # Seven short parts fit in fewer bubbles once merged
+    messages = build_reply([f'line {i}' for i in range(7)], limit=20)
+    assert len(messages) <= MAX_REPLY_MESSAGES
+    assert '\n'.join(m.text for m in messages) == '\n'.join(f'line {i}' for i in range(7))
+
+
+def test_build_reply_truncates_with_a_notice():
+    text = '\n'.join('x' * 90 for _ in range(20))
+    messages = build_reply(text, limit=100)
+    assert len(messages) == MAX_REPLY_MESSAGES
+    assert all(len(m.text) <= 100 for m in messages)
+    assert messages[-1].text.endswith(TRUNCATED_NOTICE)
+
+
+def test_pooled_client_reuses_one_session(monkeypatch):
+    client = PooledHttpClient(timeout=3)
+    calls = []
+
+    class Response:
+        status_code = 200
+        headers = {}
+
+    def request(method, url, timeout=None, **kwargs):
+        calls.append((method, url, timeout))
+        return Response()
+
+    monkeypatch.setattr(client.session, 'request', request)
+    before = LINE_API_REQUESTS.value(method='POST', status=200)
+    client.post('https://api.line.me/v2/bot/message/reply', data='{}')
+    client.post('https://api.line.me/v2/bot/message/reply', data='{}', timeout=1)
+    assert calls == [('POST', 'https://api.line.me/v2/bot/message/reply', 3),
+                     ('POST', 'https://api.line.me/v2/bot/message/reply', 1)]
+    assert LINE_API_REQUESTS.value(method='POST', status=200) == before + 2
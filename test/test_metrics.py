@@ -0,0 +1,53 @@
+import os
+import time
+
+from metrics import Registry, collect, render_text, snapshot, write_snapshot
+
+
+def _worker_registry(requests, depth):
+    registry = Registry()
+    registry.counter('jobs_total', 'Jobs', labelnames=('kind',)).inc(requests, kind='a')
+    registry.gauge('queue_depth', 'Depth').set(depth)
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0)).observe(0.5)
+    return registry
+
+
+def test_render_text_histogram_is_cumulative():
+    text = render_text(collect(registry=_worker_registry(3, 2)))
+    assert '# TYPE jobs_total counter\njobs_total{kind="a"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{le="1.0"} 1' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in text
+    assert 'latency_seconds_count 1' in text
+
+
+def test_collect_merges_other_workers(tmp_path):
+    live_peer = os.getppid()
+    dead_peer = 2 ** 22 + 12345
+    write_snapshot(str(tmp_path), _worker_registry(5, 4), pid=live_peer, token='a')
+    write_snapshot(str(tmp_path), _worker_registry(7, 100), pid=dead_peer, token='a')
+    # An earlier process that had this pid, and a live one that stopped writing
+    write_snapshot(str(tmp_path), _worker_registry(9, 9), pid=os.getpid(), token='old')
+    write_snapshot(str(tmp_path), _worker_registry(11, 11), pid=live_peer, token='b')
+    stale = tmp_path / f'{live_peer}-b.json'
+    os.utime(stale, (time.time() - 60, time.time() - 60))
+
+    merged = collect(str(tmp_path), registry=_worker_registry(1, 1), max_age=15)
+    assert dict(merged['jobs_total']['samples']) == {('a',): 6}
+    assert dict(merged['queue_depth']['samples']) == {(): 5}
+    assert dict(merged['latency_seconds']['samples'])[()]['buckets'] == [0, 2]
+    # Files of workers that are gone are cleaned up
+    assert sorted(os.listdir(tmp_path)) == [f'{live_peer}-a.json']
+    assert snapshot(_worker_registry(1, 1))['queue_depth']['kind'] == 'gauge'
+
+
+def test_metrics_endpoint_reports_commands_and_queries(app_module, send_text):
+    send_text('Uteam', '密碼 team_pass1')
+    send_text('Uteam', '查看卡牌')
+
+    response = app_module.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'bot_command_seconds_count{command="查看卡牌"}' in text
+    assert 'db_queries_total{command="查看卡牌"}' in text
+    assert '# TYPE http_request_seconds histogram' in text
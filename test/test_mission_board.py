@@ -0,0 +1,59 @@
+from sqlalchemy import event
+
+from messaging import split_text
+
+
+def test_split_text_breaks_on_lines():
+    text = '\n'.join(['a' * 40] * 10)
+    chunks = split_text(text, limit=100)
+    assert all(len(c) <= 100 for c in chunks)
+    assert '\n'.join(chunks) == text
+    assert split_text('x' * 250, limit=100) == ['x' * 100, 'x' * 100, 'x' * 50]
+
+
+def test_board_is_cached_until_a_mission_changes(app_module, send_text):
+    app = app_module
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+    send_text('Uteam', '密碼 team_pass1')
+    assert send_text('Uteam', '查看任務') == ['目前沒有任何任務。']
+    send_text('Uadmin', '添加任務 m1 尋寶 找到寶藏')
+
+    assert send_text('Uteam', '查看任務') == ['目前任務列表：\n代碼：M1, 名稱：尋寶, 狀態：⏳ 未完成']
+    statements = []
+    event.listen(app.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    send_text('Uteam', '查看任務')
+    # Only the version check; the board itself comes from the cache
+    assert len(statements) == 1 and 'state_versions' in statements[0]
+
+    send_text('Uteam', '完成任務 m1')
+    board = send_text('Uadmin', '查看所有任務')
+    assert board[0].startswith('所有任務列表：\n代碼：M1, 名稱：尋寶, 狀態：✅ 已完成\n  完成時間：')
+    assert board[0].endswith('完成隊伍：隊伍-team_pass1')
+
+
+def test_long_boards_are_split_into_bubbles(app_module, send_text):
+    app = app_module
+    session = app.Session()
+    session.add_all([app.Mission(mission_code=f'M{i:03}', name='任' * 90, description='') for i in range(120)])
+    session.commit()
+    session.close()
+    send_text('Uteam', '密碼 team_pass1')
+
+    bubbles = send_text('Uteam', '查看任務')
+    assert len(bubbles) == 3
+    assert all(len(b) <= 5000 for b in bubbles)
+
+
+def test_change_on_another_worker_is_seen_at_once(app_module, send_text):
+    app = app_module
+    send_text('Uteam', '密碼 team_pass1')
+    assert send_text('Uteam', '查看任務') == ['目前沒有任何任務。']
+
+    # Another worker adds a mission: new row and bumped version, local cache untouched
+    session = app.Session()
+    session.add(app.Mission(mission_code='M1', name='尋寶', description=''))
+    app.state_versions.bump(session, 'missions')
+    session.commit()
+    session.close()
+
+    assert send_text('Uteam', '查看任務') == ['目前任務列表：\n代碼：M1, 名稱：尋寶, 狀態：⏳ 未完成']
@@ -0,0 +1,69 @@
+import os
+import time
+
+from sqlalchemy import event
+
+
+def _add_mission(app, code):
+    session = app.Session()
+    session.add(app.Mission(mission_code=code, name=f'任務{code}', description=''))
+    session.commit()
+    session.close()
+
+
+def test_complete_mission(app_module):
+    app = app_module
+    _add_mission(app, 'M1')
+
+    assert app.complete_mission('M1', '隊伍-1') == (True, '任務M1', '隊伍-1')
+    assert app.complete_mission('M1', '隊伍-2') == (False, '任務M1', '隊伍-1')
+    assert app.complete_mission('NOPE', '隊伍-2') == (False, None, None)
+
+
+def test_concurrent_completions_have_exactly_one_winner(app_module):
+    app = app_module
+    _add_mission(app, 'M1')
+    app.engine.dispose()
+
+    pids = []
+    for worker in range(8):
+        pid = os.fork()
+        if pid == 0:
+            status = 3
+            try:
+                app.engine.dispose(close=False)
+                event.listen(app.engine, 'before_cursor_execute', lambda *args: time.sleep(0.001))
+                won, name, team = app.complete_mission('M1', f'隊伍-{worker}')
+                status = 0 if won else 1
+            finally:
+                os._exit(status)
+        pids.append(pid)
+
+    codes = [os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) for pid in pids]
+    assert sorted(codes) == [0] + [1] * 7
+
+    winner = f'隊伍-{codes.index(0)}'
+    session = app.Session()
+    assert session.query(app.Mission).filter_by(mission_code='M1').one().completed_by_team == winner
+    session.close()
+
+
+def test_first_finisher_leaderboard(app_module, send_text):
+    app = app_module
+    for code in ('M1', 'M2', 'M3'):
+        _add_mission(app, code)
+    app.complete_mission('M1', '隊伍-2')
+    app.complete_mission('M2', '隊伍-1')
+    app.complete_mission('M3', '隊伍-2')
+
+    send_text('Uteam', '密碼 team_pass1')
+    assert send_text('Uteam', '任務排行榜') == ['任務排行榜 (最先完成)：\n1. 隊伍-2：2 個任務\n2. 隊伍-1：1 個任務']
+
+    # A completion on another worker leaves this worker's cache alone but
+    # moves the missions version
+    session = app.Session()
+    session.query(app.Mission).filter_by(mission_code='M2').update({'completed_by_team': '隊伍-2'})
+    app.state_versions.bump(session, 'missions')
+    session.commit()
+    session.close()
+    assert send_text('Uteam', '任務排行榜') == ['任務排行榜 (最先完成)：\n1. 隊伍-2：3 個任務']
@@ -0,0 +1,46 @@
+from ratelimit import THROTTLED, ConcurrencyLimit, MemoryRateLimiter, SqlRateLimiter
+
+
+def test_memory_bucket_refills_over_time():
+    now = [0.0]
+    limiter = MemoryRateLimiter(rate=1.0, burst=3, clock=lambda: now[0])
+    assert [limiter.allow('U1') for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow('U2')
+    now[0] = 1.5
+    assert limiter.allow('U1')
+    assert not limiter.allow('U1')
+    now[0] = 100
+    assert limiter.sweep() == 2
+
+
+def test_sql_buckets_are_shared(app_module):
+    now = [1000.0]
+    clock = lambda: now[0]
+    worker_a = SqlRateLimiter(app_module.engine, rate=0.5, burst=2, clock=clock)
+    worker_b = SqlRateLimiter(app_module.engine, rate=0.5, burst=2, clock=clock)
+    assert worker_a.allow('U1')
+    assert worker_b.allow('U1')
+    assert not worker_a.allow('U1')
+    now[0] += 2
+    assert worker_b.allow('U1')
+    assert not worker_a.allow('U1')
+    now[0] += 10
+    assert worker_a.sweep() == 1
+
+
+def test_concurrency_limit_does_not_block():
+    limit = ConcurrencyLimit(1)
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+    limit.release()
+    assert limit.try_acquire()
+
+
+def test_throttled_user_is_told_once(app_module, send_text, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'rate_limiter', MemoryRateLimiter(rate=0.001, burst=2))
+    before = THROTTLED.value(reason='user')
+    replies = [send_text('Uflood', '查看任務') for _ in range(5)]
+    assert replies[2] == [app.THROTTLED_REPLY]
+    assert replies[3:] == [[], []]
+    assert THROTTLED.value(reason='user') == before + 3
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+
+from scheduler_leader import LeaderLease
+
+
+def test_announcement_jobs_are_persisted(app_module):
+    app = app_module
+    assert app.SCHEDULER_PERSISTENT
+    assert app.schedule_announcement('集合', '2099-01-01 10:00')
+
+    # A fresh job store on the same database sees the job (e.g. after a restart)
+    store = SQLAlchemyJobStore(engine=app.engine, tablename='apscheduler_jobs')
+    store.start(app.scheduler, 'check')
+    jobs = store.get_all_jobs()
+    assert [job.id for job in jobs] == ['announcement_1']
+    assert jobs[0].next_run_time == datetime(2099, 1, 1, 2, 0, tzinfo=jobs[0].next_run_time.tzinfo)
+
+
+def test_unsent_announcements_are_rehydrated_once(app_module):
+    app = app_module
+    session = app.Session()
+    session.add_all([
+        app.Announcement(message='待發送', scheduled_time=datetime(2099, 1, 1)),
+        app.Announcement(message='已發送', scheduled_time=datetime(2000, 1, 1), sent=True),
+    ])
+    session.commit()
+    session.close()
+
+    assert app.rehydrate_announcements() == 1
+    assert app.rehydrate_announcements() == 0
+    assert [job.id for job in app.scheduler.get_jobs(jobstore=app.ANNOUNCEMENT_JOBSTORE)] == ['announcement_1']
+
+
+def test_only_one_process_holds_the_lease(app_module):
+    now = [datetime(2025, 1, 1)]
+    clock = lambda: now[0]
+    worker_a = LeaderLease(app_module.engine, 'test', ttl=30, holder='a', clock=clock)
+    worker_b = LeaderLease(app_module.engine, 'test', ttl=30, holder='b', clock=clock)
+
+    assert worker_a.try_acquire()
+    assert not worker_b.try_acquire()
+    now[0] += timedelta(seconds=10)
+    assert worker_a.try_acquire()
+
+    # worker_a stops renewing; the lease expires and worker_b takes over
+    now[0] += timedelta(seconds=31)
+    assert worker_b.try_acquire()
+    assert not worker_a.try_acquire()
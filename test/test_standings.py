@@ -0,0 +1,57 @@
+from sqlalchemy import event
+
+
+def test_standings_follow_missions_cards_and_trades(app_module, api_client, send_text):
+    app = app_module
+    send_text('Uadmin', '管理員密碼 gm_pass1')
+    send_text('Ua', '密碼 team_pass1')
+    send_text('Ub', '密碼 team_pass2')
+    send_text('Uadmin', '添加任務 M1 一 x')
+    send_text('Uadmin', '添加任務 M2 二 y')
+
+    send_text('Ub', '完成任務 M1')
+    send_text('Ua', '批量新增卡牌 火:3 水:2')
+    send_text('Ub', '新增卡牌 土 1')
+    send_text('Ua', '交換卡牌 隊伍-team_pass1 隊伍-team_pass2 火 2 土 1')
+    send_text('Ub', '交換卡牌 隊伍-team_pass1 隊伍-team_pass2 火 2 土 1')
+    assert app.get_standings() == [
+        {'rank': 1, 'team': '隊伍-team_pass2', 'missions_completed': 1, 'cards_held': 2,
+         'last_completion': app.get_standings()[0]['last_completion']},
+        {'rank': 2, 'team': '隊伍-team_pass1', 'missions_completed': 0, 'cards_held': 4, 'last_completion': None},
+    ]
+
+    send_text('Uadmin', '重置任務 M1')
+    send_text('Ua', '完成任務 M2')
+    assert send_text('Ua', '排行榜') == ['隊伍排行榜：\n1. 隊伍-team_pass1：任務 1 個，卡牌 4 張\n2. 隊伍-team_pass2：任務 0 個，卡牌 2 張']
+
+    # Reading is served from the cache; a rebuild from scratch agrees with the running totals
+    statements = []
+    event.listen(app.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+    assert send_text('Ub', '排行榜')[0].startswith('隊伍排行榜：')
+    assert len(statements) == 1 and 'state_versions' in statements[0]
+    before = api_client.get('/api/standings').get_json()
+    app.rebuild_standings()
+    assert app.get_standings() == before
+
+
+def test_placeholder_filter_does_not_treat_underscores_as_wildcards(app_module, send_text):
+    app = app_module
+    # An unescaped LIKE '%_placeholder_%' would match this real LINE id
+    send_text('Uxplaceholderx', '密碼 team_pass1')
+
+    app.rebuild_standings()
+    assert [row['team'] for row in app.get_standings()] == ['隊伍-team_pass1']
+    assert app.resolve_audience('team:隊伍-team_pass1') == ['Uxplaceholderx']
+
+
+def test_change_on_another_worker_reaches_the_cached_standings(app_module, send_text):
+    app = app_module
+    send_text('Ua', '密碼 team_pass1')
+    assert send_text('Ua', '排行榜') == ['隊伍排行榜：\n1. 隊伍-team_pass1：任務 0 個，卡牌 0 張']
+
+    session = app.Session()
+    app.bump_standing(session, '隊伍-team_pass1', cards=3)
+    app.state_versions.bump(session, 'inventory')
+    session.commit()
+    session.close()
+    assert send_text('Ua', '排行榜') == ['隊伍排行榜：\n1. 隊伍-team_pass1：任務 0 個，卡牌 3 張']
@@ -0,0 +1,94 @@
+import os
+import time
+
+from sqlalchemy import event
+
+
+def _seed(app, teams, cards, quantity):
+    session = app.Session()
+    users = [app.User(user_id=f'U-{name}', role='team', team_name=name) for name in teams]
+    card_rows = [app.Card(card_number=name, name_zh=name) for name in cards]
+    session.add_all(users + card_rows)
+    session.flush()
+    for user in users:
+        for card in card_rows:
+            session.add(app.TeamCard(team_id=user.id, card_id=card.id, quantity=quantity))
+    session.commit()
+    session.close()
+
+
+def _holdings(app):
+    session = app.Session()
+    rows = (session.query(app.User.team_name, app.Card.name_zh, app.TeamCard.quantity)
+            .join(app.TeamCard, app.TeamCard.team_id == app.User.id)
+            .join(app.Card, app.Card.id == app.TeamCard.card_id).all())
+    session.close()
+    return {(team, card): qty for team, card, qty in rows}
+
+
+def test_trade_swaps_cards_in_one_commit(app_module):
+    app = app_module
+    _seed(app, ['A', 'B'], ['火', '水'], 2)
+    commits = []
+    event.listen(app.engine, 'commit', lambda conn: commits.append(1))
+
+    assert app.execute_trade('A', '火', 2, 'B', '水', 1) == (True, None)
+    assert len(commits) == 1
+    assert _holdings(app) == {('A', '水'): 3, ('B', '火'): 4, ('B', '水'): 1}
+
+    assert app.execute_trade('A', '火', 1, 'B', '水', 1) == (False, "A 的 火 數量不足。")
+    assert app.execute_trade('A', '雷', 1, 'B', '水', 1) == (False, "A 的 雷 數量不足。")
+    assert app.execute_trade('A', '水', 1, 'Z', '水', 1) == (False, "找不到指定隊伍。")
+
+
+def test_trade_creates_rows_for_cards_a_team_did_not_hold(app_module, monkeypatch):
+    app = app_module
+    _seed(app, ['A'], ['火'], 2)
+    _seed(app, ['B'], ['水'], 2)
+
+    assert app.execute_trade('A', '火', 2, 'B', '水', 1) == (True, None)
+    assert _holdings(app) == {('A', '水'): 1, ('B', '火'): 2, ('B', '水'): 1}
+
+    # Database errors are logged, not shown to the players
+    def fail(session, deltas):
+        raise RuntimeError('duplicate key value violates unique constraint "ux_team_cards_team_card"')
+    monkeypatch.setattr(app, 'upsert_team_cards', fail)
+    assert app.execute_trade('A', '水', 1, 'B', '火', 1) == (False, "系統錯誤，請稍後再試。")
+    assert _holdings(app) == {('A', '水'): 1, ('B', '火'): 2, ('B', '水'): 1}
+
+
+def test_concurrent_trades_do_not_lose_updates(app_module):
+    app = app_module
+    teams = ['A', 'B', 'C']
+    _seed(app, teams, ['火', '水'], 40)
+    app.engine.dispose()
+
+    workers, trades_per_worker = 4, 15
+    pids = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                app.engine.dispose(close=False)
+                # Widen the race window between statements
+                event.listen(app.engine, 'before_cursor_execute', lambda *args: time.sleep(0.001))
+                for i in range(trades_per_worker):
+                    team_a = teams[(worker + i) % 3]
+                    team_b = teams[(worker + i + 1) % 3]
+                    ok, msg = app.execute_trade(team_a, '火', 1, team_b, '水', 1)
+                    if not ok:
+                        status = 1
+            except BaseException:
+                status = 2
+            finally:
+                os._exit(status)
+        pids.append(pid)
+
+    statuses = [os.waitpid(pid, 0)[1] for pid in pids]
+    assert statuses == [0] * workers
+
+    holdings = _holdings(app)
+    assert sum(q for (team, card), q in holdings.items() if card == '火') == 120
+    assert sum(q for (team, card), q in holdings.items() if card == '水') == 120
+    assert all(q > 0 for q in holdings.values())
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from trade_store import MemoryPendingTradeStore, SqlPendingTradeStore
+
+TRADE = ('隊伍-1', '火', 1, '隊伍-2', '水', 2)
+
+
+class Clock:
+    def __init__(self):
+        self.now = datetime(2025, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=['memory', 'sql'])
+def make_store(request, app_module):
+    def make(clock):
+        if request.param == 'memory':
+            return MemoryPendingTradeStore(clock=clock)
+        return SqlPendingTradeStore(app_module.Session, app_module.TradeRequest, clock=clock)
+    return make
+
+
+def test_second_team_completes_the_handshake(make_store):
+    clock = Clock()
+    store = make_store(clock)
+
+    assert store.confirm(TRADE, 'Ua') == (True, {'Ua'})
+    assert store.confirm(TRADE, 'Ua') == (False, {'Ua'})
+    assert store.confirm(TRADE, 'Ub') == (False, {'Ua', 'Ub'})
+    # Consumed: the next request starts over
+    assert store.confirm(TRADE, 'Ub') == (True, {'Ub'})
+
+
+def test_expired_requests_start_over_and_are_swept(make_store):
+    clock = Clock()
+    store = make_store(clock)
+
+    store.confirm(TRADE, 'Ua')
+    clock.now += timedelta(seconds=61)
+    assert store.confirm(TRADE, 'Ub') == (True, {'Ub'})
+
+    clock.now += timedelta(seconds=61)
+    assert store.sweep() == 1
+    assert len(store) == 0
+
+
+def test_sql_store_matches_across_workers(app_module):
+    worker_a = SqlPendingTradeStore(app_module.Session, app_module.TradeRequest)
+    worker_b = SqlPendingTradeStore(app_module.Session, app_module.TradeRequest)
+
+    assert worker_a.confirm(TRADE, 'Ua').created
+    assert worker_b.confirm(TRADE, 'Ub').user_ids == {'Ua', 'Ub'}
@@ -0,0 +1,54 @@
+from cache import CACHE_HITS, CACHE_MISSES
+
+
+def test_get_user_is_cached_until_login(app_module):
+    app = app_module
+    app.user_cache.clear()
+
+    assert app.get_user('U123') is None
+    assert app.get_user('U123') is None
+    stats = app.user_cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+    app.create_or_update_user('U123', role='team', team_name='隊伍-1', team_password='team_pass1')
+    user = app.get_user('U123')
+    assert user is not None
+    assert user.role == 'team'
+    assert app.user_cache.stats()['misses'] == 2
+
+
+def test_login_on_another_worker_is_seen_on_the_next_message(app_module):
+    app = app_module
+    app.user_cache.clear()
+    assert app.get_user('U456') is None
+
+    # What another worker's create_or_update_user() leaves behind: a new row
+    # and a bumped 'users' version, but this worker's cache untouched
+    session = app.Session()
+    session.add(app.User(user_id='U456', role='team', team_name='隊伍-1'))
+    app.state_versions.bump(session, 'users')
+    session.commit()
+    session.close()
+
+    assert app.get_user('U456').role == 'team'
+    # Logged-in users are then served from the cache without a version check
+    assert app.get_user('U456').role == 'team'
+    assert app.user_cache.stats()['hits'] == 2
+
+
+def test_user_cache_counts_are_exported_on_metrics(app_module):
+    app = app_module
+    app.user_cache.clear()
+    hits = CACHE_HITS.value(cache='user')
+    misses = CACHE_MISSES.value(cache='user')
+
+    app.get_user('U789')
+    app.get_user('U789')
+    assert CACHE_HITS.value(cache='user') == hits + 1
+    assert CACHE_MISSES.value(cache='user') == misses + 1
+
+    text = app.app.test_client().get('/metrics').get_data(as_text=True)
+    assert f'cache_hits_total{{cache="user"}} {hits + 1}' in text
+    assert f'cache_misses_total{{cache="user"}} {misses + 1}' in text
+    assert '# TYPE cache_evictions_total counter' in text
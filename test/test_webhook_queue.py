@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import gevent
+from linebot import WebhookHandler
+from linebot.models import MessageEvent, TextMessage
+
+from webhook_queue import EventDispatcher
+
+
+def _text_event(user_id, text):
+    return MessageEvent.new_from_json_dict({
+        'type': 'message',
+        'replyToken': 'token',
+        'timestamp': 0,
+        'mode': 'active',
+        'source': {'type': 'user', 'userId': user_id},
+        'message': {'type': 'text', 'id': '1', 'text': text},
+    })
+
+
+def test_events_from_one_user_stay_in_order():
+    handler = WebhookHandler('secret')
+    seen = []
+
+    @handler.add(MessageEvent, message=TextMessage)
+    def record(event):
+        gevent.sleep(0.001 if int(event.message.text) % 2 else 0)
+        seen.append((event.source.user_id, int(event.message.text)))
+
+    dispatcher = EventDispatcher(handler, workers=4, maxsize=400)
+    for i in range(50):
+        for user_id in ('Ua', 'Ub', 'Uc'):
+            assert dispatcher.submit(_text_event(user_id, str(i)))
+    while dispatcher.depth():
+        gevent.sleep(0.01)
+    gevent.sleep(0.05)
+    dispatcher.stop()
+
+    for user_id in ('Ua', 'Ub', 'Uc'):
+        assert [n for uid, n in seen if uid == user_id] == list(range(50))
+    assert dispatcher.stats()['latency']['count'] >= 150
+
+
+def test_callback_acks_before_handling(app_module, monkeypatch):
+    app = app_module
+    handled = []
+    monkeypatch.setattr(app, 'WEBHOOK_ASYNC', True)
+    monkeypatch.setattr(app.event_dispatcher, 'dispatch', lambda event, destination=None: handled.append(event))
+
+    body = json.dumps({'destination': 'bot', 'events': [{
+        'type': 'message', 'replyToken': 'token', 'timestamp': 0, 'mode': 'active',
+        'source': {'type': 'user', 'userId': 'U1'},
+        'message': {'type': 'text', 'id': '1', 'text': '查看任務'},
+    }]})
+    signature = base64.b64encode(hmac.new(b'dummy', body.encode('utf-8'), hashlib.sha256).digest()).decode()
+
+    response = app.app.test_client().post('/callback', data=body, headers={'X-Line-Signature': signature})
+    assert response.status_code == 200
+    assert handled == []
+    gevent.sleep(0.05)
+    assert len(handled) == 1
+
+    response = app.app.test_client().post('/callback', data=body, headers={'X-Line-Signature': 'bad'})
+    assert response.status_code == 400
+    app.event_dispatcher.stop()
@@ -0,0 +1,134 @@
+# trade_store.py
+import json
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import lock_for_write
+
+# Result of confirming a pending trade: `created` is True when this call
+# opened a new request, `user_ids` holds everyone who has confirmed so far.
+# Once len(user_ids) reaches the required count the entry has been consumed
+# and the caller that received it is the one that must execute the trade.
+Confirmation = namedtuple('Confirmation', ['created', 'user_ids'])
+
+
+def trade_key(normalized):
+    """Serialize a _normalize_trade() tuple into a stable string key."""
+    return json.dumps(list(normalized), ensure_ascii=False, separators=(',', ':'))
+
+
+class MemoryPendingTradeStore:
+    """Process-local pending trades; only correct with a single worker."""
+
+    def __init__(self, ttl=timedelta(minutes=1), clock=datetime.utcnow):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}  # key -> (created_at, set of user_ids)
+        self._lock = threading.Lock()
+
+    def confirm(self, normalized, user_id, required=2):
+        key = trade_key(normalized)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl:
+                entry = self._entries[key] = (now, {user_id})
+                created = True
+            else:
+                entry[1].add(user_id)
+                created = False
+            user_ids = set(entry[1])
+            if len(user_ids) >= required:
+                del self._entries[key]
+        return Confirmation(created, user_ids)
+
+    def sweep(self):
+        cutoff = self._clock() - self.ttl
+        with self._lock:
+            expired = [key for key, (created_at, _) in self._entries.items() if created_at < cutoff]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqlPendingTradeStore:
+    """Pending trades kept in the trade_requests table, shared by all workers.
+
+    Each request is one row looked up by its unique request_id (the serialized
+    trade key); confirmations are serialized with a row lock.
+    """
+
+    def __init__(self, session_factory, model, ttl=timedelta(minutes=1), clock=datetime.utcnow):
+        self.session_factory = session_factory
+        self.model = model
+        self.ttl = ttl
+        self._clock = clock
+
+    def confirm(self, normalized, user_id, required=2):
+        try:
+            return self._confirm(normalized, user_id, required)
+        except IntegrityError:
+            # Another worker inserted the same request between our lookup and
+            # insert; the retry will find and update its row.
+            return self._confirm(normalized, user_id, required)
+
+    def _confirm(self, normalized, user_id, required):
+        model = self.model
+        key = trade_key(normalized)
+        now = self._clock()
+        session = self.session_factory()
+        try:
+            lock_for_write(session)
+            row = session.query(model).filter_by(request_id=key).with_for_update().first()
+            if row is not None and (row.status != 'pending' or now - row.created_at > self.ttl):
+                session.delete(row)
+                session.flush()
+                row = None
+            if row is None:
+                row = model(
+                    request_id=key, requester_user_id=user_id, status='pending', created_at=now,
+                    confirmed_by_users=user_id, action_type='team_to_team_trade',
+                    card_a_quantity=normalized[2], card_b_quantity=normalized[5],
+                )
+                session.add(row)
+                user_ids = {user_id}
+                created = True
+            else:
+                user_ids = set(filter(None, row.confirmed_by_users.split(',')))
+                user_ids.add(user_id)
+                row.confirmed_by_users = ','.join(sorted(user_ids))
+                created = False
+            if len(user_ids) >= required:
+                session.delete(row)
+            session.commit()
+            return Confirmation(created, user_ids)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def sweep(self):
+        cutoff = self._clock() - self.ttl
+        session = self.session_factory()
+        try:
+            removed = (session.query(self.model)
+                       .filter(self.model.status == 'pending', self.model.created_at < cutoff)
+                       .delete(synchronize_session=False))
+            session.commit()
+            return removed
+        finally:
+            session.close()
+
+    def __len__(self):
+        session = self.session_factory()
+        try:
+            return session.query(self.model).filter_by(status='pending').count()
+        finally:
+            session.close()
@@ -0,0 +1,42 @@
+# versions.py
+from sqlalchemy import Column, Integer, MetaData, String, Table, select, update
+
+from database import dialect_insert
+
+_metadata = MetaData()
+state_versions = Table(
+    'state_versions', _metadata,
+    Column('resource', String(50), primary_key=True),
+    Column('version', Integer, nullable=False),
+)
+
+
+class StateVersions:
+    """A monotonically increasing version number per kind of game state.
+
+    Writers bump the resource they changed inside their own transaction, so a
+    new version becomes visible together with the data. Readers use the
+    versions as cache keys and ETags.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def bump(self, session, *resources):
+        t = state_versions
+        for resource in resources:
+            stmt = dialect_insert(session.get_bind(), t)
+            if hasattr(stmt, 'on_conflict_do_update'):
+                session.execute(stmt.values(resource=resource, version=1).on_conflict_do_update(
+                    index_elements=['resource'], set_={'version': t.c.version + 1}))
+                continue
+            updated = session.execute(update(t).where(t.c.resource == resource).values(version=t.c.version + 1))
+            if updated.rowcount == 0:
+                session.execute(t.insert().values(resource=resource, version=1))
+
+    def get(self, *resources):
+        """Return {resource: version}; resources never bumped are at 0."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(state_versions).where(state_versions.c.resource.in_(resources)))
+            versions = {row.resource: row.version for row in rows}
+        return {resource: versions.get(resource, 0) for resource in resources}
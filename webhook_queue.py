@@ -0,0 +1,127 @@
+# webhook_queue.py
+import contextvars
+import logging
+import os
+import time
+import zlib
+
+import gevent
+from gevent.queue import Queue, Full
+from linebot.exceptions import LineBotApiError
+from linebot.models import MessageEvent
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EVENTS_ENQUEUED = REGISTRY.counter(
+    'webhook_events_enqueued_total', 'Webhook events accepted onto the worker queue')
+EVENTS_REJECTED = REGISTRY.counter(
+    'webhook_events_rejected_total', 'Webhook events refused because the queue was full')
+EVENTS_FAILED = REGISTRY.counter(
+    'webhook_events_failed_total', 'Webhook events whose handler raised')
+QUEUE_DEPTH = REGISTRY.gauge(
+    'webhook_queue_depth', 'Webhook events waiting for a worker')
+QUEUE_WAIT = REGISTRY.histogram(
+    'webhook_queue_wait_seconds', 'Time an event spent queued before a worker picked it up')
+EVENT_LATENCY = REGISTRY.histogram(
+    'webhook_event_processing_seconds', 'Time spent running the handler for one event')
+
+
+def _ordering_key(event):
+    source = getattr(event, 'source', None)
+    if source is None:
+        return ''
+    return (getattr(source, 'user_id', None) or getattr(source, 'group_id', None)
+            or getattr(source, 'room_id', None) or '')
+
+
+class EventDispatcher:
+    """Run WebhookHandler callbacks on a pool of greenlets fed by bounded queues.
+
+    Every event is routed to one worker by a hash of its source, so events from
+    the same LINE user are always handled one at a time and in arrival order.
+    """
+
+    def __init__(self, handler, workers=8, maxsize=1000, put_timeout=0.5):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.put_timeout = put_timeout
+        shard_size = max(1, maxsize // self.workers)
+        self._queues = [Queue(maxsize=shard_size) for _ in range(self.workers)]
+        self._greenlets = []
+        self._pid = None
+        QUEUE_DEPTH.set_function(self.depth)
+
+    def start(self):
+        # Greenlets do not survive a fork, so (re)spawn them in each worker.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._greenlets = [gevent.spawn(self._run, q) for q in self._queues]
+
+    def stop(self):
+        gevent.killall(self._greenlets, block=False)
+        self._greenlets = []
+        self._pid = None
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def submit(self, event, destination=None):
+        """Queue one parsed event; return False if its shard stayed full."""
+        self.start()
+        index = zlib.crc32(_ordering_key(event).encode('utf-8')) % self.workers
+        try:
+            # The context carries the request's correlation id over to the worker
+            self._queues[index].put((time.perf_counter(), contextvars.copy_context(), event, destination),
+                                    timeout=self.put_timeout)
+        except Full:
+            EVENTS_REJECTED.inc()
+            return False
+        EVENTS_ENQUEUED.inc()
+        return True
+
+    def dispatch(self, event, destination=None):
+        """Invoke the handler registered for `event`, as WebhookHandler.handle() does."""
+        func = None
+        if isinstance(event, MessageEvent):
+            key = f"{event.__class__.__name__}_{event.message.__class__.__name__}"
+            func = self.handler._handlers.get(key)
+        if func is None:
+            func = self.handler._handlers.get(event.__class__.__name__)
+        if func is None:
+            func = self.handler._default
+        if func is None:
+            logger.info("No handler for %s", event.__class__.__name__)
+            return
+        func(event)
+
+    def _run(self, queue):
+        while True:
+            enqueued_at, context, event, destination = queue.get()
+            started = time.perf_counter()
+            QUEUE_WAIT.observe(started - enqueued_at)
+            try:
+                context.run(self.dispatch, event, destination)
+            except LineBotApiError as e:
+                EVENTS_FAILED.inc()
+                logger.error(f"LineBot API error: {e}")
+                if e.status_code == 401:
+                    logger.error("Authentication failed. Check LINE_CHANNEL_ACCESS_TOKEN.")
+            except Exception as e:
+                EVENTS_FAILED.inc()
+                logger.error(f"Error handling webhook event: {e}")
+            finally:
+                EVENT_LATENCY.observe(time.perf_counter() - started)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'depth': self.depth(),
+            'enqueued': EVENTS_ENQUEUED.value(),
+            'rejected': EVENTS_REJECTED.value(),
+            'failed': EVENTS_FAILED.value(),
+            'wait': QUEUE_WAIT.summary(),
+            'latency': EVENT_LATENCY.summary(),
+        }